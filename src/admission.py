@@ -0,0 +1,175 @@
+"""
+Контроль допуска запросов, чтобы пул соединений не становился безграничной очередью.
+
+Каждый HTTP-запрос относится к классу: scan (сканирование), write (операции и правки),
+heavy (выгрузки, журнал, импорт, остатки на дату, синхронизация) или read (остальные чтения).
+Запросы всех классов делят ADMISSION_TOTAL_LIMIT мест (по умолчанию размер пула primary плюс overflow
+за вычетом соединений фоновых задач: снимков остатков, сверки версий кэшей, рассылки событий остатков,
+групповой фиксации), у класса есть свой предел одновременных запросов и ограниченная очередь ожидания.
+Освободившееся место отдается ожидающим в порядке приоритета классов: scan, write, read, heavy,
+поэтому сканы не стоят за долгими выгрузками.
+
+Если очередь класса заполнена или место не освободилось за ADMISSION_MAX_WAIT_SECONDS, запрос
+сразу получает 503 с Retry-After. Такие ответы отдаются до MetricsMiddleware и не попадают
+в http_requests_total, поэтому отказы считаются отдельно: admission_rejected_total и
+admission_timed_out_total по классам в GET /metrics. Служебные и долгоживущие маршруты (метрики, потоки событий,
+состояние пула) не ограничиваются. Место держится до конца ответа, включая потоковые выгрузки.
+"""
+import asyncio
+import json
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+SCAN = "scan"
+WRITE = "write"
+READ = "read"
+HEAVY = "heavy"
+PRIORITY = (SCAN, WRITE, READ, HEAVY)
+
+_HEAVY_PREFIXES = (
+    "/api/export/", "/api/operations/log", "/api/items/import", "/api/stock/at", "/api/stock/history", "/api/sync",
+)
+_EXEMPT_PREFIXES = ("/metrics", "/ws/", "/api/stock/events", "/api/admin/db/pool", "/api/admin/admission")
+_WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    """Класс запроса или None, если запрос не ограничивается."""
+    if path.startswith(_EXEMPT_PREFIXES):
+        return None
+    if path.startswith(_HEAVY_PREFIXES):
+        return HEAVY
+    if path.startswith("/api/items/scan/"):
+        return SCAN
+    if method in _WRITE_METHODS:
+        return WRITE
+    return READ
+
+
+class Overloaded(Exception):
+    pass
+
+
+class AdmissionClass:
+    __slots__ = ("limit", "queue_limit", "active", "waiters", "admitted", "rejected", "timed_out")
+
+    def __init__(self, limit: int, queue_limit: int):
+        self.limit = limit
+        self.queue_limit = queue_limit
+        self.active = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.rejected = 0 # очередь заполнена
+        self.timed_out = 0 # не дождались места
+
+
+class AdmissionController:
+    """Семафор с приоритетами классов. Рассчитан на один event loop, поэтому обходится без блокировок."""
+
+    def __init__(self, total_limit: int, limits: Dict[str, Tuple[int, int]], max_wait: float):
+        self.total_limit = total_limit
+        self.max_wait = max_wait
+        self.active = 0
+        self.classes = {name: AdmissionClass(*limits[name]) for name in PRIORITY}
+
+    def _can_run(self, state: AdmissionClass) -> bool:
+        return self.active < self.total_limit and state.active < state.limit
+
+    def _grant(self, state: AdmissionClass) -> None:
+        self.active += 1
+        state.active += 1
+        state.admitted += 1
+
+    async def acquire(self, name: str) -> None:
+        state = self.classes[name]
+        # После каждого release ожидающие, которым хватает мест, сразу получают их (_wake), поэтому
+        # свободное место для нового запроса означает, что он никого не обгоняет
+        if self._can_run(state):
+            self._grant(state)
+            return
+        if len(state.waiters) >= state.queue_limit:
+            state.rejected += 1
+            raise Overloaded()
+        waiter = asyncio.get_running_loop().create_future()
+        state.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.max_wait)
+        except asyncio.TimeoutError:
+            if waiter.done():
+                # Место выдано одновременно с таймаутом: запрос уже допущен и выполняется
+                return
+            state.waiters.remove(waiter)
+            state.timed_out += 1
+            raise Overloaded()
+        except asyncio.CancelledError:
+            if waiter.done():
+                self.release(name)
+            else:
+                state.waiters.remove(waiter)
+            raise
+
+    def release(self, name: str) -> None:
+        state = self.classes[name]
+        self.active -= 1
+        state.active -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        for name in PRIORITY:
+            state = self.classes[name]
+            while state.waiters and self._can_run(state):
+                waiter = state.waiters.popleft()
+                self._grant(state)
+                waiter.set_result(None)
+            if self.active >= self.total_limit:
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "total_limit": self.total_limit,
+            "classes": {
+                name: {
+                    "active": state.active,
+                    "queued": len(state.waiters),
+                    "limit": state.limit,
+                    "queue_limit": state.queue_limit,
+                    "admitted": state.admitted,
+                    "rejected": state.rejected,
+                    "timed_out": state.timed_out,
+                }
+                for name, state in self.classes.items()
+            },
+        }
+
+
+class AdmissionMiddleware:
+    def __init__(self, app, controller: AdmissionController, retry_after: int):
+        self.app = app
+        self.controller = controller
+        self.body = json.dumps({"detail": "Сервер перегружен, повторите запрос позже."}, ensure_ascii=False).encode()
+        self.retry_after = str(retry_after).encode()
+
+    async def __call__(self, scope, receive, send):
+        name = classify(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.controller.acquire(name)
+        except Overloaded:
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(self.body)).encode()),
+                    (b"retry-after", self.retry_after),
+                ],
+            })
+            await send({"type": "http.response.body", "body": self.body})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(name)
@@ -0,0 +1,154 @@
+"""
+Бенчмарк горячего пути сканирования: задержки scan_item_by_code на большом каталоге.
+
+Запуск (из каталога src, нужна настроенная .env с PostgreSQL):
+    python bench_scan.py --items 1000000 --scans 20000 --user-tg-id 732334353
+
+Скрипт один раз создает локацию BENCH и N товаров с кодами BENCH-<n>, затем меряет p50/p99
+для двух режимов:
+    db     - каждый скан идет в БД (кэш сбрасывается перед каждым вызовом), индекс items.code;
+    cache  - повторные сканы горячих кодов из item_cache.
+Товары загружаются через импортер (importer.py), как обычный каталог: вместе с приемками, журналом
+остатков, location_stock и журналом изменений. Операции записываются от имени --user-tg-id.
+Флаг --cleanup удаляет тестовые данные, тоже поддерживая агрегаты и журнал изменений.
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+
+from sqlalchemy import delete, func, select, text
+
+from cache import item_cache
+from database import async_engine, async_session_factory
+from location_stock import LocationStockDelta
+from models import ItemORM, LocationORM
+from schemas import LocationCreateSchema
+import changes
+import importer
+import requests as rq
+
+BENCH_PREFIX = "BENCH-"
+BENCH_LOCATION = "BENCH"
+SEED_CHUNK_SIZE = 10_000
+# Товаров на транзакцию при удалении: журнал изменений ограничивает число записей в одной транзакции
+CLEANUP_BATCH = 10_000
+
+
+async def seed(items: int, user_tg_id: int) -> None:
+    async with async_session_factory() as session:
+        user = await rq.fetch_auth_user(user_tg_id, session)
+        if not user:
+            raise SystemExit(f"Пользователь с Telegram ID {user_tg_id} не найден.")
+        location_id = await session.scalar(
+            select(LocationORM.id).where(LocationORM.name == BENCH_LOCATION, LocationORM.parent_id.is_(None))
+        )
+        if location_id is None:
+            location = await rq.create_new_location(
+                LocationCreateSchema(name=BENCH_LOCATION, description="Локация для бенчмарка сканирования"), session,
+            )
+            location_id = location.id
+        existing = await session.scalar(
+            select(func.count(ItemORM.id)).where(ItemORM.location_id == location_id)
+        )
+        await session.commit()
+    if existing < items:
+        print(f"Создаем {items - existing} товаров...")
+        started = time.perf_counter()
+        # iter_records читает NDJSON построчно, поэтому вместо файла подходит генератор строк
+        lines = (
+            json.dumps({
+                "code": f"{BENCH_PREFIX}{n}", "name": f"Товар {n}", "weight": 1, "quantity": 100,
+                "location_id": location_id, "description": "bench",
+            }, ensure_ascii=False)
+            for n in range(existing + 1, items + 1)
+        )
+        report = await importer.ItemImporter(user.id, chunk_size=SEED_CHUNK_SIZE).run(lines, "ndjson")
+        if report.rejected:
+            print(f"Отклонено {report.rejected} строк, первая: {report.rejects[0].error}", file=sys.stderr)
+        async with async_engine.connect() as conn:
+            await conn.execute(text("ANALYZE items"))
+        print(f"Готово за {time.perf_counter() - started:.1f} с")
+
+
+async def cleanup() -> None:
+    # Операции и журнал остатков удаляются каскадом, агрегаты и журнал изменений - в той же транзакции
+    while True:
+        async with async_session_factory() as session:
+            batch = select(ItemORM.id).where(ItemORM.code.startswith(BENCH_PREFIX)).limit(CLEANUP_BATCH)
+            rows = (await session.execute(
+                delete(ItemORM).where(ItemORM.id.in_(batch))
+                .returning(ItemORM.id, ItemORM.location_id, ItemORM.quantity, ItemORM.weight)
+                .execution_options(synchronize_session=False)
+            )).all()
+            if not rows:
+                break
+            stock_delta = LocationStockDelta()
+            for _, location_id, quantity, weight in rows:
+                stock_delta.change((location_id, quantity, weight), None)
+            await stock_delta.apply(session)
+            changes.record(session, changes.ITEM, [row.id for row in rows], deleted=True)
+            await session.commit()
+    async with async_session_factory() as session:
+        location_id = await session.scalar(
+            select(LocationORM.id).where(LocationORM.name == BENCH_LOCATION, LocationORM.parent_id.is_(None))
+        )
+        if location_id is not None:
+            await rq.delete_existing_location(location_id, session)
+            await session.commit()
+
+
+async def measure(codes, cold: bool) -> list:
+    timings = []
+    async with async_session_factory() as session:
+        for code in codes:
+            if cold:
+                item_cache.clear()
+            started = time.perf_counter()
+            result = await rq.scan_item_by_code(code, session)
+            timings.append((time.perf_counter() - started) * 1000)
+            assert result["status"] == "exists", code
+    return timings
+
+
+def report(title: str, timings: list) -> None:
+    timings = sorted(timings)
+    p50 = statistics.median(timings)
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(f"{title:<8} n={len(timings):<7} p50={p50:.3f} мс  p99={p99:.3f} мс  max={timings[-1]:.3f} мс")
+
+
+async def main(args) -> None:
+    if args.cleanup:
+        await cleanup()
+        await async_engine.dispose()
+        return
+    if args.user_tg_id is None:
+        raise SystemExit("Для загрузки товаров нужен --user-tg-id: от его имени записываются приемки.")
+    await seed(args.items, args.user_tg_id)
+    rnd = random.Random(args.seed)
+    cold_codes = [f"{BENCH_PREFIX}{rnd.randint(1, args.items)}" for _ in range(args.scans)]
+    # Горячий набор: сканеры работают с ограниченным числом паллет в смене
+    hot = [f"{BENCH_PREFIX}{rnd.randint(1, args.items)}" for _ in range(args.hot)]
+    hot_codes = [rnd.choice(hot) for _ in range(args.scans)]
+
+    await measure(cold_codes[:100], cold=True) # прогрев пула и плана запроса
+    report("db", await measure(cold_codes, cold=True))
+    item_cache.clear()
+    report("cache", await measure(hot_codes, cold=False))
+    print(f"item_cache: {item_cache.stats()}")
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк scan_item_by_code")
+    parser.add_argument("--items", type=int, default=1_000_000, help="Размер каталога")
+    parser.add_argument("--scans", type=int, default=20_000, help="Число сканирований в каждом режиме")
+    parser.add_argument("--hot", type=int, default=2_000, help="Число горячих кодов для режима cache")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--user-tg-id", type=int, help="Telegram ID пользователя для операций приемки")
+    parser.add_argument("--cleanup", action="store_true", help="Удалить тестовые данные и выйти")
+    asyncio.run(main(parser.parse_args()))
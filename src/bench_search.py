@@ -0,0 +1,62 @@
+"""
+Бенчмарк поиска товаров: задержки search_items на большом каталоге.
+
+Запуск (из каталога src, нужна настроенная .env с PostgreSQL):
+    python bench_search.py --items 1000000 --queries 2000 --user-tg-id 732334353
+
+Каталог тот же, что у bench_scan.py (локация BENCH, товары BENCH-<n> с названием "Товар <n>"),
+и создается при необходимости тем же кодом; удаляется через python bench_scan.py --cleanup.
+Замеры p50/p99 первой страницы по группам запросов:
+    broad  - двухсимвольные запросы, подходящие к большой части каталога ("BE", "То"):
+             кандидаты ограничены search.SEARCH_CANDIDATE_LIMIT;
+    code   - префикс кода длиннее двух символов (BENCH-<n>);
+    name   - нечеткое совпадение с названием ("Товар <n>");
+    miss   - запрос без совпадений.
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from bench_scan import BENCH_PREFIX, report, seed
+from database import async_engine, async_session_factory
+import search
+
+BROAD_QUERIES = ("BE", "То", "ов")
+
+
+async def measure(queries, limit: int) -> list:
+    timings = []
+    async with async_session_factory() as session:
+        for query in queries:
+            started = time.perf_counter()
+            await search.search_items(session, query, limit)
+            timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+async def main(args) -> None:
+    if args.user_tg_id is None:
+        raise SystemExit("Для загрузки товаров нужен --user-tg-id: от его имени записываются приемки.")
+    await seed(args.items, args.user_tg_id)
+    rnd = random.Random(args.seed)
+    groups = {
+        "broad": [rnd.choice(BROAD_QUERIES) for _ in range(args.queries)],
+        "code": [f"{BENCH_PREFIX}{rnd.randint(1, args.items)}" for _ in range(args.queries)],
+        "name": [f"Товар {rnd.randint(1, args.items)}" for _ in range(args.queries)],
+        "miss": [f"нет-{rnd.randint(1, args.items)}" for _ in range(args.queries)],
+    }
+    await measure(groups["name"][:50], args.limit) # прогрев пула и планов запросов
+    for title, queries in groups.items():
+        report(title, await measure(queries, args.limit))
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк search_items")
+    parser.add_argument("--items", type=int, default=1_000_000, help="Размер каталога")
+    parser.add_argument("--queries", type=int, default=2_000, help="Число запросов в каждой группе")
+    parser.add_argument("--limit", type=int, default=50, help="Размер страницы")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--user-tg-id", type=int, help="Telegram ID пользователя для операций приемки")
+    asyncio.run(main(parser.parse_args()))
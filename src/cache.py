@@ -0,0 +1,82 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, NamedTuple, Optional, Tuple
+
+from config import settings
+from models import UserRole
+
+
+class TTLCache:
+    """
+    Ограниченный по размеру LRU-кэш с временем жизни записей.
+    Рассчитан на один event loop, поэтому обходится без блокировок.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Увеличивается при clear(): значение, прочитанное из БД до сброса, не должно попасть в кэш после него
+        self.generation = 0
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """Возвращает (найдено, значение): значением может быть и None, если закэширован отрицательный ответ."""
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return False, None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return True, entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+        self.invalidations += 1
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.generation += 1
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_ratio": round(self.hits / total, 4) if total else None,
+        }
+
+
+# Минимум данных о пользователе, который нужен зависимостям авторизации
+class CachedUser(NamedTuple):
+    id: int
+    tg_id: int
+    role: UserRole
+    is_active: Optional[bool]
+
+
+# tg_id -> CachedUser или None (пользователь не зарегистрирован). Изменения в своем воркере сбрасывают запись
+# сразу, изменения в других воркерах - через версию users (requests.watch_cache_versions)
+user_cache = TTLCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL)
+
+# code -> ItemReadSchema для scan_item_by_code. Заполняется при промахе и обновляется
+# после COMMIT функциями записи товаров (write-through); записи товаров в других воркерах
+# сбрасывают кэш через версию items (requests.watch_cache_versions)
+item_cache = TTLCache(maxsize=settings.ITEM_CACHE_SIZE, ttl=settings.ITEM_CACHE_TTL)
+
+# ETag -> закодированное тело ответа каталога (conditional.py)
+response_cache = TTLCache(maxsize=settings.RESPONSE_CACHE_SIZE, ttl=settings.RESPONSE_CACHE_TTL)
@@ -0,0 +1,120 @@
+"""
+Журнал изменений каталога для дельта-синхронизации клиентов (таблица change_log, GET /api/sync).
+
+Функции записи отмечают измененные товары и локации через record(). Перед COMMIT отмеченные
+сущности пишутся в change_log одной командой upsert. Номер seq строится из id транзакции:
+(pg_current_xact_id() << SEQ_TXID_SHIFT) + порядковый номер сущности в транзакции, поэтому
+писатели не ждут друг друга. Транзакции фиксируются не в порядке seq, и синхронизация отдает
+только строки ниже границы pg_snapshot_xmin своего снимка: все транзакции с меньшим id уже завершены,
+а незавершенные и будущие получат seq не меньше границы. Клиент, видевший seq N, не пропустит
+изменение с меньшим номером, а долгая пишущая транзакция лишь задерживает выдачу более поздних.
+
+Синхронизация отдает текущее состояние сущностей, измененных после since, и надгробия удаленных.
+"""
+from typing import Any, Dict, Iterable, List
+
+from sqlalchemy import BigInteger, Text, cast, event, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from models import ChangeLogORM, ItemORM, LocationORM
+from schemas import ItemReadSchema, LocationReadSchema, SyncResponseSchema
+
+# Младшие биты seq - номер сущности в транзакции: до 2**20 сущностей на COMMIT
+SEQ_TXID_SHIFT = 20
+ITEM = "item"
+LOCATION = "location"
+SYNC_DEFAULT_LIMIT = 1000
+SYNC_MAX_LIMIT = 5000
+
+_ENTITY_FIELDS = {
+    ITEM: (ItemORM, tuple(ItemReadSchema.model_fields)),
+    LOCATION: (LocationORM, tuple(LocationReadSchema.model_fields)),
+}
+
+
+def _xid_as_bigint(xid):
+    return cast(cast(xid, Text), BigInteger)
+
+
+def record(session, entity: str, entity_ids: Iterable[int], deleted: bool = False) -> None:
+    """Отмечает изменение сущностей в текущей транзакции; в журнал они попадут перед COMMIT."""
+    pending = session.info.setdefault("changes", {})
+    for entity_id in entity_ids:
+        pending[(entity, entity_id)] = deleted
+
+
+@event.listens_for(Session, "before_commit")
+def _write_change_log(session):
+    pending = session.info.pop("changes", None)
+    if not pending:
+        return
+    if len(pending) >= 1 << SEQ_TXID_SHIFT:
+        raise RuntimeError(f"Слишком много изменений в одной транзакции для журнала изменений: {len(pending)}")
+    # pg_current_xact_id назначает транзакции id, если она еще ничего не записала
+    base = session.scalar(select(_xid_as_bigint(func.pg_current_xact_id()))) << SEQ_TXID_SHIFT
+    rows = [
+        {"entity": entity, "entity_id": entity_id, "seq": base + offset, "deleted": deleted}
+        for offset, ((entity, entity_id), deleted) in enumerate(sorted(pending.items()))
+    ]
+    stmt = pg_insert(ChangeLogORM)
+    session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[ChangeLogORM.entity, ChangeLogORM.entity_id],
+            set_={"seq": stmt.excluded.seq, "deleted": stmt.excluded.deleted, "changed_at": func.now()},
+        ),
+        rows,
+    )
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending_changes(session):
+    session.info.pop("changes", None)
+
+
+async def sync_changes(session: AsyncSession, since: int, limit: int = SYNC_DEFAULT_LIMIT) -> SyncResponseSchema:
+    """
+    Изменения после since: не более limit сущностей в порядке seq. Клиент передает next_since
+    в следующий запрос, пока has_more = true. Изменения транзакций за границей видимости
+    (см. описание модуля) придут при следующей синхронизации.
+    """
+    # Граница и строки берутся из одного снимка команды
+    horizon = _xid_as_bigint(func.pg_snapshot_xmin(func.pg_current_snapshot())) * (1 << SEQ_TXID_SHIFT)
+    changes = (await session.execute(
+        select(ChangeLogORM.entity, ChangeLogORM.entity_id, ChangeLogORM.seq, ChangeLogORM.deleted)
+        .where(ChangeLogORM.seq > since, ChangeLogORM.seq < horizon)
+        .order_by(ChangeLogORM.seq)
+        .limit(limit + 1)
+    )).all()
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    live: Dict[str, List[int]] = {ITEM: [], LOCATION: []}
+    deleted: Dict[str, List[int]] = {ITEM: [], LOCATION: []}
+    for change in changes:
+        (deleted if change.deleted else live)[change.entity].append(change.entity_id)
+
+    rows: Dict[str, List[Dict[str, Any]]] = {}
+    for entity, ids in live.items():
+        rows[entity] = []
+        if not ids:
+            continue
+        model, fields = _ENTITY_FIELDS[entity]
+        found = (await session.execute(
+            select(*(getattr(model, name) for name in fields)).where(model.id.in_(ids)).order_by(model.id)
+        )).mappings().all()
+        rows[entity] = [dict(row) for row in found]
+        # Строка могла исчезнуть каскадом без отметки в журнале: для клиента это тоже удаление
+        missing = set(ids) - {row["id"] for row in found}
+        deleted[entity].extend(sorted(missing))
+
+    return SyncResponseSchema.model_construct(
+        since=since,
+        next_since=changes[-1].seq if changes else since,
+        has_more=has_more,
+        items=rows[ITEM],
+        locations=rows[LOCATION],
+        deleted_items=deleted[ITEM],
+        deleted_locations=deleted[LOCATION],
+    )
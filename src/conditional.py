@@ -0,0 +1,73 @@
+"""
+Условные GET для эндпоинтов каталога (ETag / If-None-Match).
+
+ETag строится из пути, параметров запроса и версий таблиц, от которых зависит ответ (table_versions,
+версии увеличивают триггеры миграции v0006). Проверка If-None-Match стоит один запрос к table_versions
+и не читает items и locations. Закодированное тело ответа кэшируется по ETag: пока версии
+не изменились, повторные запросы отдаются из response_cache без выборки и сериализации, а одновременные
+запросы с пустым кэшем делят одну выборку и одно закодированное тело (singleflight.py).
+
+Версии читаются до выборки данных. Если между ними успела зафиксироваться запись, в кэш попадут
+более новые данные под старой версией - это безопасно: следующий запрос увидит новую версию.
+"""
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, Sequence
+
+from fastapi import Request, Response
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import response_cache
+from models import TableVersionORM
+from serialization import dumps
+from singleflight import reads as single_flight
+
+# Параметры, не влияющие на содержимое ответа (tg_id - только авторизация)
+IGNORED_PARAMS = ("tg_id",)
+
+
+async def table_versions(session: AsyncSession, tables: Sequence[str]) -> Dict[str, int]:
+    rows = await session.execute(
+        select(TableVersionORM.table_name, func.sum(TableVersionORM.version))
+        .where(TableVersionORM.table_name.in_(tables))
+        .group_by(TableVersionORM.table_name)
+    )
+    versions = {name: int(version) for name, version in rows}
+    return {table: versions.get(table, 0) for table in tables}
+
+
+def make_etag(request: Request, versions: Dict[str, int]) -> str:
+    params = sorted((key, value) for key, value in request.query_params.multi_items() if key not in IGNORED_PARAMS)
+    raw = f"{request.url.path}?{params}|{sorted(versions.items())}"
+    # Сильный ETag: одинаковое значение означает побайтно одинаковое тело ответа
+    return '"' + hashlib.sha1(raw.encode()).hexdigest()[:24] + '"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in (tag.strip() for tag in header.split(","))
+
+
+async def conditional_json(
+    request: Request,
+    session: AsyncSession,
+    tables: Sequence[str],
+    build: Callable[[], Awaitable[Any]],
+) -> Response:
+    """Отдает 304, тело из кэша или результат build(), закодированный в JSON, с заголовком ETag."""
+    etag = make_etag(request, await table_versions(session, tables))
+    # no-cache: клиент может хранить ответ, но обязан перепроверять его по ETag
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    found, body = response_cache.get(etag)
+    if not found:
+        async def encode() -> bytes:
+            encoded = dumps(await build())
+            response_cache.set(etag, encoded)
+            return encoded
+        # Одновременные запросы с одним ETag при пустом кэше строят и кодируют ответ один раз
+        body = await single_flight.do(("conditional_json", etag), encode)
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -1,29 +1,241 @@
 import asyncio
-from typing import Annotated
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Annotated, Any, AsyncIterator, Callable, Dict, Optional
 
-from sqlalchemy import String, create_engine
+from sqlalchemy import Engine, String, create_engine, event
+from sqlalchemy.exc import DBAPIError, TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase, Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from config import settings
 
-sync_engine = create_engine(
-    url=settings.DATABASE_URL_psycopg,
-    echo=True,
-    # pool_size=5,
-    # max_overflow=10,
-)
 
-async_engine = create_async_engine(
-    url=settings.DATABASE_URL_asyncpg,
-    echo=True,
-)
+class PoolWaitStats:
+    """Время получения соединения из пула: ожидание свободного соединения плюс pre-ping или открытие нового."""
+
+    SLOW_ACQUIRE_SECONDS = 0.1
+
+    def __init__(self):
+        self.acquired = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.slow = 0 # получений дольше SLOW_ACQUIRE_SECONDS
+
+    def record(self, seconds: float) -> None:
+        self.acquired += 1
+        self.total_wait += seconds
+        if seconds > self.max_wait:
+            self.max_wait = seconds
+        if seconds > self.SLOW_ACQUIRE_SECONDS:
+            self.slow += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "acquired": self.acquired,
+            "timeouts": self.timeouts,
+            "slow": self.slow,
+            "avg_wait_ms": round(self.total_wait / self.acquired * 1000, 3) if self.acquired else None,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+        }
+
+
+pool_wait_stats = PoolWaitStats()
+
+
+class MeteredAsyncQueuePool(AsyncAdaptedQueuePool):
+    """Пул асинхронного движка, который замеряет, сколько запрос ждал соединение."""
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            pool_wait_stats.timeouts += 1
+            raise
+        finally:
+            pool_wait_stats.record(time.perf_counter() - started)
 
-session_factory = sessionmaker(sync_engine)
+
+def _async_engine_options(metered: bool = True) -> Dict[str, Any]:
+    connect_args: Dict[str, Any] = {
+        # Кэш подготовленных выражений asyncpg на соединение (0 - выключен, нужно за pgbouncer)
+        "prepared_statement_cache_size": settings.DB_PREPARED_STATEMENT_CACHE_SIZE,
+    }
+    if settings.DB_STATEMENT_TIMEOUT_MS:
+        connect_args["server_settings"] = {"statement_timeout": str(settings.DB_STATEMENT_TIMEOUT_MS)}
+    return dict(
+        echo=settings.DB_ECHO,
+        # Замеры ожидания ведутся только для пула primary, чтобы реплики не смешивались с ним
+        poolclass=MeteredAsyncQueuePool if metered else AsyncAdaptedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+
+
+async_engine = create_async_engine(url=settings.DATABASE_URL_asyncpg, **_async_engine_options())
 async_session_factory = async_sessionmaker(async_engine)
 
+replica_engines = [
+    create_async_engine(url=url, **_async_engine_options(metered=False)) for url in settings.replica_urls
+]
+
+
+class ReadRouter:
+    """
+    Выбор сессии для запросов только на чтение.
+    Реплики перебираются по кругу; реплика, к которой не удалось подключиться, пропускается
+    DB_REPLICA_RETRY_SECONDS секунд. Если реплик нет или все недоступны, чтение идет в primary.
+    Пользователь, только что сделавший запись, какое-то время читает с primary,
+    чтобы не увидеть на отстающей реплике состояние до своей записи.
+    """
+
+    MAX_TRACKED_WRITERS = 10_000
+
+    def __init__(self, engines, read_your_writes_seconds: float, retry_seconds: float):
+        self._factories = [async_sessionmaker(engine) for engine in engines]
+        self._read_your_writes_seconds = read_your_writes_seconds
+        self._retry_seconds = retry_seconds
+        self._next = 0
+        self._down_until = [0.0] * len(self._factories)
+        self._recent_writers: Dict[int, float] = {}
+        self.routed_to_replica = 0
+        self.routed_to_primary = 0
+        self.replica_failures = 0
+
+    def mark_write(self, tg_id: int) -> None:
+        now = time.monotonic()
+        if len(self._recent_writers) >= self.MAX_TRACKED_WRITERS:
+            self._recent_writers = {key: until for key, until in self._recent_writers.items() if until > now}
+        self._recent_writers[tg_id] = now + self._read_your_writes_seconds
+
+    def _wrote_recently(self, tg_id: Optional[int]) -> bool:
+        if tg_id is None:
+            return False
+        until = self._recent_writers.get(tg_id)
+        return until is not None and until > time.monotonic()
+
+    @asynccontextmanager
+    async def session(self, tg_id: Optional[int] = None) -> AsyncIterator[AsyncSession]:
+        if self._factories and not self._wrote_recently(tg_id):
+            for _ in range(len(self._factories)):
+                index = self._next % len(self._factories)
+                self._next += 1
+                if self._down_until[index] > time.monotonic():
+                    continue
+                session = self._factories[index]()
+                try:
+                    # Подключаемся сразу, чтобы недоступная реплика обнаружилась до выполнения запроса
+                    await session.connection()
+                except (OSError, DBAPIError, asyncio.TimeoutError, PoolTimeoutError):
+                    await session.close()
+                    self.replica_failures += 1
+                    self._down_until[index] = time.monotonic() + self._retry_seconds
+                    continue
+                self.routed_to_replica += 1
+                try:
+                    yield session
+                finally:
+                    await session.close()
+                return
+        self.routed_to_primary += 1
+        async with async_session_factory() as session:
+            yield session
+
+    def status(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "replicas": len(self._factories),
+            "replicas_down": sum(1 for until in self._down_until if until > now),
+            "routed_to_replica": self.routed_to_replica,
+            "routed_to_primary": self.routed_to_primary,
+            "replica_failures": self.replica_failures,
+        }
+
+
+read_router = ReadRouter(
+    replica_engines,
+    read_your_writes_seconds=settings.DB_REPLICA_READ_YOUR_WRITES_SECONDS,
+    retry_seconds=settings.DB_REPLICA_RETRY_SECONDS,
+)
+
+
+@lru_cache(maxsize=None)
+def get_sync_engine() -> Engine:
+    """
+    Синхронный движок (psycopg) нужен только скриптам вроде orm.py, поэтому создается при первом обращении,
+    а не при импорте модуля приложением.
+    """
+    connect_args = {}
+    if settings.DB_STATEMENT_TIMEOUT_MS:
+        connect_args["options"] = f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"
+    return create_engine(
+        url=settings.DATABASE_URL_psycopg,
+        echo=settings.DB_ECHO,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+
+
+def session_factory() -> Session:
+    return Session(get_sync_engine())
+
+
+def pool_status() -> Dict[str, Any]:
+    """Текущее состояние пула асинхронного движка в этом воркере."""
+    pool = async_engine.pool
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "timeout_s": settings.DB_POOL_TIMEOUT,
+        "waits": pool_wait_stats.as_dict(),
+        "read_routing": read_router.status(),
+    }
+
 str_256 = Annotated[str, 256]
 
+
+def run_after_commit(session, callback: Callable[[], None]) -> None:
+    """
+    Откладывает callback до успешного COMMIT текущей транзакции сессии (при ROLLBACK он отбрасывается).
+    Подходит для AsyncSession и Session: внутри AsyncSession работает обычная Session с тем же info.
+    """
+    session.info.setdefault("after_commit", []).append(callback)
+
+
+@event.listens_for(Session, "after_commit")
+def _run_after_commit_callbacks(session):
+    for callback in session.info.pop("after_commit", ()):
+        callback()
+
+
+@event.listens_for(Session, "after_commit")
+def _remember_recent_writer(session):
+    # actor_tg_id выставляет зависимость авторизации; после COMMIT этот пользователь временно читает с primary
+    tg_id = session.info.get("actor_tg_id")
+    if tg_id is not None:
+        read_router.mark_write(tg_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_after_commit_callbacks(session):
+    session.info.pop("after_commit", None)
+
+
 class Base(DeclarativeBase):
     type_annotation_map = {
         str_256: String(256)
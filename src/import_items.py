@@ -0,0 +1,51 @@
+"""
+Импорт товаров из файла в обход HTTP.
+    python import_items.py items.csv --user-tg-id 732334353
+    python import_items.py items.ndjson --user-tg-id 732334353 --chunk-size 5000
+Операции "приемка" записываются от имени пользователя с указанным Telegram ID.
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from database import async_engine, async_session_factory
+import importer
+import requests as rq
+
+
+async def main(args) -> int:
+    try:
+        async with async_session_factory() as session:
+            user = await rq.fetch_auth_user(args.user_tg_id, session)
+        if not user:
+            print(f"Пользователь с Telegram ID {args.user_tg_id} не найден.", file=sys.stderr)
+            return 1
+
+        started = time.perf_counter()
+
+        def progress(report):
+            rate = report.processed / max(time.perf_counter() - started, 1e-9)
+            print(f"обработано {report.processed}, загружено {report.imported}, "
+                  f"отклонено {report.rejected} ({rate:.0f} строк/с)", flush=True)
+
+        fmt = importer.detect_format(args.path, args.format)
+        with open(args.path, "rb") as stream:
+            report = await importer.import_items(stream, fmt, user.id, args.chunk_size, progress)
+        for reject in report.rejects:
+            print(f"строка {reject.line} [{reject.code or '-'}]: {reject.error}", file=sys.stderr)
+        if report.rejects_truncated:
+            print(f"... и еще {report.rejected - len(report.rejects)} отклоненных строк", file=sys.stderr)
+        print(f"Готово: загружено {report.imported} из {report.processed} за {time.perf_counter() - started:.1f} с")
+        return 0 if not report.rejected else 2
+    finally:
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Массовый импорт товаров из CSV/NDJSON")
+    parser.add_argument("path", help="Путь к файлу .csv или .ndjson")
+    parser.add_argument("--user-tg-id", type=int, required=True, help="Telegram ID пользователя для операций приемки")
+    parser.add_argument("--format", choices=importer.IMPORT_FORMATS, help="Формат файла; по умолчанию по расширению")
+    parser.add_argument("--chunk-size", type=int, default=importer.IMPORT_CHUNK_SIZE)
+    sys.exit(asyncio.run(main(parser.parse_args())))
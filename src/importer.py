@@ -0,0 +1,231 @@
+"""
+Массовый импорт товаров из CSV или NDJSON.
+
+Файл читается потоково, пачками по IMPORT_CHUNK_SIZE строк. Для каждой пачки:
+    - строки проверяются схемой ItemCreateSchema;
+    - уникальность кодов проверяется одним IN-запросом (и внутри самого файла);
+    - существование локаций проверяется одним IN-запросом (известные локации запоминаются);
+    - товары пишутся через COPY (PostgreSQL + asyncpg) или executemany на других драйверах;
+    - операции "приемка" и строки журнала остатков создаются INSERT ... SELECT по кодам вставленных товаров;
+    - агрегаты остатков по локациям (location_stock) увеличиваются одной командой на пачку.
+Каждая пачка фиксируется отдельной транзакцией: при сбое уже загруженные пачки остаются в БД,
+а отчет показывает, сколько строк успели записаться.
+
+Чтение и разбор файла (загруженный файл лежит в SpooledTemporaryFile и может быть на диске) и проверка
+строк схемой выполняются в потоке, чтобы большой импорт не останавливал event loop между пачками:
+в цикле событий остаются только запросы к БД.
+"""
+import asyncio
+import csv
+import io
+import json
+from itertools import islice
+from typing import Any, Callable, IO, Iterator, List, Optional, Tuple
+
+from asyncpg.exceptions import IntegrityConstraintViolationError
+from pydantic import ValidationError
+from sqlalchemy import String, cast, insert, literal, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import async_session_factory
+from location_stock import LocationStockDelta
+import changes
+from models import ItemORM, LocationORM, OperationORM, OperationType, StockLedgerORM
+from schemas import ImportRejectSchema, ImportReportSchema, ItemCreateSchema
+
+IMPORT_CHUNK_SIZE = 2000
+# Сколько отклоненных строк попадает в отчет; остальные только считаются
+MAX_REPORTED_REJECTS = 1000
+IMPORT_FORMATS = ("csv", "ndjson")
+ITEM_COPY_COLUMNS = ("code", "name", "weight", "quantity", "location_id", "description")
+
+
+def detect_format(filename: Optional[str], explicit: Optional[str] = None) -> str:
+    if explicit:
+        if explicit not in IMPORT_FORMATS:
+            raise ValueError(f"Неизвестный формат импорта: {explicit}")
+        return explicit
+    name = (filename or "").lower()
+    if name.endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    return "csv"
+
+
+def iter_records(text_stream: IO[str], fmt: str) -> Iterator[Tuple[int, Any]]:
+    """Построчно отдает (номер строки в файле, запись). Для NDJSON запись может оказаться исключением разбора."""
+    if fmt == "csv":
+        reader = csv.DictReader(text_stream)
+        for record in reader:
+            # Для CSV номер строки с учетом заголовка и многострочных полей
+            yield reader.line_num, record
+    else:
+        for line_no, line in enumerate(text_stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except ValueError as e:
+                yield line_no, e
+
+
+class ItemImporter:
+    def __init__(self, user_id: int, chunk_size: int = IMPORT_CHUNK_SIZE,
+                 progress: Optional[Callable[[ImportReportSchema], None]] = None):
+        self.user_id = user_id
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.report = ImportReportSchema()
+        self._seen_codes: set = set()
+        self._known_locations: set = set()
+
+    def _reject(self, line: int, code: Optional[str], error: str) -> None:
+        self.report.rejected += 1
+        if len(self.report.rejects) < MAX_REPORTED_REJECTS:
+            self.report.rejects.append(ImportRejectSchema(line=line, code=code, error=error))
+        else:
+            self.report.rejects_truncated = True
+
+    async def run(self, text_stream: IO[str], fmt: str) -> ImportReportSchema:
+        records = iter_records(text_stream, fmt)
+        while True:
+            chunk = await asyncio.to_thread(self._read_chunk, records)
+            if chunk is None:
+                break
+            await self._import_chunk(chunk)
+            if self.progress:
+                self.progress(self.report)
+        self.report.rejects.sort(key=lambda reject: reject.line)
+        return self.report
+
+    def _read_chunk(self, records: Iterator[Tuple[int, Any]]) -> Optional[List[Tuple[int, ItemCreateSchema]]]:
+        """Следующая пачка проверенных строк (выполняется в потоке); None, если файл закончился."""
+        chunk = list(islice(records, self.chunk_size))
+        if not chunk:
+            return None
+        return self._validate(chunk)
+
+    def _validate(self, chunk: List[Tuple[int, Any]]) -> List[Tuple[int, ItemCreateSchema]]:
+        valid = []
+        for line, record in chunk:
+            self.report.processed += 1
+            if isinstance(record, Exception):
+                self._reject(line, None, f"Некорректный JSON: {record}")
+                continue
+            if not isinstance(record, dict):
+                self._reject(line, None, "Строка должна быть объектом.")
+                continue
+            # Пустые ячейки CSV считаем отсутствующими значениями
+            record = {key: value for key, value in record.items() if key and value not in ("", None)}
+            try:
+                item = ItemCreateSchema.model_validate(record)
+            except ValidationError as e:
+                errors = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+                self._reject(line, record.get("code"), errors)
+                continue
+            if item.code in self._seen_codes:
+                self._reject(line, item.code, "Код повторяется в файле.")
+                continue
+            self._seen_codes.add(item.code)
+            valid.append((line, item))
+        return valid
+
+    async def _import_chunk(self, valid: List[Tuple[int, ItemCreateSchema]]) -> None:
+        if not valid:
+            return
+        async with async_session_factory() as session:
+            codes = [item.code for _, item in valid]
+            existing = set(await session.scalars(select(ItemORM.code).where(ItemORM.code.in_(codes))))
+
+            location_ids = {item.location_id for _, item in valid} - self._known_locations
+            if location_ids:
+                self._known_locations |= set(await session.scalars(
+                    select(LocationORM.id).where(LocationORM.id.in_(location_ids))
+                ))
+
+            rows = []
+            for line, item in valid:
+                if item.code in existing:
+                    self._reject(line, item.code, "Товар с таким кодом уже существует.")
+                elif item.location_id not in self._known_locations:
+                    self._reject(line, item.code, "Указанная локация не найдена.")
+                else:
+                    rows.append((line, item))
+            if not rows:
+                return
+
+            try:
+                await self._write_items(session, [item for _, item in rows])
+                await session.commit()
+            except (IntegrityError, IntegrityConstraintViolationError) as e:
+                # Код мог появиться, а локация - исчезнуть параллельно между проверкой и записью: пачка
+                # откатывается целиком. COPY идет напрямую через asyncpg, и его ошибки SQLAlchemy не оборачивает
+                await session.rollback()
+                for line, item in rows:
+                    self._reject(line, item.code, f"Ошибка базы данных при записи пачки: {getattr(e, 'orig', e)}")
+                return
+            self.report.imported += len(rows)
+
+    async def _write_items(self, session: AsyncSession, items: List[ItemCreateSchema]) -> None:
+        records = [
+            (item.code, item.name, item.weight, item.quantity, item.location_id, item.description or "")
+            for item in items
+        ]
+        conn = await session.connection()
+        if conn.dialect.name == "postgresql" and conn.dialect.driver == "asyncpg":
+            # COPY в рамках текущей транзакции сессии: строки идут бинарным потоком без разбора SQL
+            raw = await conn.get_raw_connection()
+            await raw.driver_connection.copy_records_to_table(
+                ItemORM.__tablename__, records=records, columns=ITEM_COPY_COLUMNS,
+            )
+        else:
+            await session.execute(insert(ItemORM), [dict(zip(ITEM_COPY_COLUMNS, record)) for record in records])
+
+        # "Добавление нового товара = приемка": операции для всей пачки одним INSERT ... SELECT
+        await session.execute(
+            insert(OperationORM).from_select(
+                ["item_id", "user_id", "type", "note", "created_by_id"],
+                select(
+                    ItemORM.id,
+                    literal(self.user_id),
+                    literal(OperationType.receive, OperationORM.type.type),
+                    literal("Первичная приемка при импорте товара. Количество: ") + cast(ItemORM.quantity, String),
+                    literal(self.user_id),
+                ).where(ItemORM.code.in_([item.code for item in items])),
+            )
+        )
+        # Журнал остатков: у новых товаров других операций нет, поэтому соединение по item_id однозначно
+        await session.execute(
+            insert(StockLedgerORM).from_select(
+                ["item_id", "operation_id", "type", "delta", "quantity_after", "location_id"],
+                select(
+                    ItemORM.id,
+                    OperationORM.id,
+                    literal(OperationType.receive, StockLedgerORM.type.type),
+                    ItemORM.quantity,
+                    ItemORM.quantity,
+                    ItemORM.location_id,
+                )
+                .join(OperationORM, OperationORM.item_id == ItemORM.id)
+                .where(ItemORM.code.in_([item.code for item in items])),
+            )
+        )
+        changes.record(session, changes.ITEM, await session.scalars(
+            select(ItemORM.id).where(ItemORM.code.in_([item.code for item in items]))
+        ))
+        stock_delta = LocationStockDelta()
+        for item in items:
+            stock_delta.change(None, (item.location_id, item.quantity, item.weight))
+        await stock_delta.apply(session)
+
+
+async def import_items(binary_stream: IO[bytes], fmt: str, user_id: int,
+                       chunk_size: int = IMPORT_CHUNK_SIZE,
+                       progress: Optional[Callable[[ImportReportSchema], None]] = None) -> ImportReportSchema:
+    """Импортирует товары из бинарного потока (загруженный файл или открытый на диске)."""
+    text_stream = io.TextIOWrapper(binary_stream, encoding="utf-8-sig", newline="")
+    try:
+        return await ItemImporter(user_id, chunk_size, progress).run(text_stream, fmt)
+    finally:
+        # Не закрываем исходный поток вместе с оберткой: им владеет вызывающая сторона
+        text_stream.detach()
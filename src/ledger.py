@@ -0,0 +1,246 @@
+"""
+Журнал остатков (stock_ledger) и снимки остатков (stock_snapshots).
+
+Каждая функция записи, меняющая количество или локацию товара, добавляет в журнал строку с изменением
+(delta), остатком после него (quantity_after) и локациями. Раз в STOCK_SNAPSHOT_INTERVAL_SECONDS
+снимается снимок остатков всех товаров. Остаток на момент T восстанавливается одним запросом:
+последний снимок не позже T плюс последняя строка журнала каждого товара в интервале (снимок, T].
+Объем чтения ограничен одним снимком и журналом за период между снимками, а не всей историей,
+а в приложение попадает только запрошенная страница.
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import TIMESTAMP, cast, delete, func, insert, literal, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database import async_session_factory
+from models import ItemORM, OperationType, StockLedgerORM, StockSnapshotORM
+from pagination import PageParams, paginate
+from schemas import (
+    StockAtSchema, StockHistorySchema, StockLedgerEntrySchema, StockPointSchema, StockSnapshotResultSchema,
+)
+from serialization import validate_rows
+
+# Ключ advisory lock, чтобы снимок в нескольких воркерах снимался один раз
+SNAPSHOT_LOCK_KEY = 7_305_112_002
+# Сколько снимок ждет транзакции записи, начатые до него; не дождавшись, он переносится на следующий интервал
+SNAPSHOT_WAIT_SECONDS = 30.0
+SNAPSHOT_WAIT_POLL_SECONDS = 0.05
+LEDGER_FIELDS = tuple(StockLedgerEntrySchema.model_fields)
+STOCK_POINT_FIELDS = tuple(StockPointSchema.model_fields)
+
+
+def ledger_entry(
+    item_id: int,
+    op_type: OperationType,
+    quantity_before: int,
+    location_before: Optional[int],
+    quantity_after: int,
+    location_after: int,
+    operation_id: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Строка журнала по состоянию товара до и после изменения.
+    Для нового товара quantity_before = 0 и location_before = None.
+    """
+    moved = location_before is not None and location_before != location_after
+    return {
+        "item_id": item_id,
+        "operation_id": operation_id,
+        "type": op_type,
+        "delta": quantity_after - quantity_before,
+        "quantity_after": quantity_after,
+        "from_location_id": location_before if moved else None,
+        "location_id": location_after,
+    }
+
+
+async def write_entries(session: AsyncSession, entries: List[Dict[str, Any]]) -> None:
+    """Пишет строки журнала в текущей транзакции одним executemany."""
+    if entries:
+        await session.execute(insert(StockLedgerORM), entries)
+
+
+async def _wait_for_writers(session: AsyncSession, timeout: float) -> bool:
+    """
+    Ждет завершения транзакций, выполнявшихся к моменту вызова; False - не дождались за timeout секунд.
+    Функции записи добавляют строки журнала после изменения items, то есть когда транзакции уже назначен
+    xid, поэтому строку с created_at раньше вызова может дописать только одна из этих транзакций.
+    Новые транзакции не ждут снимок и не блокируются им.
+    """
+    # xid короткой отдельной транзакции больше xid всех уже начавших запись. xmax снимка для этого
+    # не подходит: он равен последнему завершенному xid + 1, и выполняющиеся транзакции могут быть за ним.
+    # Своя транзакция снимка xid не получает, чтобы не задерживать горизонт журнала изменений на время ожидания
+    async with session.bind.connect() as conn:
+        boundary = await conn.scalar(text("SELECT pg_current_xact_id()::text::bigint"))
+        await conn.commit()
+    deadline = time.monotonic() + timeout
+    while not await session.scalar(
+        text("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint >= :boundary"), {"boundary": boundary}
+    ):
+        if time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(SNAPSHOT_WAIT_POLL_SECONDS)
+    return True
+
+
+async def take_snapshot(min_interval: float = 0.0) -> StockSnapshotResultSchema:
+    """
+    Снимает снимок остатков всех товаров в отдельной транзакции.
+    Если последний снимок моложе min_interval секунд или снимок уже снимает другой воркер, ничего не делает.
+
+    Снимок на момент taken_at строится из предыдущего снимка и журнала за (предыдущий снимок, taken_at],
+    тем же запросом, что и остатки на дату, поэтому запись в items не блокируется. Сначала снимок ждет
+    транзакции, начатые до taken_at: их строки журнала могут иметь created_at раньше taken_at.
+    Только самый первый снимок читает items под LOCK TABLE items IN SHARE MODE: опереться ему не на что.
+    Старые снимки удаляются отдельной транзакцией после COMMIT.
+    """
+    async with async_session_factory() as session:
+        postgres = session.bind.dialect.name == "postgresql"
+        if postgres:
+            locked = await session.scalar(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": SNAPSHOT_LOCK_KEY})
+            if not locked:
+                return StockSnapshotResultSchema()
+        # Время строки журнала - clock_timestamp() в колонке без часового пояса, граница снимка берется так же
+        now = await session.scalar(select(cast(func.clock_timestamp(), TIMESTAMP)))
+        previous = await session.scalar(select(func.max(StockSnapshotORM.taken_at)))
+        if min_interval and previous is not None and (now - previous).total_seconds() < min_interval:
+            return StockSnapshotResultSchema()
+        if previous is not None and postgres:
+            if not await _wait_for_writers(session, SNAPSHOT_WAIT_SECONDS):
+                print(f"Снимок остатков отложен: транзакции записи не завершились за {SNAPSHOT_WAIT_SECONDS} с")
+                return StockSnapshotResultSchema()
+            state = _state_query(previous, now)
+            source = select(literal(now, StockSnapshotORM.taken_at.type), state.c.item_id, state.c.quantity, state.c.location_id)
+        else:
+            if postgres:
+                # Первый снимок: SHARE блокирует запись в items до конца транзакции, поэтому все изменения,
+                # начатые раньше, успевают зафиксироваться и попадают в снимок, а более поздние получают
+                # created_at позже taken_at и попадают в журнал после снимка
+                await session.execute(text("LOCK TABLE items IN SHARE MODE"))
+            source = select(literal(now, StockSnapshotORM.taken_at.type), ItemORM.id, ItemORM.quantity, ItemORM.location_id)
+        result = await session.execute(
+            insert(StockSnapshotORM).from_select(["taken_at", "item_id", "quantity", "location_id"], source)
+        )
+        await session.commit()
+    if settings.STOCK_SNAPSHOT_RETENTION_DAYS:
+        async with async_session_factory() as session:
+            # Только что снятый снимок младше срока хранения и остается основой для следующего
+            await session.execute(
+                delete(StockSnapshotORM)
+                .where(StockSnapshotORM.taken_at < now - timedelta(days=settings.STOCK_SNAPSHOT_RETENTION_DAYS))
+            )
+            await session.commit()
+    return StockSnapshotResultSchema(taken_at=now, items=result.rowcount)
+
+
+async def snapshot_loop(interval: float) -> None:
+    """Фоновая задача приложения: периодически снимает снимок остатков."""
+    while True:
+        try:
+            await take_snapshot(min_interval=interval)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Сбой снимка не должен останавливать задачу: следующая попытка через интервал
+            print(f"Не удалось снять снимок остатков: {e}")
+        await asyncio.sleep(interval)
+
+
+async def _snapshot_time(session: AsyncSession, at: datetime) -> datetime:
+    taken_at = await session.scalar(
+        select(func.max(StockSnapshotORM.taken_at)).where(StockSnapshotORM.taken_at <= at)
+    )
+    if taken_at is None:
+        raise HTTPException(status_code=400, detail="Нет снимка остатков на указанный момент: история начинается позже.")
+    return taken_at
+
+
+def _state_query(taken_at: datetime, at: datetime, item_id: Optional[int] = None):
+    """
+    Подзапрос состояния товаров на момент at: (item_id, quantity, location_id).
+    Строка снимка заменяется последней строкой журнала товара между снимком и at, товары,
+    созданные после снимка, берутся только из журнала.
+    """
+    snapshot = select(StockSnapshotORM.item_id, StockSnapshotORM.quantity, StockSnapshotORM.location_id).where(
+        StockSnapshotORM.taken_at == taken_at
+    )
+    # Последняя строка журнала каждого товара. Сортировка по id, а не по времени: строки одного
+    # товара пишутся под блокировкой его строки в items, поэтому id идут в порядке фиксации
+    latest = (
+        select(StockLedgerORM.item_id, StockLedgerORM.quantity_after, StockLedgerORM.location_id)
+        .where(StockLedgerORM.created_at > taken_at, StockLedgerORM.created_at <= at)
+        .distinct(StockLedgerORM.item_id)
+        .order_by(StockLedgerORM.item_id, StockLedgerORM.id.desc())
+    )
+    if item_id is not None:
+        snapshot = snapshot.where(StockSnapshotORM.item_id == item_id)
+        latest = latest.where(StockLedgerORM.item_id == item_id)
+    snapshot = snapshot.subquery("snapshot")
+    latest = latest.subquery("latest")
+    return (
+        select(
+            func.coalesce(latest.c.item_id, snapshot.c.item_id).label("item_id"),
+            func.coalesce(latest.c.quantity_after, snapshot.c.quantity).label("quantity"),
+            func.coalesce(latest.c.location_id, snapshot.c.location_id).label("location_id"),
+        )
+        .select_from(snapshot.join(latest, latest.c.item_id == snapshot.c.item_id, full=True))
+        .subquery("state")
+    )
+
+
+async def stock_at(
+    session: AsyncSession,
+    at: datetime,
+    params: PageParams,
+    item_id: Optional[int] = None,
+    location_id: Optional[int] = None,
+) -> StockAtSchema:
+    """
+    Остатки на момент at: всех товаров, одного товара или товаров, находившихся в локации.
+    Состояние собирается и фильтруется в БД, страница выбирается keyset-пагинацией по item_id.
+    """
+    taken_at = await _snapshot_time(session, at)
+    state = _state_query(taken_at, at, item_id)
+    rows, next_cursor = await paginate(
+        session, state.c, params,
+        allowed_fields=STOCK_POINT_FIELDS, sortable=("item_id",), default_sort="item_id", unique_key="item_id",
+        where=[state.c.location_id == location_id] if location_id is not None else (),
+    )
+    return StockAtSchema.model_construct(
+        at=at, snapshot_taken_at=taken_at, items=validate_rows(StockPointSchema, rows), next_cursor=next_cursor,
+    )
+
+
+async def stock_history(session: AsyncSession, item_id: int, date_from: datetime, date_to: datetime) -> StockHistorySchema:
+    """Остаток товара на начало периода, строки журнала за период (date_from, date_to] и остаток на конец."""
+    if date_to < date_from:
+        raise HTTPException(status_code=400, detail="Конец периода раньше начала.")
+    state = _state_query(await _snapshot_time(session, date_from), date_from, item_id)
+    opening = (await session.execute(select(state.c.quantity, state.c.location_id))).first()
+    rows = (await session.execute(
+        select(*(getattr(StockLedgerORM, name) for name in LEDGER_FIELDS))
+        .where(
+            StockLedgerORM.item_id == item_id,
+            StockLedgerORM.created_at > date_from,
+            StockLedgerORM.created_at <= date_to,
+        )
+        .order_by(StockLedgerORM.id)
+    )).mappings().all()
+    entries = [StockLedgerEntrySchema.model_validate(dict(row)) for row in rows]
+    closing = (entries[-1].quantity_after, entries[-1].location_id) if entries else opening
+    return StockHistorySchema(
+        item_id=item_id,
+        date_from=date_from,
+        date_to=date_to,
+        opening_quantity=opening[0] if opening else None,
+        opening_location_id=opening[1] if opening else None,
+        closing_quantity=closing[0] if closing else None,
+        closing_location_id=closing[1] if closing else None,
+        entries=entries,
+    )
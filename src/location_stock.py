@@ -0,0 +1,113 @@
+"""
+Инкрементальные агрегаты остатков по локациям (таблица location_stock).
+
+Функции записи товаров собирают изменения в LocationStockDelta: состояние товара до и после
+(локация, количество, вес единицы). В конце транзакции apply() пишет в location_stock одной
+командой INSERT ... ON CONFLICT DO UPDATE с приращениями, поэтому сводки не сканируют items.
+
+Строка агрегата блокируется до COMMIT, и при одной строке на локацию все записи в локацию
+(приемка машины в одну зону, перемещения в ячейку отгрузки) шли бы по очереди. Поэтому агрегат
+локации разбит на LOCATION_STOCK_SHARDS шардов: транзакция пишет в шард txid_current() % N,
+как счетчики table_versions, а сводки суммируют шарды локации.
+"""
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import BigInteger, cast, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import LocationORM, LocationStockORM
+from schemas import LocationSummarySchema
+
+# Состояние товара для агрегатов: (location_id, quantity, weight)
+ItemState = Tuple[int, int, int]
+# Число шардов можно менять без миграции: строки прежних шардов продолжают суммироваться
+LOCATION_STOCK_SHARDS = 8
+
+
+class LocationStockDelta:
+    def __init__(self):
+        # location_id -> [item_count, total_quantity, total_weight]
+        self._deltas: Dict[int, List[int]] = defaultdict(lambda: [0, 0, 0])
+
+    def _add(self, state: ItemState, sign: int) -> None:
+        location_id, quantity, weight = state
+        delta = self._deltas[location_id]
+        delta[0] += sign
+        delta[1] += sign * quantity
+        delta[2] += sign * weight * quantity
+
+    def change(self, before: Optional[ItemState], after: Optional[ItemState]) -> None:
+        """Учитывает изменение товара; before = None для нового товара, after = None для удаленного."""
+        if before == after:
+            return
+        if before is not None:
+            self._add(before, -1)
+        if after is not None:
+            self._add(after, 1)
+
+    async def apply(self, session: AsyncSession) -> None:
+        rows = [
+            {"location_id": location_id, "item_count": count, "total_quantity": quantity, "total_weight": weight}
+            # Порядок по location_id: параллельные транзакции блокируют строки агрегатов в одном порядке
+            for location_id, (count, quantity, weight) in sorted(self._deltas.items())
+            if count or quantity or weight
+        ]
+        self._deltas.clear()
+        if not rows:
+            return
+        # Шард один на транзакцию, поэтому порядок блокировок по location_id сохраняется
+        stmt = pg_insert(LocationStockORM).values(shard=func.txid_current() % LOCATION_STOCK_SHARDS)
+        await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[LocationStockORM.location_id, LocationStockORM.shard],
+                set_={
+                    "item_count": LocationStockORM.item_count + stmt.excluded.item_count,
+                    "total_quantity": LocationStockORM.total_quantity + stmt.excluded.total_quantity,
+                    "total_weight": LocationStockORM.total_weight + stmt.excluded.total_weight,
+                },
+            ),
+            rows,
+        )
+
+
+async def apply_change(session: AsyncSession, before: Optional[ItemState], after: Optional[ItemState]) -> None:
+    """Изменение одного товара: сокращение для функций записи, меняющих один товар."""
+    delta = LocationStockDelta()
+    delta.change(before, after)
+    await delta.apply(session)
+
+
+def totals(column):
+    """Сумма колонки агрегата по шардам (0, если строк нет); sum(bigint) в PostgreSQL - numeric."""
+    return cast(func.coalesce(func.sum(column), 0), BigInteger)
+
+
+def summary_query():
+    """Итоги каждой локации; локации без товаров не имеют строк в location_stock, для них нули."""
+    return (
+        select(
+            LocationORM.id.label("location_id"),
+            LocationORM.name,
+            totals(LocationStockORM.item_count).label("item_count"),
+            totals(LocationStockORM.total_quantity).label("total_quantity"),
+            totals(LocationStockORM.total_weight).label("total_weight"),
+        )
+        .outerjoin(LocationStockORM, LocationStockORM.location_id == LocationORM.id)
+        .group_by(LocationORM.id, LocationORM.name)
+        .order_by(LocationORM.id)
+    )
+
+
+async def location_summaries(session: AsyncSession) -> List[LocationSummarySchema]:
+    rows = (await session.execute(summary_query())).mappings().all()
+    return [LocationSummarySchema.model_validate(dict(row)) for row in rows]
+
+
+async def location_summary(session: AsyncSession, location_id: int) -> LocationSummarySchema:
+    row = (await session.execute(summary_query().where(LocationORM.id == location_id))).mappings().first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Локация не найдена")
+    return LocationSummarySchema.model_validate(dict(row))
@@ -0,0 +1,137 @@
+"""
+Иерархия локаций на таблице замыкания location_tree.
+
+Для каждой локации хранятся строки (предок, потомок, глубина) ко всем ее предкам и к самой себе,
+поэтому поддерево - это одно условие ancestor_id = :id по первичному ключу location_tree,
+а товары и остатки поддерева выбираются одним соединением с items или location_stock.
+Таблицу ведут функции записи локаций (requests.py): add_location при создании и reparent при смене
+родителя. Изменения иерархии выполняются под транзакционной advisory-блокировкой, чтобы параллельные
+переносы не создали цикл и не записали пути от устаревших предков.
+"""
+from typing import Dict, Iterable, Optional, Set, Union
+
+from fastapi import HTTPException
+from sqlalchemy import Select, delete, distinct, exists, func, insert, literal, select, text, true
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from models import LocationORM, LocationStockORM, LocationTreeORM
+from schemas import LocationSubtreeSummarySchema
+import location_stock
+
+# Ключ advisory lock для изменений иерархии
+LOCATION_TREE_LOCK_KEY = 7_305_112_004
+
+
+def subtree_ids(location_id: int) -> Select:
+    """Подзапрос id локаций поддерева, включая саму локацию."""
+    return select(LocationTreeORM.descendant_id).where(LocationTreeORM.ancestor_id == location_id)
+
+
+async def _lock(session: AsyncSession) -> None:
+    await session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": LOCATION_TREE_LOCK_KEY})
+
+
+async def add_location(session: AsyncSession, location_id: int, parent_id: Optional[int]) -> None:
+    """Пути новой локации: к самой себе и ко всем предкам родителя."""
+    if parent_id is None:
+        await session.execute(insert(LocationTreeORM).values(ancestor_id=location_id, descendant_id=location_id, depth=0))
+        return
+    await _lock(session)
+    await session.execute(
+        insert(LocationTreeORM).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(LocationTreeORM.ancestor_id, literal(location_id), LocationTreeORM.depth + 1)
+            .where(LocationTreeORM.descendant_id == parent_id)
+            .union_all(select(literal(location_id), literal(location_id), literal(0))),
+        )
+    )
+
+
+async def reparent(session: AsyncSession, location_id: int, parent_id: Optional[int]) -> None:
+    """Переносит локацию вместе с поддеревом под parent_id (None - в корень)."""
+    await _lock(session)
+    if parent_id is not None:
+        cycle = await session.scalar(select(exists().where(
+            LocationTreeORM.ancestor_id == location_id, LocationTreeORM.descendant_id == parent_id,
+        )))
+        if cycle:
+            raise HTTPException(status_code=400, detail="Нельзя перенести локацию внутрь ее собственного поддерева.")
+    # Удаляем пути от прежних предков ко всему поддереву; пути внутри поддерева не меняются
+    await session.execute(
+        delete(LocationTreeORM)
+        .where(
+            LocationTreeORM.descendant_id.in_(subtree_ids(location_id)),
+            LocationTreeORM.ancestor_id.in_(
+                select(LocationTreeORM.ancestor_id).where(
+                    LocationTreeORM.descendant_id == location_id, LocationTreeORM.ancestor_id != location_id,
+                )
+            ),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if parent_id is None:
+        return
+    above = select(LocationTreeORM.ancestor_id, LocationTreeORM.depth).where(
+        LocationTreeORM.descendant_id == parent_id
+    ).subquery("above")
+    below = select(LocationTreeORM.descendant_id, LocationTreeORM.depth).where(
+        LocationTreeORM.ancestor_id == location_id
+    ).subquery("below")
+    await session.execute(
+        insert(LocationTreeORM).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(above.c.ancestor_id, below.c.descendant_id, above.c.depth + below.c.depth + 1)
+            .select_from(above.join(below, true())),
+        )
+    )
+
+
+async def descendants_of(session: AsyncSession, location_ids: Iterable[int]) -> Dict[int, Set[int]]:
+    """Поддеревья нескольких локаций одним запросом: id -> id локаций поддерева."""
+    result: Dict[int, Set[int]] = {location_id: set() for location_id in location_ids}
+    if not result:
+        return result
+    rows = await session.execute(
+        select(LocationTreeORM.ancestor_id, LocationTreeORM.descendant_id)
+        .where(LocationTreeORM.ancestor_id.in_(result))
+    )
+    for ancestor_id, descendant_id in rows:
+        result[ancestor_id].add(descendant_id)
+    return result
+
+
+async def ancestors_of(conn: Union[AsyncSession, AsyncConnection], location_ids: Iterable[int]) -> Dict[int, Set[int]]:
+    """Предки нескольких локаций одним запросом: id -> id предков, включая саму локацию."""
+    result: Dict[int, Set[int]] = {location_id: {location_id} for location_id in location_ids}
+    if not result:
+        return result
+    rows = await conn.execute(
+        select(LocationTreeORM.descendant_id, LocationTreeORM.ancestor_id)
+        .where(LocationTreeORM.descendant_id.in_(result))
+    )
+    for descendant_id, ancestor_id in rows:
+        result[descendant_id].add(ancestor_id)
+    return result
+
+
+async def subtree_summary(session: AsyncSession, location_id: int) -> LocationSubtreeSummarySchema:
+    """Итоги поддерева по агрегатам location_stock: одно соединение, без сканирования items."""
+    row = (await session.execute(
+        select(
+            LocationORM.id.label("location_id"),
+            LocationORM.name,
+            # У локации может быть несколько строк-шардов location_stock
+            func.count(distinct(LocationTreeORM.descendant_id)).label("location_count"),
+            location_stock.totals(LocationStockORM.item_count).label("item_count"),
+            location_stock.totals(LocationStockORM.total_quantity).label("total_quantity"),
+            location_stock.totals(LocationStockORM.total_weight).label("total_weight"),
+        )
+        .select_from(LocationTreeORM)
+        .join(LocationORM, LocationORM.id == LocationTreeORM.ancestor_id)
+        .outerjoin(LocationStockORM, LocationStockORM.location_id == LocationTreeORM.descendant_id)
+        .where(LocationTreeORM.ancestor_id == location_id)
+        .group_by(LocationORM.id, LocationORM.name)
+    )).mappings().first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Локация не найдена")
+    return LocationSubtreeSummarySchema.model_validate(dict(row))
@@ -1,23 +1,50 @@
 import asyncio
 import os
 from contextlib import asynccontextmanager
+from datetime import datetime
 from typing import Annotated, Optional, List, Dict, Any
 
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, File, HTTPException, Query, Request, UploadFile, WebSocket, WebSocketDisconnect, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, text
 
 # Импортируем из вашего НОВОГО проекта
-from database import async_session_factory, async_engine, Base
+from config import settings
+from database import async_session_factory, async_engine, Base, pool_status, read_router
+import migrations
 from models import UserORM, OperationORM, ItemORM, LocationORM, UserRole, OperationType
 from schemas import (
     UserCreateSchema, UserReadSchema, UserUpdateSchema,
     ItemCreateSchema, ItemReadSchema, ItemUpdateSchema,
     OperationCreateSchema, OperationReadSchema, # Эти схемы будут адаптированы ниже
     LocationCreateSchema, LocationReadSchema, LocationUpdateSchema,
-    DeleteResponseSchema,
+    DeleteResponseSchema, OperationLogPageSchema, PageSchema,
+    OperationBatchResultSchema, ImportReportSchema,
+    StockAtSchema, StockHistorySchema, StockSnapshotResultSchema, LocationSummarySchema,
+    LocationSubtreeSummarySchema,
+    SyncResponseSchema,
 )
+from pagination import DEFAULT_PAGE_LIMIT, MAX_PAGE_LIMIT, PageParams, PageParamsDep
+from cache import CachedUser, item_cache, response_cache, user_cache
+from singleflight import reads as single_flight
+import export
+import importer
+import ledger
+import location_stock
+import location_tree
+import search
+import changes
+import metrics
+import stockstream
+import querydebug
+import profiling
+import admission
+from write_pipeline import OperationWritePipeline
+from serialization import FastJSONResponse
+from conditional import conditional_json
 import requests as rq
 
 # Добавляем необходимые схемы, адаптированные под вашу models.py
@@ -26,6 +53,9 @@ import requests as rq
 
 from pydantic import BaseModel, Field, conint # Для OperationCreateSchema
 
+# Верхняя граница числа строк в POST /api/operations/batch
+MAX_BATCH_OPERATIONS = 1000
+
 # Переопределяем OperationCreateSchema для входных данных
 class AdaptedOperationCreateSchema(BaseModel):
     item_id: int
@@ -38,6 +68,10 @@ class AdaptedOperationCreateSchema(BaseModel):
     from_location_id: Optional[int] = Field(None, description="Начальная локация для перемещения")
     to_location_id: Optional[int] = Field(None, description="Конечная локация для перемещения")
 
+# Пакет операций (например, приемка целой машины): строки применяются по порядку в одной транзакции
+class OperationBatchCreateSchema(BaseModel):
+    operations: List[AdaptedOperationCreateSchema] = Field(..., min_length=1, max_length=MAX_BATCH_OPERATIONS)
+
 # OperationReadSchema будет использовать вашу текущую модель, без доп. полей
 # Предполагается, что в вашей schemas.py уже есть корректная OperationReadSchema
 # с полями id, item_id, user_id, type, note, created_at, created_by_id
@@ -58,30 +92,69 @@ async def get_session():
 
 SessionDep = Annotated[AsyncSession, Depends(get_session)]
 
-# Зависимость для проверки авторизации пользователя
-async def get_current_user(tg_id: int, session: SessionDep) -> UserORM:
-    user = await rq.fetch_user_by_tg_id(tg_id, session)
+# Зависимость для сессии только на чтение: реплика (если настроены) или primary.
+# tg_id берется из запроса, чтобы после своей записи пользователь читал с primary
+async def get_read_session(request: Request):
+    tg_id = request.query_params.get("tg_id")
+    async with read_router.session(int(tg_id) if tg_id and tg_id.isdigit() else None) as session:
+        yield session
+
+ReadSessionDep = Annotated[AsyncSession, Depends(get_read_session)]
+
+# Зависимость для проверки авторизации пользователя.
+# Данные берутся из user_cache, поэтому в большинстве запросов SELECT по users не выполняется.
+# При промахе SELECT идет в primary, и транзакция сразу завершается: соединение возвращается в пул,
+# поэтому эндпоинт на ReadSessionDep не держит одновременно соединение primary и реплики
+async def get_current_user(tg_id: int, session: SessionDep) -> CachedUser:
+    user = await rq.fetch_auth_user(tg_id, session)
+    if session.in_transaction():
+        await session.commit()
     if not user or not user.is_active:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Пользователь не авторизован или неактивен.")
+    # По этому значению после COMMIT включается окно "read your own writes"
+    session.info["actor_tg_id"] = user.tg_id
     return user
 
-CurrentUserDep = Annotated[UserORM, Depends(get_current_user)]
+CurrentUserDep = Annotated[CachedUser, Depends(get_current_user)]
 
 # Зависимость для проверки роли администратора
-async def get_current_admin_user(current_user: CurrentUserDep) -> UserORM:
+async def get_current_admin_user(current_user: CurrentUserDep) -> CachedUser:
     if current_user.role != UserRole.admin:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Недостаточно прав. Требуется роль администратора.")
     return current_user
 
-CurrentAdminUserDep = Annotated[UserORM, Depends(get_current_admin_user)]
+CurrentAdminUserDep = Annotated[CachedUser, Depends(get_current_admin_user)]
+
+# Конвейер групповой фиксации операций (только при OPERATIONS_GROUP_COMMIT)
+write_pipeline = OperationWritePipeline(
+    settings.GROUP_COMMIT_MAX_BATCH, settings.GROUP_COMMIT_MAX_DELAY_MS, settings.GROUP_COMMIT_QUEUE_SIZE,
+)
 
 @asynccontextmanager
 async def lifespan(app_: FastAPI):
-    async with async_engine.begin() as conn:
-        # await conn.run_sync(Base.metadata.drop_all) # Закомментировано
-        await conn.run_sync(Base.metadata.create_all)
-    print("Backend initialized and tables created.")
+    # При старте только сверяем версию схемы; таблицы и индексы создают миграции
+    version = await migrations.ensure_schema(async_engine, auto_migrate=settings.DB_AUTO_MIGRATE)
+    print(f"Backend initialized, schema version {version}.")
+    snapshot_task = None
+    if settings.STOCK_SNAPSHOT_INTERVAL_SECONDS:
+        snapshot_task = asyncio.create_task(ledger.snapshot_loop(settings.STOCK_SNAPSHOT_INTERVAL_SECONDS))
+    cache_watch_task = None
+    if settings.CACHE_VERSION_CHECK_SECONDS:
+        cache_watch_task = asyncio.create_task(rq.watch_cache_versions(settings.CACHE_VERSION_CHECK_SECONDS))
+    stream_task = None
+    if settings.STOCK_STREAM_NOTIFY:
+        stream_task = asyncio.create_task(stockstream.broker.run())
+    if settings.OPERATIONS_GROUP_COMMIT:
+        write_pipeline.start()
     yield
+    # Сначала фиксируем уже принятые операции
+    await write_pipeline.stop()
+    if stream_task:
+        stream_task.cancel()
+    if snapshot_task:
+        snapshot_task.cancel()
+    if cache_watch_task:
+        cache_watch_task.cancel()
 
 app = FastAPI(title="DiplomSklad", lifespan=lifespan)
 
@@ -95,6 +168,49 @@ origins = [
     "http://localhost:8000"
 ]
 
+# Метрики по шаблонам маршрутов для GET /metrics
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Отладочный журнал SQL-команд по запросам (выключен по умолчанию)
+if settings.QUERY_DEBUG:
+    querydebug.install()
+    app.add_middleware(querydebug.QueryDebugMiddleware, strict=settings.QUERY_DEBUG_STRICT)
+
+# Профилирование запроса по флагу администратора; без флага middleware ничего не делает
+profile_store = profiling.ProfileStore(settings.PROFILE_DIR, settings.PROFILE_KEEP)
+if settings.PROFILE_ENABLED:
+    app.add_middleware(profiling.ProfilingMiddleware, store=profile_store)
+
+# Контроль допуска: пределы по классам запросов и быстрый 503 при перегрузке вместо очереди в пуле.
+# Добавляется после остальных, чтобы отказ не доходил до них; CORS остается внешним, и ответ 503 получает его заголовки
+# Предел по умолчанию выводится из пула primary: после get_current_user запрос держит одно соединение
+# (primary или реплики, но чтение переходит на primary, если реплики недоступны), а фоновые задачи воркера
+# занимают соединения primary помимо запросов, и эти соединения вычитаются
+background_connections = (
+    # Снимок остатков держит сессию с advisory-блокировкой и, пока ждет писателей, берет еще одно соединение
+    (2 if settings.STOCK_SNAPSHOT_INTERVAL_SECONDS else 0)
+    + (1 if settings.CACHE_VERSION_CHECK_SECONDS else 0)
+    + (1 if settings.STOCK_STREAM_NOTIFY else 0) # соединение LISTEN рассылки событий остатков
+    + (1 if settings.OPERATIONS_GROUP_COMMIT else 0)
+)
+admission_total = settings.ADMISSION_TOTAL_LIMIT or max(
+    async_engine.pool.size() + settings.DB_MAX_OVERFLOW - background_connections, 1,
+)
+admission_controller = admission.AdmissionController(
+    admission_total,
+    {
+        admission.SCAN: (settings.ADMISSION_SCAN_LIMIT or admission_total, settings.ADMISSION_SCAN_QUEUE),
+        admission.WRITE: (settings.ADMISSION_WRITE_LIMIT or admission_total, settings.ADMISSION_WRITE_QUEUE),
+        admission.READ: (settings.ADMISSION_READ_LIMIT or admission_total, settings.ADMISSION_READ_QUEUE),
+        admission.HEAVY: (settings.ADMISSION_HEAVY_LIMIT or admission_total, settings.ADMISSION_HEAVY_QUEUE),
+    },
+    settings.ADMISSION_MAX_WAIT_SECONDS,
+)
+if settings.ADMISSION_ENABLED:
+    app.add_middleware(
+        admission.AdmissionMiddleware, controller=admission_controller, retry_after=settings.ADMISSION_RETRY_AFTER_SECONDS,
+    )
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -103,23 +219,116 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Эндпоинты списков возвращают FastJSONResponse: строки уже приведены к типам схем при выборке,
+# поэтому повторная валидация по response_model и jsonable_encoder пропускаются (response_model
+# остается для документации OpenAPI)
+
 # --- Эндпоинты для настройки и инициализации ---
 @app.post("/setup_database")
 async def setup_database_endpoint(session: SessionDep):
     """
-    Создает таблицы в базе данных и вставляет тестовых пользователей.
+    Пересоздает схему базы данных с нуля через миграции и вставляет тестовых пользователей.
     """
     async with async_engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(text("DROP TABLE IF EXISTS schema_version"))
+    await migrations.upgrade(async_engine)
 
     user1 = UserORM(tg_id=732334353, username="admin_user", role=UserRole.admin, is_active=True)
     user2 = UserORM(tg_id=1345214313, username="worker_user", role=UserRole.worker, is_active=True)
     session.add_all([user1, user2])
     await session.commit()
+    # Таблицы пересозданы, закэшированные пользователи больше не соответствуют БД
+    user_cache.clear()
+    item_cache.clear()
+    response_cache.clear()
 
     return {"ok": True, "message": "Database setup complete and test users inserted."}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """
+    Метрики процесса в текстовом формате Prometheus: запросы, задержки, SQL-команды и время в БД по маршрутам.
+    """
+    pool = pool_status()
+    gauges = {
+        "db_pool_checked_out": pool["checked_out"],
+        "db_pool_idle": pool["idle"],
+        "db_pool_overflow": pool["overflow"],
+        "db_pool_acquire_timeouts": pool["waits"]["timeouts"],
+        "stock_stream_subscribers": stockstream.broker.stats()["subscribers"],
+    }
+    counters = {}
+    if settings.ADMISSION_ENABLED:
+        # Отказы допуска не доходят до MetricsMiddleware, поэтому считаются по классам отдельно
+        counters = {"admission_rejected_total": {}, "admission_timed_out_total": {}}
+        for name, state in admission_controller.stats()["classes"].items():
+            gauges[f"admission_{name}_active"] = state["active"]
+            gauges[f"admission_{name}_queued"] = state["queued"]
+            counters["admission_rejected_total"][f'class="{name}"'] = state["rejected"]
+            counters["admission_timed_out_total"][f'class="{name}"'] = state["timed_out"]
+    return PlainTextResponse(metrics.registry.render(gauges, counters), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/admin/db/pool")
+async def get_db_pool_endpoint(current_admin: CurrentAdminUserDep):
+    """
+    Состояние пула соединений текущего воркера: занятые, свободные и overflow-соединения,
+    а также статистика ожидания соединения и групповой фиксации операций (только для администраторов).
+    """
+    if settings.OPERATIONS_GROUP_COMMIT:
+        return {**pool_status(), "write_pipeline": write_pipeline.stats()}
+    return pool_status()
+
+@app.get("/api/admin/admission")
+async def get_admission_endpoint(current_admin: CurrentAdminUserDep):
+    """
+    Контроль допуска текущего воркера: занятые места и глубина очередей по классам запросов,
+    число отказов 503 (только для администраторов). Маршрут сам не ограничивается.
+    """
+    return {**admission_controller.stats(), "background_connections": background_connections}
+
+@app.get("/api/admin/debug/queries")
+async def query_debug_reports(current_admin: CurrentAdminUserDep, limit: int = Query(50, ge=1, le=querydebug.MAX_REPORTS)):
+    """
+    Последние запросы с замечаниями отладки SQL: повторы, N+1, ленивые и неиспользованные загрузки связей,
+    превышение бюджета (только для администраторов, при QUERY_DEBUG).
+    """
+    if not settings.QUERY_DEBUG:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Отладка SQL выключена (QUERY_DEBUG).")
+    return list(querydebug.recent_reports)[-limit:]
+
+@app.get("/api/admin/profiles")
+async def list_profiles_endpoint(current_admin: CurrentAdminUserDep, limit: int = Query(50, ge=1, le=1000)):
+    """
+    Сохраненные профили запросов, новые первыми: маршрут, статус, длительность, число SQL-команд
+    (только для администраторов). Профиль снимается запросом с X-Profile: 1 или ?profile=1.
+    """
+    return await asyncio.to_thread(profile_store.list, limit)
+
+@app.get("/api/admin/profiles/{profile_id}")
+async def get_profile_endpoint(profile_id: str, current_admin: CurrentAdminUserDep, format: str = Query("pstats", pattern="^(pstats|json)$")):
+    """
+    Файл профиля: pstats (format=pstats) или метаданные с хронологией SQL-команд (format=json).
+    """
+    path = profile_store.path(profile_id, ".prof" if format == "pstats" else ".json")
+    if path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Профиль не найден.")
+    if format == "json":
+        return FileResponse(path, media_type="application/json")
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
+
+@app.get("/api/admin/cache/stats")
+async def get_cache_stats_endpoint(current_admin: CurrentAdminUserDep):
+    """
+    Статистика внутрипроцессных кэшей (размер, попадания, промахи) и объединения одновременных чтений
+    (только для администраторов).
+    Счетчики относятся к текущему воркеру.
+    """
+    return {
+        "users": user_cache.stats(), "items": item_cache.stats(), "responses": response_cache.stats(),
+        "single_flight": single_flight.stats(),
+    }
+
 # --- Эндпоинты для пользователей (Users) ---
 
 @app.post("/api/register", response_model=UserReadSchema)
@@ -164,13 +373,12 @@ async def get_user_by_tg_id(tg_id: int, session: SessionDep, current_user: Curre
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Пользователь не найден")
     return rq.serialize_user(user)
 
-@app.get("/api/users", response_model=List[UserReadSchema])
-async def get_all_users_endpoint(session: SessionDep, current_admin: CurrentAdminUserDep):
+@app.get("/api/users", response_model=PageSchema)
+async def get_all_users_endpoint(session: ReadSessionDep, current_admin: CurrentAdminUserDep, page: PageParamsDep):
     """
-    Получение списка всех пользователей (только для администраторов).
+    Получение списка пользователей постранично (только для администраторов).
     """
-    users = await rq.get_all_users(session)
-    return users
+    return FastJSONResponse(await rq.get_all_users(session, page))
 
 @app.put("/api/users/{user_id}", response_model=UserReadSchema)
 async def update_user_endpoint(user_id: int, user_data: UserUpdateSchema, session: SessionDep, current_admin: CurrentAdminUserDep):
@@ -204,6 +412,7 @@ async def delete_user_endpoint(user_id: int, session: SessionDep, current_admin:
 # --- Эндпоинты для товаров (Items) ---
 
 @app.get("/api/items/scan/{code}", response_model=Dict[str, Any])
+@querydebug.query_budget(2)
 async def scan_item_endpoint(code: str, session: SessionDep, current_user: CurrentUserDep):
     """
     Сканирование товара по коду. Возвращает существующий товар или информацию для создания нового.
@@ -211,6 +420,7 @@ async def scan_item_endpoint(code: str, session: SessionDep, current_user: Curre
     return await rq.scan_item_by_code(code, session)
 
 @app.post("/api/items", response_model=ItemReadSchema)
+@querydebug.query_budget(14)
 async def create_item_endpoint(item_data: ItemCreateSchema, session: SessionDep, current_user: CurrentUserDep):
     """
     Создает новый товар в базе данных. Автоматически создает операцию "приемка".
@@ -227,23 +437,57 @@ async def create_item_endpoint(item_data: ItemCreateSchema, session: SessionDep,
         await session.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Внутренняя ошибка сервера: {e}")
 
-@app.get("/api/items", response_model=List[ItemReadSchema])
-async def get_all_items_endpoint(session: SessionDep, current_user: CurrentUserDep):
+@app.post("/api/items/import", response_model=ImportReportSchema)
+async def import_items_endpoint(
+    current_admin: CurrentAdminUserDep,
+    file: UploadFile = File(..., description="CSV с заголовком или NDJSON с полями ItemCreateSchema"),
+    file_format: Optional[str] = Query(None, alias="format", description="csv или ndjson; по умолчанию по расширению файла"),
+):
+    """
+    Массовый импорт товаров (только для администраторов). Для каждого товара создается операция "приемка".
+    Файл обрабатывается пачками, каждая пачка фиксируется отдельно; отклоненные строки перечислены в отчете.
     """
-    Получение списка всех товаров.
+    try:
+        fmt = importer.detect_format(file.filename, file_format)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return await importer.import_items(file.file, fmt, current_admin.id)
+
+@app.get("/api/items", response_model=PageSchema)
+async def get_all_items_endpoint(request: Request, session: ReadSessionDep, current_user: CurrentUserDep, page: PageParamsDep):
+    """
+    Получение списка товаров постранично. Параметр fields= ограничивает набор возвращаемых полей.
+    Поддерживает If-None-Match: пока товары не менялись, ответ 304.
+    """
+    return await conditional_json(request, session, ("items",), lambda: rq.get_items(session, page))
+
+# Объявлен до /api/items/{item_id}, иначе "search" попадет в параметр пути
+@app.get("/api/items/search", response_model=PageSchema)
+async def search_items_endpoint(
+    session: ReadSessionDep,
+    current_user: CurrentUserDep,
+    q: str = Query(..., min_length=2, max_length=256, description="Префикс кода или часть названия/описания"),
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+    cursor: Optional[str] = Query(None, description="Курсор next_cursor из предыдущей страницы"),
+):
     """
-    items = await rq.get_items(session)
-    return items
+    Поиск товаров: префикс кода или нечеткое совпадение с названием и описанием.
+    Результаты отсортированы по убыванию релевантности (поле score).
+    """
+    items, next_cursor = await search.search_items(session, q, limit, cursor)
+    return FastJSONResponse(PageSchema.model_construct(items=items, next_cursor=next_cursor))
 
 @app.get("/api/items/{item_id}", response_model=ItemReadSchema)
-async def get_single_item_endpoint(item_id: int, session: SessionDep, current_user: CurrentUserDep):
+async def get_single_item_endpoint(item_id: int, request: Request, session: ReadSessionDep, current_user: CurrentUserDep):
     """
-    Получение информации о товаре по ID.
+    Получение информации о товаре по ID. Поддерживает If-None-Match.
     """
-    item = await rq.get_item_by_id(item_id, session)
-    if not item:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Товар не найден")
-    return item
+    async def build():
+        item = await rq.get_item_by_id(item_id, session)
+        if not item:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Товар не найден")
+        return item
+    return await conditional_json(request, session, ("items",), build)
 
 @app.put("/api/items/{item_id}", response_model=ItemReadSchema)
 async def update_item_endpoint(item_id: int, item_data: ItemUpdateSchema, session: SessionDep, current_user: CurrentUserDep):
@@ -275,24 +519,45 @@ async def delete_item_endpoint(item_id: int, session: SessionDep, current_user:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Внутренняя ошибка сервера: {e}")
 
 
-@app.get("/api/users/{tg_id}/items", response_model=List[ItemReadSchema])
-async def get_user_items_endpoint(tg_id: int, session: SessionDep, current_user: CurrentUserDep):
+@app.get("/api/users/{tg_id}/items", response_model=PageSchema)
+async def get_user_items_endpoint(tg_id: int, session: ReadSessionDep, current_user: CurrentUserDep, page: PageParamsDep):
     """
     Получение всех товаров, связанных с пользователем по его Telegram ID.
     (ВНИМАНИЕ: В текущей ItemORM нет user_id. Эта функция вернет ВСЕ товары.)
     """
     if current_user.tg_id != tg_id and current_user.role != UserRole.admin:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Недостаточно прав для просмотра товаров другого пользователя.")
-    return await rq.get_items_by_user_tg(tg_id, session)
+    return FastJSONResponse(await rq.get_items_by_user_tg(tg_id, session, page))
 
 # --- Эндпоинты для локаций (Locations) ---
 
-@app.get("/api/locations", response_model=List[LocationReadSchema])
-async def get_locations_endpoint(session: SessionDep, current_user: CurrentUserDep):
+@app.get("/api/locations", response_model=PageSchema)
+async def get_locations_endpoint(request: Request, session: ReadSessionDep, current_user: CurrentUserDep, page: PageParamsDep):
+    """
+    Получение списка локаций постранично. Поддерживает If-None-Match.
+    """
+    return await conditional_json(request, session, ("locations",), lambda: rq.fetch_all_locations(session, page))
+
+# Сводки объявлены до /api/locations/{location_id}, иначе "summary" попадет в параметр пути
+@app.get("/api/locations/summary", response_model=List[LocationSummarySchema])
+async def get_locations_summary_endpoint(request: Request, session: ReadSessionDep, current_user: CurrentUserDep):
+    """
+    Сводка по всем локациям: число товаров, суммарное количество и вес.
+    Читается из агрегатов location_stock, без сканирования товаров. Поддерживает If-None-Match.
+    """
+    # Агрегаты меняются вместе с товарами, поэтому ответ зависит от версий обеих таблиц
+    return await conditional_json(
+        request, session, ("items", "locations"), lambda: location_stock.location_summaries(session),
+    )
+
+@app.get("/api/locations/{location_id}/summary", response_model=LocationSummarySchema)
+async def get_location_summary_endpoint(location_id: int, request: Request, session: ReadSessionDep, current_user: CurrentUserDep):
     """
-    Получение списка всех локаций.
+    Сводка по одной локации: число товаров, суммарное количество и вес. Поддерживает If-None-Match.
     """
-    return await rq.fetch_all_locations(session)
+    return await conditional_json(
+        request, session, ("items", "locations"), lambda: location_stock.location_summary(session, location_id),
+    )
 
 @app.post("/api/locations", response_model=LocationReadSchema)
 async def create_location_endpoint(location_data: LocationCreateSchema, session: SessionDep, current_user: CurrentUserDep):
@@ -322,12 +587,17 @@ async def update_location_endpoint(location_id: int, location_data: LocationUpda
     return updated_location
 
 @app.delete("/api/locations/{location_id}", response_model=DeleteResponseSchema)
-async def delete_location_endpoint(location_id: int, session: SessionDep, current_user: CurrentUserDep):
+async def delete_location_endpoint(
+    location_id: int,
+    session: SessionDep,
+    current_user: CurrentUserDep,
+    recursive: bool = Query(False, description="Удалить локацию вместе со всеми вложенными (если в них нет товаров)"),
+):
     """
-    Удаление локации по ID.
+    Удаление локации по ID. Локацию с вложенными можно удалить только с recursive=true.
     """
     try:
-        deleted = await rq.delete_existing_location(location_id, session)
+        deleted = await rq.delete_existing_location(location_id, session, recursive=recursive)
         if not deleted:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Локация не найдена")
         await session.commit()
@@ -339,19 +609,39 @@ async def delete_location_endpoint(location_id: int, session: SessionDep, curren
         await session.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Внутренняя ошибка сервера: {e}")
 
+@app.get("/api/locations/{location_id}/subtree/items", response_model=PageSchema)
+async def get_subtree_items_endpoint(location_id: int, session: ReadSessionDep, current_user: CurrentUserDep, page: PageParamsDep):
+    """
+    Товары локации и всех вложенных в нее (зона, стеллаж, ячейки) постранично.
+    """
+    return FastJSONResponse(await rq.get_subtree_items(location_id, session, page))
+
+@app.get("/api/locations/{location_id}/subtree/summary", response_model=LocationSubtreeSummarySchema)
+async def get_subtree_summary_endpoint(location_id: int, request: Request, session: ReadSessionDep, current_user: CurrentUserDep):
+    """
+    Итоги по локации вместе с вложенными: число локаций и товаров, суммарное количество и вес.
+    Считаются по агрегатам location_stock. Поддерживает If-None-Match.
+    """
+    return await conditional_json(
+        request, session, ("items", "locations"), lambda: location_tree.subtree_summary(session, location_id),
+    )
+
 @app.get("/api/locations/{location_id}", response_model=LocationReadSchema)
-async def get_single_location_endpoint(location_id: int, session: SessionDep, current_user: CurrentUserDep):
+async def get_single_location_endpoint(location_id: int, request: Request, session: ReadSessionDep, current_user: CurrentUserDep):
     """
-    Получение информации о локации по ID.
+    Получение информации о локации по ID. Поддерживает If-None-Match.
     """
-    location = await rq.fetch_location_by_id(location_id, session)
-    if not location:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Локация не найдена")
-    return rq.serialize_location(location)
+    async def build():
+        location = await rq.fetch_location_by_id(location_id, session)
+        if not location:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Локация не найдена")
+        return rq.serialize_location(location)
+    return await conditional_json(request, session, ("locations",), build)
 
 # --- Эндпоинты для операций (Operations) ---
 
 @app.post("/api/operations", response_model=OperationReadSchema)
+@querydebug.query_budget(10)
 async def create_operation_endpoint(
     op_data: AdaptedOperationCreateSchema, # Используем адаптированную схему для входных данных
     session: SessionDep,
@@ -360,7 +650,10 @@ async def create_operation_endpoint(
     """
     Создание и обработка новой операции с товаром (отгрузка, приемка, инвентаризация, перемещение).
     Количество и локация (для перемещения) товара будут обновлены в ItemORM.
+    При OPERATIONS_GROUP_COMMIT операция фиксируется в общей транзакции с соседними запросами.
     """
+    if settings.OPERATIONS_GROUP_COMMIT:
+        return await write_pipeline.submit(op_data, current_user.id, current_user.tg_id)
     try:
         # Передаем tg_id текущего пользователя в функцию rq.process_operation
         result = await rq.process_operation(op_data, current_user.tg_id, session)
@@ -373,10 +666,245 @@ async def create_operation_endpoint(
         await session.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Внутренняя ошибка сервера: {e}")
 
-@app.get("/api/operations/log", response_model=List[OperationReadSchema])
-async def get_operations_log_endpoint(session: SessionDep, current_admin: CurrentAdminUserDep):
+@app.post("/api/operations/batch", response_model=OperationBatchResultSchema)
+async def create_operations_batch_endpoint(
+    batch: OperationBatchCreateSchema,
+    session: SessionDep,
+    current_user: CurrentUserDep,
+    atomic: bool = Query(False, description="Если true, ошибка в любой строке отменяет весь пакет"),
+):
     """
-    Получение журнала всех операций (только для администраторов).
+    Пакетная обработка операций одной транзакцией. Возвращает результат по каждой строке.
+    По умолчанию ошибочные строки пропускаются, остальные применяются; с atomic=true при любой
+    ошибке ничего не сохраняется, а ответ 409 содержит результаты строк.
     """
-    operations = await rq.get_all_operations(session)
-    return operations
\ No newline at end of file
+    try:
+        result = await rq.process_operations_batch(batch.operations, current_user.tg_id, session)
+        if atomic and result.failed:
+            await session.rollback()
+            return JSONResponse(status_code=status.HTTP_409_CONFLICT, content=jsonable_encoder(result))
+        await session.commit()
+        return result
+    except HTTPException as e:
+        await session.rollback()
+        raise e
+    except Exception as e:
+        await session.rollback()
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Внутренняя ошибка сервера: {e}")
+
+@app.get("/api/operations/log", response_model=OperationLogPageSchema)
+async def get_operations_log_endpoint(
+    session: ReadSessionDep,
+    current_admin: CurrentAdminUserDep,
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+    cursor: Optional[str] = Query(None, description="Курсор next_cursor из предыдущей страницы"),
+    item_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    op_type: Optional[OperationType] = Query(None, alias="type"),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+):
+    """
+    Получение журнала операций постранично, от новых к старым (только для администраторов).
+    Поддерживает фильтры по товару, пользователю, типу операции и интервалу дат.
+    """
+    page = await rq.get_operations_page(
+        session, limit=limit, cursor=cursor, item_id=item_id, user_id=user_id,
+        op_type=op_type, date_from=date_from, date_to=date_to,
+    )
+    return FastJSONResponse(page)
+
+@app.get("/api/operations/log/stream")
+async def stream_operations_log_endpoint(
+    current_admin: CurrentAdminUserDep,
+    item_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    op_type: Optional[OperationType] = Query(None, alias="type"),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+):
+    """
+    Потоковая выгрузка журнала операций в формате NDJSON (только для администраторов).
+    Строки читаются серверным курсором, поэтому потребление памяти не зависит от размера журнала.
+    """
+    return StreamingResponse(
+        rq.stream_operations_ndjson(
+            item_id=item_id, user_id=user_id, op_type=op_type,
+            date_from=date_from, date_to=date_to,
+        ),
+        media_type="application/x-ndjson",
+    )
+
+# --- Эндпоинты для выгрузки (Export) ---
+
+ExportFormatQuery = Annotated[str, Query(alias="format", pattern="^(csv|ndjson)$", description="csv или ndjson")]
+ExportGzipQuery = Annotated[bool, Query(description="Сжать выгрузку gzip")]
+
+def _export_response(query, name: str, fmt: str, compress: bool) -> StreamingResponse:
+    return StreamingResponse(
+        export.stream_query(query, fmt, compress),
+        media_type=export.export_media_type(fmt, compress),
+        headers=export.export_headers(name, fmt, compress),
+    )
+
+@app.get("/api/export/items")
+async def export_items_endpoint(current_admin: CurrentAdminUserDep, fmt: ExportFormatQuery = "csv", gzip: ExportGzipQuery = False):
+    """
+    Полная выгрузка товаров с названием локации (только для администраторов).
+    """
+    return _export_response(rq.items_export_query(), "items", fmt, gzip)
+
+@app.get("/api/export/stock")
+async def export_stock_endpoint(current_admin: CurrentAdminUserDep, fmt: ExportFormatQuery = "csv", gzip: ExportGzipQuery = False):
+    """
+    Выгрузка остатков по локациям: число товаров, суммарное количество и вес (только для администраторов).
+    """
+    return _export_response(rq.stock_export_query(), "stock", fmt, gzip)
+
+@app.get("/api/export/operations")
+async def export_operations_endpoint(
+    current_admin: CurrentAdminUserDep,
+    fmt: ExportFormatQuery = "csv",
+    gzip: ExportGzipQuery = False,
+    item_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    op_type: Optional[OperationType] = Query(None, alias="type"),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+):
+    """
+    Выгрузка журнала операций с теми же фильтрами, что и /api/operations/log (только для администраторов).
+    """
+    query = rq.operations_export_query(item_id, user_id, op_type, date_from, date_to)
+    return _export_response(query, "operations", fmt, gzip)
+
+
+# --- Эндпоинты для остатков на момент времени (Stock Ledger) ---
+
+@app.get("/api/stock/at", response_model=StockAtSchema)
+async def get_stock_at_endpoint(
+    at: datetime,
+    session: ReadSessionDep,
+    current_user: CurrentUserDep,
+    item_id: Optional[int] = None,
+    location_id: Optional[int] = None,
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+    cursor: Optional[str] = Query(None, description="Курсор next_cursor из предыдущей страницы"),
+):
+    """
+    Остатки на момент at (всех товаров, одного товара или товаров в локации) постранично по item_id.
+    Считаются по ближайшему снимку и журналу остатков после него.
+    """
+    params = PageParams(limit=limit, cursor=cursor, sort=None, fields=None)
+    return FastJSONResponse(await ledger.stock_at(session, at, params, item_id=item_id, location_id=location_id))
+
+@app.get("/api/stock/history", response_model=StockHistorySchema)
+async def get_stock_history_endpoint(
+    item_id: int,
+    date_from: datetime,
+    date_to: datetime,
+    session: ReadSessionDep,
+    current_user: CurrentUserDep,
+):
+    """
+    Движение товара за период: остаток на начало, изменения из журнала и остаток на конец.
+    """
+    return await ledger.stock_history(session, item_id, date_from, date_to)
+
+@app.post("/api/admin/stock/snapshot", response_model=StockSnapshotResultSchema)
+async def take_stock_snapshot_endpoint(current_admin: CurrentAdminUserDep):
+    """
+    Внеочередной снимок остатков (только для администраторов).
+    """
+    return await ledger.take_snapshot()
+
+
+# --- Дельта-синхронизация для офлайн-клиентов (Sync) ---
+
+@app.get("/api/sync", response_model=SyncResponseSchema)
+async def sync_endpoint(
+    session: ReadSessionDep,
+    current_user: CurrentUserDep,
+    since: int = Query(0, ge=0, description="next_since из предыдущего ответа; 0 - полная загрузка каталога"),
+    limit: int = Query(changes.SYNC_DEFAULT_LIMIT, ge=1, le=changes.SYNC_MAX_LIMIT),
+):
+    """
+    Товары и локации, созданные или измененные после since, и id удаленных (надгробия).
+    Клиент повторяет запрос с since = next_since, пока has_more = true.
+    """
+    return FastJSONResponse(await changes.sync_changes(session, since, limit))
+
+
+# --- Изменения остатков в реальном времени (WebSocket / SSE) ---
+
+async def _authorize_stream(tg_id: int) -> Optional[CachedUser]:
+    # Короткая сессия только на проверку: долгоживущее подключение не должно держать соединение пула
+    async with async_session_factory() as session:
+        user = await rq.fetch_auth_user(tg_id, session)
+    return user if user and user.is_active else None
+
+@app.websocket("/ws/stock")
+async def stock_websocket(
+    websocket: WebSocket,
+    tg_id: int,
+    location_id: List[int] = Query([]),
+    item_id: List[int] = Query([]),
+):
+    """
+    События изменения товаров (JSON на сообщение) из всех воркеров. Фильтры location_id и item_id можно
+    повторять; фильтр по локации включает ее поддерево, без фильтров приходят все события.
+    При переполнении очереди клиент получает overflow и отключается.
+    """
+    if len(location_id) + len(item_id) > stockstream.MAX_FILTER_IDS or not await _authorize_stream(tg_id):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    subscription = stockstream.broker.subscribe(location_id, item_id)
+    try:
+        while True:
+            event = await subscription.next_event()
+            if event is None:
+                await websocket.send_text('{"type":"ping"}')
+                continue
+            await websocket.send_text(event)
+            if event is stockstream.OVERFLOW_EVENT:
+                await websocket.close()
+                return
+    except WebSocketDisconnect:
+        pass
+    finally:
+        stockstream.broker.unsubscribe(subscription)
+
+@app.get("/api/stock/events")
+async def stock_events_endpoint(
+    tg_id: int,
+    location_id: List[int] = Query([]),
+    item_id: List[int] = Query([]),
+):
+    """
+    Те же события, что /ws/stock, в формате Server-Sent Events (для клиентов без WebSocket).
+    """
+    if len(location_id) + len(item_id) > stockstream.MAX_FILTER_IDS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Не больше {stockstream.MAX_FILTER_IDS} фильтров.")
+    if not await _authorize_stream(tg_id):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Пользователь не авторизован или неактивен.")
+
+    async def events():
+        # Подписка создается в генераторе: ее снимает finally, даже если клиент ушел сразу
+        subscription = stockstream.broker.subscribe(location_id, item_id)
+        try:
+            while True:
+                event = await subscription.next_event()
+                if event is None:
+                    yield ": ping\n\n"
+                    continue
+                yield f"data: {event}\n\n"
+                if event is stockstream.OVERFLOW_EVENT:
+                    return
+        finally:
+            stockstream.broker.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
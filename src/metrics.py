@@ -0,0 +1,182 @@
+"""
+Метрики запросов в формате Prometheus (GET /metrics).
+
+MetricsMiddleware - чистое ASGI-middleware без BaseHTTPMiddleware: на каждый запрос оно
+запоминает время начала, статус ответа и шаблон маршрута (/api/items/scan/{code}, а не сам путь,
+чтобы число рядов не росло с числом кодов). Число SQL-команд и время в БД считают обработчики
+событий движка before/after_cursor_execute и пишут их в статистику текущего запроса через contextvar.
+Все счетчики - обычные словари одного процесса: при нескольких воркерах каждый отдает свои значения.
+"""
+import bisect
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Границы бакетов гистограммы длительности запроса, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNMATCHED_ROUTE = "unmatched"
+
+
+class RequestStats:
+    __slots__ = ("statements", "db_seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+
+
+_current_request: ContextVar[Optional[RequestStats]] = ContextVar("metrics_request", default=None)
+
+
+class RouteMetrics:
+    __slots__ = ("count", "latency_sum", "buckets", "statements", "db_seconds", "statuses")
+
+    def __init__(self):
+        self.count = 0
+        self.latency_sum = 0.0
+        self.buckets: List[int] = [0] * (len(LATENCY_BUCKETS) + 1) # последний - +Inf
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.statuses: Dict[int, int] = {}
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.routes: Dict[Tuple[str, str], RouteMetrics] = {}
+        # Все SQL-команды процесса, включая фоновые задачи вне запросов
+        self.db_statements = 0
+        self.db_seconds = 0.0
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float, stats: RequestStats) -> None:
+        metrics = self.routes.get((method, route))
+        if metrics is None:
+            metrics = self.routes[(method, route)] = RouteMetrics()
+        metrics.count += 1
+        metrics.latency_sum += seconds
+        metrics.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        metrics.statements += stats.statements
+        metrics.db_seconds += stats.db_seconds
+        metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+
+    def observe_statement(self, seconds: float) -> None:
+        self.db_statements += 1
+        self.db_seconds += seconds
+        stats = _current_request.get()
+        if stats is not None:
+            stats.statements += 1
+            stats.db_seconds += seconds
+
+    def render(self, gauges: Optional[Dict[str, float]] = None,
+               counters: Optional[Dict[str, Dict[str, float]]] = None) -> str:
+        """gauges: имя -> значение; counters: имя -> {метки в формате 'class="scan"' -> значение}."""
+        lines = [
+            "# HELP http_requests_total Обработанные HTTP-запросы по маршруту и статусу.",
+            "# TYPE http_requests_total counter",
+        ]
+        routes = sorted(self.routes.items())
+        for (method, route), metrics in routes:
+            for status, count in sorted(metrics.statuses.items()):
+                lines.append(f'http_requests_total{{method="{method}",route="{route}",status="{status}"}} {count}')
+
+        lines += [
+            "# HELP http_request_duration_seconds Длительность обработки HTTP-запроса.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route), metrics in routes:
+            labels = f'method="{method}",route="{route}"'
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, metrics.buckets):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {metrics.count}')
+            lines.append(f"http_request_duration_seconds_sum{{{labels}}} {metrics.latency_sum:.6f}")
+            lines.append(f"http_request_duration_seconds_count{{{labels}}} {metrics.count}")
+
+        lines += [
+            "# HELP http_request_db_statements_total SQL-команды, выполненные при обработке запросов.",
+            "# TYPE http_request_db_statements_total counter",
+        ]
+        for (method, route), metrics in routes:
+            lines.append(f'http_request_db_statements_total{{method="{method}",route="{route}"}} {metrics.statements}')
+        lines += [
+            "# HELP http_request_db_seconds_total Время выполнения SQL-команд при обработке запросов.",
+            "# TYPE http_request_db_seconds_total counter",
+        ]
+        for (method, route), metrics in routes:
+            lines.append(f'http_request_db_seconds_total{{method="{method}",route="{route}"}} {metrics.db_seconds:.6f}')
+
+        lines += [
+            "# HELP db_statements_total Все SQL-команды процесса.",
+            "# TYPE db_statements_total counter",
+            f"db_statements_total {self.db_statements}",
+            "# HELP db_seconds_total Суммарное время SQL-команд процесса.",
+            "# TYPE db_seconds_total counter",
+            f"db_seconds_total {self.db_seconds:.6f}",
+        ]
+        for name, series in (counters or {}).items():
+            lines.append(f"# TYPE {name} counter")
+            lines += [f"{name}{{{labels}}} {value}" for labels, value in series.items()]
+        for name, value in (gauges or {}).items():
+            lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("metrics_started")
+    if started:
+        registry.observe_statement(time.perf_counter() - started.pop())
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    # Для упавшей команды after_cursor_execute не вызывается: отметку начала снимаем здесь,
+    # иначе она осталась бы в conn.info соединения пула, а время команды не попало бы в метрики
+    if context.connection is not None:
+        _after_cursor_execute(context.connection, None, context.statement, context.parameters,
+                              context.execution_context, False)
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = _current_request.set(stats)
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_request.reset(token)
+            # FastAPI кладет найденный маршрут в scope["route"]; путь без маршрута не размножает ряды
+            route = scope.get("route")
+            registry.observe_request(
+                scope["method"],
+                getattr(route, "path", UNMATCHED_ROUTE),
+                status_code,
+                time.perf_counter() - started,
+                stats,
+            )
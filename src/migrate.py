@@ -0,0 +1,29 @@
+"""
+Управление версией схемы БД.
+    python migrate.py status   - текущая и последняя доступная версия
+    python migrate.py upgrade  - применить недостающие миграции
+"""
+import argparse
+import asyncio
+
+from database import async_engine
+import migrations
+
+
+async def main(command: str) -> None:
+    try:
+        if command == "upgrade":
+            applied = await migrations.upgrade(async_engine)
+            print(f"Применено миграций: {len(applied)}")
+        else:
+            async with async_engine.connect() as conn:
+                version = await migrations.current_version(conn)
+            print(f"Версия схемы: {version}, последняя миграция: {migrations.latest_version()}")
+    finally:
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Миграции схемы БД")
+    parser.add_argument("command", choices=["status", "upgrade"])
+    asyncio.run(main(parser.parse_args().command))
@@ -0,0 +1,103 @@
+"""
+Версионированные миграции схемы БД.
+
+Каждая миграция - модуль migrations/versions/vNNNN_<описание>.py с константами VERSION, DESCRIPTION
+и корутиной upgrade(conn). Миграции только накатываются вперед: уже примененный скрипт
+не редактируется, исправление оформляется новой версией. Примененные версии записываются
+в таблицу schema_version, каждая миграция выполняется в отдельной транзакции.
+
+Применение вручную:  python migrate.py upgrade
+Текущее состояние:   python migrate.py status
+"""
+import importlib
+import pkgutil
+from types import ModuleType
+from typing import List
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from migrations import versions
+
+# Ключ advisory lock, чтобы несколько воркеров не накатывали миграции одновременно
+MIGRATION_LOCK_KEY = 7_305_112_001
+
+SCHEMA_VERSION_DDL = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    description VARCHAR(256) NOT NULL,
+    applied_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now()
+)
+"""
+
+
+def load_migrations() -> List[ModuleType]:
+    modules = [
+        importlib.import_module(f"{versions.__name__}.{info.name}")
+        for info in pkgutil.iter_modules(versions.__path__)
+        if info.name.startswith("v")
+    ]
+    modules.sort(key=lambda module: module.VERSION)
+    numbers = [module.VERSION for module in modules]
+    if numbers != list(range(1, len(numbers) + 1)):
+        raise RuntimeError(f"Номера миграций должны идти подряд с 1, найдены: {numbers}")
+    return modules
+
+
+def latest_version() -> int:
+    migrations = load_migrations()
+    return migrations[-1].VERSION if migrations else 0
+
+
+async def current_version(conn: AsyncConnection) -> int:
+    # Один запрос без интроспекции таблиц: to_regclass вернет NULL, если schema_version еще нет
+    exists = await conn.scalar(text("SELECT to_regclass('schema_version') IS NOT NULL"))
+    if not exists:
+        return 0
+    return await conn.scalar(text("SELECT coalesce(max(version), 0) FROM schema_version"))
+
+
+async def upgrade(engine: AsyncEngine) -> List[int]:
+    """Применяет все недостающие миграции и возвращает номера примененных версий."""
+    applied = []
+    async with engine.connect() as lock_conn:
+        await lock_conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(text(SCHEMA_VERSION_DDL))
+                version = await current_version(conn)
+            for migration in load_migrations():
+                if migration.VERSION <= version:
+                    continue
+                async with engine.begin() as conn:
+                    await migration.upgrade(conn)
+                    await conn.execute(
+                        text("INSERT INTO schema_version (version, description) VALUES (:version, :description)"),
+                        {"version": migration.VERSION, "description": migration.DESCRIPTION},
+                    )
+                print(f"Применена миграция {migration.VERSION}: {migration.DESCRIPTION}")
+                applied.append(migration.VERSION)
+        finally:
+            await lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            await lock_conn.commit()
+    return applied
+
+
+async def ensure_schema(engine: AsyncEngine, auto_migrate: bool) -> int:
+    """
+    Проверка при старте приложения: сравнивает версию схемы с последней миграцией.
+    Если схема отстает, накатывает миграции (auto_migrate) или останавливает запуск.
+    """
+    async with engine.connect() as conn:
+        version = await current_version(conn)
+    target = latest_version()
+    if version == target:
+        return version
+    if version > target:
+        raise RuntimeError(f"Версия схемы БД ({version}) новее кода приложения ({target}).")
+    if not auto_migrate:
+        raise RuntimeError(
+            f"Схема БД устарела: версия {version}, требуется {target}. Выполните: python migrate.py upgrade"
+        )
+    await upgrade(engine)
+    return target
@@ -0,0 +1,71 @@
+"""
+Исходная схема: таблицы users, locations, items, operations в том виде, в котором их создавал
+Base.metadata.create_all. IF NOT EXISTS позволяет принять под управление уже существующую БД.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+VERSION = 1
+DESCRIPTION = "baseline schema"
+
+STATEMENTS = [
+    """
+    DO $$ BEGIN
+        CREATE TYPE userrole AS ENUM ('admin', 'worker');
+    EXCEPTION WHEN duplicate_object THEN NULL;
+    END $$
+    """,
+    """
+    DO $$ BEGIN
+        CREATE TYPE operationtype AS ENUM ('receive', 'move', 'ship', 'inventory');
+    EXCEPTION WHEN duplicate_object THEN NULL;
+    END $$
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        tg_id INTEGER NOT NULL,
+        username VARCHAR(256),
+        last_login TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(),
+        role userrole NOT NULL,
+        is_active BOOLEAN,
+        created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS locations (
+        id SERIAL PRIMARY KEY,
+        name VARCHAR(256) NOT NULL,
+        description VARCHAR(256) NOT NULL,
+        created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS items (
+        id SERIAL PRIMARY KEY,
+        code VARCHAR(256) NOT NULL,
+        name VARCHAR(256) NOT NULL,
+        weight INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        location_id INTEGER NOT NULL REFERENCES locations (id) ON DELETE CASCADE,
+        description VARCHAR(256) NOT NULL,
+        created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS operations (
+        id SERIAL PRIMARY KEY,
+        item_id INTEGER NOT NULL REFERENCES items (id) ON DELETE CASCADE,
+        user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+        type operationtype NOT NULL,
+        note VARCHAR(256) NOT NULL,
+        created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(),
+        created_by_id INTEGER NOT NULL
+    )
+    """,
+]
+
+
+async def upgrade(conn: AsyncConnection) -> None:
+    for statement in STATEMENTS:
+        await conn.execute(text(statement))
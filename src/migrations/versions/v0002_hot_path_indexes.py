@@ -0,0 +1,30 @@
+"""
+Индексы и уникальные ограничения под реальные запросы:
+    users.tg_id            - авторизация каждого запроса (get_current_user), уникален;
+    items.code             - сканирование (scan_item_by_code), уникален;
+    items.location_id      - проверки при удалении локации и выборки по локации;
+    locations.name         - проверка дубликата в create_new_location, уникально;
+    operations (created_at, id), (item_id, created_at, id), (user_id, created_at, id)
+                           - keyset-пагинация журнала и его фильтры, проверки при удалении.
+Если в данных уже есть дубликаты tg_id, code или name, миграция упадет: их нужно устранить вручную.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+VERSION = 2
+DESCRIPTION = "hot path indexes and unique constraints"
+
+STATEMENTS = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_tg_id ON users (tg_id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_items_code ON items (code)",
+    "CREATE INDEX IF NOT EXISTS ix_items_location_id ON items (location_id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_locations_name ON locations (name)",
+    "CREATE INDEX IF NOT EXISTS ix_operations_created_at_id ON operations (created_at, id)",
+    "CREATE INDEX IF NOT EXISTS ix_operations_item_id_created_at ON operations (item_id, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS ix_operations_user_id_created_at ON operations (user_id, created_at, id)",
+]
+
+
+async def upgrade(conn: AsyncConnection) -> None:
+    for statement in STATEMENTS:
+        await conn.execute(text(statement))
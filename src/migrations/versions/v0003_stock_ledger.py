@@ -0,0 +1,49 @@
+"""
+Журнал остатков stock_ledger и снимки stock_snapshots для запросов остатка на момент времени.
+Сразу снимается исходный снимок всех товаров: с него начинается история, дальше ее ведет журнал.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+VERSION = 3
+DESCRIPTION = "stock ledger and snapshots"
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS stock_ledger (
+        id SERIAL PRIMARY KEY,
+        item_id INTEGER NOT NULL REFERENCES items (id) ON DELETE CASCADE,
+        operation_id INTEGER REFERENCES operations (id) ON DELETE SET NULL,
+        type operationtype NOT NULL,
+        delta INTEGER NOT NULL,
+        quantity_after INTEGER NOT NULL,
+        from_location_id INTEGER,
+        location_id INTEGER NOT NULL,
+        created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT clock_timestamp()
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_stock_ledger_item_id_created_at ON stock_ledger (item_id, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS ix_stock_ledger_created_at_id ON stock_ledger (created_at, id)",
+    """
+    CREATE TABLE IF NOT EXISTS stock_snapshots (
+        id SERIAL PRIMARY KEY,
+        taken_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        item_id INTEGER NOT NULL REFERENCES items (id) ON DELETE CASCADE,
+        quantity INTEGER NOT NULL,
+        location_id INTEGER NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_stock_snapshots_taken_at_item_id ON stock_snapshots (taken_at, item_id)",
+    "CREATE INDEX IF NOT EXISTS ix_stock_snapshots_item_id ON stock_snapshots (item_id)",
+    # Исходный снимок под блокировкой записи в items, чтобы ни одно изменение не потерялось между ним и журналом
+    "LOCK TABLE items IN SHARE MODE",
+    """
+    INSERT INTO stock_snapshots (taken_at, item_id, quantity, location_id)
+    SELECT now(), id, quantity, location_id FROM items
+    """,
+]
+
+
+async def upgrade(conn: AsyncConnection) -> None:
+    for statement in STATEMENTS:
+        await conn.execute(text(statement))
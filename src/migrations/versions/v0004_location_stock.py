@@ -0,0 +1,36 @@
+"""
+Агрегаты остатков по локациям (location_stock) для сводок склада без сканирования items.
+Таблица заполняется по текущим товарам под блокировкой записи в items, дальше ее ведут функции записи.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+VERSION = 4
+DESCRIPTION = "location stock aggregates"
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS location_stock (
+        location_id INTEGER PRIMARY KEY REFERENCES locations (id) ON DELETE CASCADE,
+        item_count INTEGER NOT NULL DEFAULT 0,
+        total_quantity BIGINT NOT NULL DEFAULT 0,
+        total_weight BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+    "LOCK TABLE items IN SHARE MODE",
+    """
+    INSERT INTO location_stock (location_id, item_count, total_quantity, total_weight)
+    SELECT location_id, count(*), coalesce(sum(quantity), 0), coalesce(sum(weight::bigint * quantity), 0)
+    FROM items
+    GROUP BY location_id
+    ON CONFLICT (location_id) DO UPDATE SET
+        item_count = excluded.item_count,
+        total_quantity = excluded.total_quantity,
+        total_weight = excluded.total_weight
+    """,
+]
+
+
+async def upgrade(conn: AsyncConnection) -> None:
+    for statement in STATEMENTS:
+        await conn.execute(text(statement))
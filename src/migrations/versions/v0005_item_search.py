@@ -0,0 +1,23 @@
+"""
+Индексы поиска товаров (GET /api/items/search):
+    items.code text_pattern_ops      - LIKE 'префикс%' независимо от правил сортировки БД;
+    items.name, items.description    - GIN pg_trgm для нечеткого поиска оператором <%.
+Для CREATE EXTENSION нужны права на создание расширений в БД.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+VERSION = 5
+DESCRIPTION = "item search indexes"
+
+STATEMENTS = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_items_code_prefix ON items (code text_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_items_name_trgm ON items USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_items_description_trgm ON items USING gin (description gin_trgm_ops)",
+]
+
+
+async def upgrade(conn: AsyncConnection) -> None:
+    for statement in STATEMENTS:
+        await conn.execute(text(statement))
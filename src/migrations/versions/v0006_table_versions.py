@@ -0,0 +1,52 @@
+"""
+Версии таблиц items и locations для ETag и условных GET (conditional.py).
+Триггер уровня команды увеличивает версию при любой записи, включая COPY, массовые UPDATE
+и правки в обход приложения. Счетчик разбит на TABLE_VERSION_SHARDS строк по txid, чтобы
+параллельные транзакции не ждали блокировку одной строки до COMMIT.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+VERSION = 6
+DESCRIPTION = "table versions for etags"
+
+TABLE_VERSION_SHARDS = 16
+VERSIONED_TABLES = ("items", "locations")
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS table_versions (
+        table_name VARCHAR(64) NOT NULL,
+        shard INTEGER NOT NULL,
+        version BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (table_name, shard)
+    )
+    """,
+    f"""
+    CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        UPDATE table_versions SET version = version + 1
+        WHERE table_name = TG_TABLE_NAME AND shard = txid_current() % {TABLE_VERSION_SHARDS};
+        RETURN NULL;
+    END $$
+    """,
+]
+for table in VERSIONED_TABLES:
+    STATEMENTS += [
+        f"""
+        INSERT INTO table_versions (table_name, shard)
+        SELECT '{table}', shard FROM generate_series(0, {TABLE_VERSION_SHARDS - 1}) AS shard
+        ON CONFLICT DO NOTHING
+        """,
+        f"DROP TRIGGER IF EXISTS {table}_bump_version ON {table}",
+        f"""
+        CREATE TRIGGER {table}_bump_version
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+        FOR EACH STATEMENT EXECUTE PROCEDURE bump_table_version()
+        """,
+    ]
+
+
+async def upgrade(conn: AsyncConnection) -> None:
+    for statement in STATEMENTS:
+        await conn.execute(text(statement))
@@ -0,0 +1,40 @@
+"""
+Журнал изменений change_log для дельта-синхронизации клиентов (GET /api/sync).
+Существующие локации и товары попадают в журнал сразу, чтобы первая синхронизация с since=0
+вернула весь каталог.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+VERSION = 7
+DESCRIPTION = "change log for delta sync"
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS change_log (
+        entity VARCHAR(16) NOT NULL,
+        entity_id INTEGER NOT NULL,
+        seq BIGINT NOT NULL,
+        deleted BOOLEAN NOT NULL DEFAULT false,
+        changed_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(),
+        PRIMARY KEY (entity, entity_id)
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_change_log_seq ON change_log (seq)",
+    "LOCK TABLE locations, items IN SHARE MODE",
+    """
+    INSERT INTO change_log (entity, entity_id, seq)
+    SELECT 'location', id, row_number() OVER (ORDER BY id) FROM locations
+    ON CONFLICT DO NOTHING
+    """,
+    """
+    INSERT INTO change_log (entity, entity_id, seq)
+    SELECT 'item', id, (SELECT coalesce(max(seq), 0) FROM change_log) + row_number() OVER (ORDER BY id) FROM items
+    ON CONFLICT DO NOTHING
+    """,
+]
+
+
+async def upgrade(conn: AsyncConnection) -> None:
+    for statement in STATEMENTS:
+        await conn.execute(text(statement))
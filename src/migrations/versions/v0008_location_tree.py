@@ -0,0 +1,37 @@
+"""
+Иерархия локаций (склад -> зона -> стеллаж -> ячейка): locations.parent_id и таблица замыкания
+location_tree с парой (предок, потомок) для каждого пути, включая путь локации к самой себе.
+Поддерево локации выбирается одним соединением по первичному ключу location_tree.
+Существующие локации становятся корневыми.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+VERSION = 8
+DESCRIPTION = "location hierarchy closure table"
+
+STATEMENTS = [
+    "ALTER TABLE locations ADD COLUMN IF NOT EXISTS parent_id INTEGER REFERENCES locations (id)",
+    "CREATE INDEX IF NOT EXISTS ix_locations_parent_id ON locations (parent_id)",
+    """
+    CREATE TABLE IF NOT EXISTS location_tree (
+        ancestor_id INTEGER NOT NULL REFERENCES locations (id) ON DELETE CASCADE,
+        descendant_id INTEGER NOT NULL REFERENCES locations (id) ON DELETE CASCADE,
+        depth INTEGER NOT NULL,
+        PRIMARY KEY (ancestor_id, descendant_id)
+    )
+    """,
+    # Путь вверх от локации: предки при перемещении поддерева и проверке циклов
+    "CREATE INDEX IF NOT EXISTS ix_location_tree_descendant_id ON location_tree (descendant_id, ancestor_id)",
+    "LOCK TABLE locations IN SHARE MODE",
+    """
+    INSERT INTO location_tree (ancestor_id, descendant_id, depth)
+    SELECT id, id, 0 FROM locations
+    ON CONFLICT DO NOTHING
+    """,
+]
+
+
+async def upgrade(conn: AsyncConnection) -> None:
+    for statement in STATEMENTS:
+        await conn.execute(text(statement))
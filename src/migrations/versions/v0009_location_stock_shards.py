@@ -0,0 +1,22 @@
+"""
+Шарды агрегатов location_stock: строка (location_id, shard) вместо одной строки на локацию.
+Транзакция пишет приращения в шард txid_current() % LOCATION_STOCK_SHARDS (location_stock.py),
+поэтому параллельные записи в одну локацию не ждут блокировку одной строки до COMMIT.
+Сводки суммируют шарды. Существующие строки становятся шардом 0.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+VERSION = 9
+DESCRIPTION = "location stock shards"
+
+STATEMENTS = [
+    "ALTER TABLE location_stock ADD COLUMN IF NOT EXISTS shard SMALLINT NOT NULL DEFAULT 0",
+    "ALTER TABLE location_stock DROP CONSTRAINT IF EXISTS location_stock_pkey",
+    "ALTER TABLE location_stock ADD CONSTRAINT location_stock_pkey PRIMARY KEY (location_id, shard)",
+]
+
+
+async def upgrade(conn: AsyncConnection) -> None:
+    for statement in STATEMENTS:
+        await conn.execute(text(statement))
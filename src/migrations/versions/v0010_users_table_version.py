@@ -0,0 +1,32 @@
+"""
+Версия таблицы users в table_versions. Каждый воркер держит свой user_cache и раз в
+CACHE_VERSION_CHECK_SECONDS сверяет эту версию (requests.watch_cache_versions): изменение
+пользователя в любом воркере или в обход приложения сбрасывает кэши всех воркеров.
+Функцию bump_table_version и разбиение на шарды создала миграция v0006.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+VERSION = 10
+DESCRIPTION = "users table version"
+
+TABLE_VERSION_SHARDS = 16
+
+STATEMENTS = [
+    f"""
+    INSERT INTO table_versions (table_name, shard)
+    SELECT 'users', shard FROM generate_series(0, {TABLE_VERSION_SHARDS - 1}) AS shard
+    ON CONFLICT DO NOTHING
+    """,
+    "DROP TRIGGER IF EXISTS users_bump_version ON users",
+    """
+    CREATE TRIGGER users_bump_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON users
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_table_version()
+    """,
+]
+
+
+async def upgrade(conn: AsyncConnection) -> None:
+    for statement in STATEMENTS:
+        await conn.execute(text(statement))
@@ -0,0 +1,23 @@
+"""
+Имя локации уникально среди соседей, а не глобально: у разных стеллажей могут быть полки "1", "2"...
+Корневые локации (parent_id IS NULL) сравниваются между собой через coalesce(parent_id, 0):
+id начинаются с 1, поэтому 0 не совпадает ни с одним родителем. Выражение вместо
+NULLS NOT DISTINCT, чтобы миграция работала и на PostgreSQL до 15.
+Индекс ix_locations_name остается обычным для поиска локации по имени.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+VERSION = 11
+DESCRIPTION = "location name unique per parent"
+
+STATEMENTS = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_locations_parent_id_name ON locations ((coalesce(parent_id, 0)), name)",
+    "DROP INDEX IF EXISTS ix_locations_name",
+    "CREATE INDEX IF NOT EXISTS ix_locations_name ON locations (name)",
+]
+
+
+async def upgrade(conn: AsyncConnection) -> None:
+    for statement in STATEMENTS:
+        await conn.execute(text(statement))
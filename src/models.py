@@ -12,7 +12,9 @@ from sqlalchemy import (
     Integer,
     MetaData,
     PrimaryKeyConstraint,
+    SmallInteger,
     String,
+    BigInteger,
     Boolean,
     Table,
     func,
@@ -42,7 +44,7 @@ class UserORM(Base):
     __tablename__ = "users"
 
     id: Mapped[intpk]
-    tg_id: Mapped[int] 
+    tg_id: Mapped[int] = mapped_column(index=True, unique=True)
     username: Mapped[str_256 | None]
     last_login: Mapped[updated_at]
     role: Mapped[UserRole]
@@ -59,11 +61,12 @@ class ItemORM(Base):
     __tablename__ = "items"
 
     id: Mapped[intpk]
-    code: Mapped[str_256]
+    # Уникальный индекс: по коду идет каждое сканирование (scan_item_by_code)
+    code: Mapped[str_256] = mapped_column(index=True, unique=True)
     name: Mapped[str_256]
     weight: Mapped[int]
     quantity: Mapped[int]
-    location_id: Mapped[int] = mapped_column(ForeignKey("locations.id", ondelete="CASCADE"))
+    location_id: Mapped[int] = mapped_column(ForeignKey("locations.id", ondelete="CASCADE"), index=True)
     description: Mapped[str_256]
     created_at: Mapped[created_at]
 
@@ -77,11 +80,17 @@ class ItemORM(Base):
 
 class LocationORM(Base):
     __tablename__ = "locations"
+    # Имя уникально среди соседей (миграция v0011); корневые локации сравниваются через coalesce(parent_id, 0)
+    __table_args__ = (
+        Index("ix_locations_parent_id_name", func.coalesce(text("parent_id"), 0), "name", unique=True),
+    )
 
     id: Mapped[intpk]
-    name: Mapped[str_256]
+    name: Mapped[str_256] = mapped_column(index=True)
     description: Mapped[str_256]
     created_at: Mapped[created_at]
+    # Родительская локация (NULL - корневая). Поддеревья выбираются через location_tree
+    parent_id: Mapped[int | None] = mapped_column(ForeignKey("locations.id"), index=True)
 
     items: Mapped[list["ItemORM"]] = relationship(
         back_populates="location",
@@ -90,6 +99,13 @@ class LocationORM(Base):
 
 class OperationORM(Base):
     __tablename__ = "operations"
+    # Индексы повторяют миграцию v0002: журнал листается по (created_at, id)
+    # и фильтруется по товару и пользователю
+    __table_args__ = (
+        Index("ix_operations_created_at_id", "created_at", "id"),
+        Index("ix_operations_item_id_created_at", "item_id", "created_at", "id"),
+        Index("ix_operations_user_id_created_at", "user_id", "created_at", "id"),
+    )
 
     id: Mapped[intpk]
     item_id: Mapped[int] = mapped_column(ForeignKey("items.id", ondelete="CASCADE"))
@@ -107,3 +123,100 @@ class OperationORM(Base):
     )
 
 
+
+
+class StockLedgerORM(Base):
+    """
+    Структурированный журнал остатков: одна строка на каждое изменение количества или локации товара.
+    quantity_after хранит остаток после изменения, поэтому состояние на момент времени берется
+    из последней строки, а не суммированием всей истории.
+    """
+    __tablename__ = "stock_ledger"
+    __table_args__ = (
+        Index("ix_stock_ledger_item_id_created_at", "item_id", "created_at", "id"),
+        Index("ix_stock_ledger_created_at_id", "created_at", "id"),
+    )
+
+    id: Mapped[intpk]
+    item_id: Mapped[int] = mapped_column(ForeignKey("items.id", ondelete="CASCADE"))
+    # NULL для правок товара через PUT /api/items/{id}, которые идут мимо операций
+    operation_id: Mapped[int | None] = mapped_column(ForeignKey("operations.id", ondelete="SET NULL"))
+    type: Mapped[OperationType]
+    delta: Mapped[int]
+    quantity_after: Mapped[int]
+    # Локация до изменения заполняется только при перемещении
+    from_location_id: Mapped[int | None]
+    location_id: Mapped[int]
+    # clock_timestamp, а не now(): время записи строки, а не начала транзакции
+    created_at: Mapped[datetime.datetime] = mapped_column(server_default=func.clock_timestamp())
+
+
+class StockSnapshotORM(Base):
+    """Периодический снимок остатков всех товаров; все строки одного снимка имеют одинаковый taken_at."""
+    __tablename__ = "stock_snapshots"
+    __table_args__ = (
+        Index("ix_stock_snapshots_taken_at_item_id", "taken_at", "item_id"),
+    )
+
+    id: Mapped[intpk]
+    taken_at: Mapped[datetime.datetime]
+    item_id: Mapped[int] = mapped_column(ForeignKey("items.id", ondelete="CASCADE"), index=True)
+    quantity: Mapped[int]
+    location_id: Mapped[int]
+
+
+class LocationStockORM(Base):
+    """
+    Агрегаты остатков по локации. Поддерживаются инкрементально функциями записи товаров
+    (location_stock.py), поэтому сводка по складу не сканирует items.
+    Агрегат локации разбит на шарды: итог локации - сумма ее строк.
+    """
+    __tablename__ = "location_stock"
+
+    location_id: Mapped[int] = mapped_column(ForeignKey("locations.id", ondelete="CASCADE"), primary_key=True)
+    shard: Mapped[int] = mapped_column(SmallInteger, primary_key=True, server_default=text("0"))
+    item_count: Mapped[int] = mapped_column(server_default=text("0"))
+    total_quantity: Mapped[int] = mapped_column(BigInteger, server_default=text("0"))
+    total_weight: Mapped[int] = mapped_column(BigInteger, server_default=text("0"))
+
+
+class TableVersionORM(Base):
+    """
+    Версии таблиц для ETag. Увеличиваются триггерами миграции v0006 на каждую команду записи.
+    Версия таблицы - сумма по шардам: разные транзакции обновляют разные строки и не ждут друг друга.
+    """
+    __tablename__ = "table_versions"
+
+    table_name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    shard: Mapped[int] = mapped_column(primary_key=True)
+    version: Mapped[int] = mapped_column(BigInteger, server_default=text("0"))
+
+
+class ChangeLogORM(Base):
+    """
+    Журнал изменений для синхронизации клиентов (GET /api/sync): одна строка на сущность.
+    При каждом изменении строка получает новый seq, поэтому размер таблицы равен числу сущностей,
+    а удаленные сущности остаются в ней надгробиями (deleted = true).
+    """
+    __tablename__ = "change_log"
+
+    entity: Mapped[str] = mapped_column(String(16), primary_key=True) # "item" или "location"
+    entity_id: Mapped[int] = mapped_column(primary_key=True)
+    seq: Mapped[int] = mapped_column(BigInteger, unique=True, index=True)
+    deleted: Mapped[bool] = mapped_column(server_default=text("false"))
+    changed_at: Mapped[created_at]
+
+
+class LocationTreeORM(Base):
+    """
+    Таблица замыкания иерархии локаций: строка на каждую пару (предок, потомок), включая (id, id)
+    с depth = 0. Ведется функциями записи локаций (location_tree.py).
+    """
+    __tablename__ = "location_tree"
+    __table_args__ = (
+        Index("ix_location_tree_descendant_id", "descendant_id", "ancestor_id"),
+    )
+
+    ancestor_id: Mapped[int] = mapped_column(ForeignKey("locations.id", ondelete="CASCADE"), primary_key=True)
+    descendant_id: Mapped[int] = mapped_column(ForeignKey("locations.id", ondelete="CASCADE"), primary_key=True)
+    depth: Mapped[int]
@@ -1,7 +1,7 @@
 from sqlalchemy import Integer, and_, cast, func, insert, inspect, or_, select, text
 from sqlalchemy.orm import aliased, contains_eager, joinedload, selectinload
 
-from database import Base, async_engine, async_session_factory, session_factory, sync_engine
+from database import Base, async_engine, async_session_factory, get_sync_engine, session_factory
 from models import UserORM, LocationORM, OperationORM, ItemORM, UserRole, OperationType
 
 
@@ -0,0 +1,180 @@
+import base64
+import binascii
+import enum
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Annotated, Any, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import Depends, HTTPException, Query
+from sqlalchemy import and_, or_, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Размер страницы по умолчанию и верхняя граница для параметра limit
+DEFAULT_PAGE_LIMIT = 50
+MAX_PAGE_LIMIT = 500
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """
+    Упаковывает значения ключа сортировки последней строки страницы в непрозрачный курсор.
+    Клиент не должен разбирать курсор, он просто передает его обратно в следующем запросе.
+    """
+    payload = []
+    for value in values:
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, enum.Enum):
+            value = value.value
+        payload.append(value)
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    """
+    Распаковывает курсор, полученный от encode_cursor. Даты возвращаются строками,
+    приведение типов выполняет вызывающая сторона.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Некорректный курсор пагинации.")
+    if not isinstance(values, list):
+        raise HTTPException(status_code=400, detail="Некорректный курсор пагинации.")
+    return values
+
+
+@dataclass
+class PageParams:
+    limit: int
+    cursor: Optional[str]
+    sort: Optional[str]
+    fields: Optional[str]
+
+
+def page_params(
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+    cursor: Optional[str] = Query(None, description="Курсор next_cursor из предыдущей страницы"),
+    sort: Optional[str] = Query(None, description="Ключи сортировки через запятую, '-' перед полем - по убыванию"),
+    fields: Optional[str] = Query(None, description="Список возвращаемых полей через запятую"),
+) -> PageParams:
+    return PageParams(limit=limit, cursor=cursor, sort=sort, fields=fields)
+
+PageParamsDep = Annotated[PageParams, Depends(page_params)]
+
+
+def _parse_sort(
+    sort: Optional[str], sortable: Sequence[str], default_sort: str, unique_key: str = "id",
+) -> List[Tuple[str, bool]]:
+    """Разбирает строку вида "name,-created_at" в список (поле, по_убыванию)."""
+    keys = []
+    for token in (sort or default_sort).split(","):
+        token = token.strip()
+        if not token:
+            continue
+        descending = token.startswith("-")
+        name = token.lstrip("-")
+        if name not in sortable:
+            raise HTTPException(status_code=400, detail=f"Сортировка по полю '{name}' не поддерживается.")
+        keys.append((name, descending))
+    if not keys:
+        raise HTTPException(status_code=400, detail="Не указаны ключи сортировки.")
+    # id всегда замыкает ключ: без уникального хвоста keyset-курсор теряет строки с одинаковыми значениями
+    if unique_key not in dict(keys):
+        keys.append((unique_key, keys[-1][1]))
+    return keys
+
+
+def _parse_fields(fields: Optional[str], allowed: Sequence[str]) -> List[str]:
+    if not fields:
+        return list(allowed)
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in requested if name not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Неизвестные поля: {', '.join(unknown)}.")
+    return requested
+
+
+def _cursor_value(column, raw: Any) -> Any:
+    """Приводит значение из курсора к python-типу колонки."""
+    if raw is None:
+        return None
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return raw
+    if python_type is datetime:
+        return datetime.fromisoformat(raw)
+    if issubclass(python_type, enum.Enum):
+        return python_type(raw)
+    return python_type(raw)
+
+
+def _keyset_condition(columns: Sequence[Any], directions: Sequence[bool], values: Sequence[Any]):
+    if all(directions) or not any(directions):
+        # Одно направление для всех ключей: сравнение кортежей использует составной индекс целиком
+        if directions[0]:
+            return tuple_(*columns) < tuple_(*values)
+        return tuple_(*columns) > tuple_(*values)
+    # Смешанные направления: (a > x) OR (a = x AND b < y) OR ...
+    clauses = []
+    for idx, (column, descending) in enumerate(zip(columns, directions)):
+        prefix = [columns[j] == values[j] for j in range(idx)]
+        step = column < values[idx] if descending else column > values[idx]
+        clauses.append(and_(*prefix, step))
+    return or_(*clauses)
+
+
+async def paginate(
+    session: AsyncSession,
+    model,
+    params: PageParams,
+    *,
+    allowed_fields: Sequence[str],
+    sortable: Sequence[str],
+    default_sort: str = "id",
+    where: Sequence[Any] = (),
+    unique_key: str = "id",
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Общая keyset-пагинация для списков.
+    Выбирает только запрошенные колонки (плюс ключи сортировки) без ORM-объектов и возвращает
+    строки страницы в виде словарей и курсор следующей страницы (None на последней странице).
+    model - ORM-модель или колонки подзапроса (subquery.c); unique_key - уникальная колонка,
+    которой заканчивается ключ сортировки.
+    """
+    sort_keys = _parse_sort(params.sort, sortable, default_sort, unique_key)
+    fields = _parse_fields(params.fields, allowed_fields)
+    sort_names = [name for name, _ in sort_keys]
+    sort_columns = [getattr(model, name) for name in sort_names]
+    directions = [descending for _, descending in sort_keys]
+    # Сигнатура сортировки хранится в курсоре, чтобы курсор нельзя было применить к другой сортировке
+    sort_signature = ",".join(("-" if descending else "") + name for name, descending in sort_keys)
+
+    selected = list(dict.fromkeys(fields + sort_names))
+    query = select(*(getattr(model, name) for name in selected))
+    for clause in where:
+        query = query.where(clause)
+
+    if params.cursor:
+        values = decode_cursor(params.cursor)
+        if not values or values[0] != sort_signature or len(values) != len(sort_columns) + 1:
+            raise HTTPException(status_code=400, detail="Курсор не соответствует параметрам сортировки.")
+        try:
+            last = [_cursor_value(column, raw) for column, raw in zip(sort_columns, values[1:])]
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Некорректный курсор пагинации.")
+        query = query.where(_keyset_condition(sort_columns, directions, last))
+
+    query = query.order_by(*(column.desc() if descending else column.asc()
+                             for column, descending in zip(sort_columns, directions)))
+    # Берем на одну строку больше, чтобы понять, есть ли следующая страница
+    rows = (await session.execute(query.limit(params.limit + 1))).mappings().all()
+
+    next_cursor = None
+    if len(rows) > params.limit:
+        rows = rows[:params.limit]
+        next_cursor = encode_cursor([sort_signature, *(rows[-1][name] for name in sort_names)])
+    return [{name: row[name] for name in fields} for row in rows], next_cursor
@@ -0,0 +1,198 @@
+"""
+Профилирование отдельного запроса по требованию администратора.
+
+Запрос с заголовком X-Profile: 1 или параметром profile=1 от администратора (tg_id в строке запроса)
+выполняется под cProfile. Результат сохраняется в PROFILE_DIR двумя файлами с общим именем:
+    - <имя>.prof - статистика pstats (snakeviz, `python -m pstats`, speedscope через конвертер);
+    - <имя>.json - метаданные запроса и хронология SQL-команд (смещение от начала, длительность).
+Каталог работает как кольцевой буфер: хранятся последние PROFILE_KEEP профилей.
+
+Запросы без флага проходят через middleware без работы: проверяется только наличие флага.
+Обработчики событий движка для хронологии SQL ставятся при первом профилировании.
+cProfile профилирует поток целиком, поэтому в профиль попадают и конкурентные запросы того же
+event loop; профилируемые запросы выполняются по одному.
+"""
+import asyncio
+import cProfile
+import json
+import os
+import re
+import time
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from database import async_session_factory
+from models import UserRole
+import requests as rq
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_QUERY_FLAG = b"profile="
+_SQL_TEXT_LIMIT = 500
+_NAME_RE = re.compile(r"^[0-9A-Za-z_.-]+$")
+
+
+class SQLTimeline:
+    def __init__(self, started: float):
+        self.started = started
+        self.statements: List[Dict[str, Any]] = []
+
+
+_current_timeline: ContextVar[Optional[SQLTimeline]] = ContextVar("profile_timeline", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_timeline.get() is not None:
+        conn.info.setdefault("profiling_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timeline = _current_timeline.get()
+    started = conn.info.get("profiling_started")
+    if timeline is None or not started:
+        return
+    begin = started.pop()
+    sql = " ".join(statement.split())
+    timeline.statements.append({
+        "sql": sql if len(sql) <= _SQL_TEXT_LIMIT else sql[:_SQL_TEXT_LIMIT] + "...",
+        "start_ms": round((begin - timeline.started) * 1000, 3),
+        "ms": round((time.perf_counter() - begin) * 1000, 3),
+        "executemany": executemany,
+    })
+
+
+def _handle_error(context):
+    # Упавшая команда не вызывает after_cursor_execute: записываем ее здесь и снимаем отметку начала
+    if context.connection is not None and context.statement is not None:
+        executemany = context.execution_context is not None and context.execution_context.executemany
+        _after_cursor_execute(context.connection, None, context.statement, context.parameters,
+                              context.execution_context, executemany)
+
+
+_installed = False
+
+
+def _install_sql_listeners() -> None:
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(Engine, "handle_error", _handle_error)
+
+
+class ProfileStore:
+    """Кольцевой буфер профилей на диске: после записи удаляются самые старые сверх keep."""
+
+    def __init__(self, directory: str, keep: int):
+        self.directory = directory
+        self.keep = keep
+
+    def path(self, name: str, suffix: str) -> Optional[str]:
+        # Имя приходит из URL, поэтому пути вне каталога не допускаются
+        if not _NAME_RE.match(name):
+            return None
+        path = os.path.join(self.directory, name + suffix)
+        return path if os.path.exists(path) else None
+
+    def save(self, name: str, profiler: cProfile.Profile, meta: Dict[str, Any]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        profiler.dump_stats(os.path.join(self.directory, name + ".prof"))
+        with open(os.path.join(self.directory, name + ".json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        for old in self.names()[self.keep:]:
+            for suffix in (".prof", ".json"):
+                try:
+                    os.remove(os.path.join(self.directory, old + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def names(self) -> List[str]:
+        """Имена профилей, новые первыми (имя начинается с метки времени)."""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted((f[:-5] for f in os.listdir(self.directory) if f.endswith(".prof")), reverse=True)
+
+    def list(self, limit: int) -> List[Dict[str, Any]]:
+        result = []
+        for name in self.names()[:limit]:
+            meta_path = self.path(name, ".json")
+            if meta_path is None:
+                continue
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            meta.pop("sql", None)
+            result.append(meta)
+        return result
+
+
+def _requested(scope) -> bool:
+    for key, value in scope.get("headers", ()):
+        if key == PROFILE_HEADER:
+            return value in (b"1", b"true")
+    query = scope.get("query_string", b"")
+    return PROFILE_QUERY_FLAG in query and parse_qs(query.decode()).get("profile") in (["1"], ["true"])
+
+
+async def _is_admin(scope) -> bool:
+    tg_id = parse_qs(scope.get("query_string", b"").decode()).get("tg_id", [""])[0]
+    if not tg_id.isdigit():
+        return False
+    async with async_session_factory() as session:
+        user = await rq.fetch_auth_user(int(tg_id), session)
+    return user is not None and user.is_active and user.role == UserRole.admin
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, store: ProfileStore):
+        self.app = app
+        self.store = store
+        self._lock = asyncio.Lock() # cProfile допускает один активный профилировщик на поток
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _requested(scope) or not await _is_admin(scope):
+            await self.app(scope, receive, send)
+            return
+        _install_sql_listeners()
+        async with self._lock:
+            await self._profile(scope, receive, send)
+
+    async def _profile(self, scope, receive, send):
+        started = time.perf_counter()
+        name = f"{datetime.now():%Y%m%dT%H%M%S%f}-{scope['method']}"
+        timeline = SQLTimeline(started)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", name.encode())]}
+            await send(message)
+
+        token = _current_timeline.set(timeline)
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.disable()
+            _current_timeline.reset(token)
+            route = scope.get("route")
+            meta = {
+                "id": name,
+                "method": scope["method"],
+                "path": scope["path"],
+                "route": getattr(route, "path", "unmatched"),
+                "status": status_code,
+                "ms": round((time.perf_counter() - started) * 1000, 3),
+                "statements": len(timeline.statements),
+                "db_ms": round(sum(s["ms"] for s in timeline.statements), 3),
+                "sql": timeline.statements,
+            }
+            await asyncio.to_thread(self.store.save, name, profiler, meta)
@@ -0,0 +1,234 @@
+"""
+Отладка SQL-запросов по HTTP-запросам (включается QUERY_DEBUG, для разработки и CI).
+
+На каждый HTTP-запрос записываются все SQL-команды и ORM-загрузки, а в конце строится отчет:
+    - repeated: одинаковые команды с одинаковыми параметрами, выполненные больше одного раза;
+    - n_plus_one: одна и та же команда с разными параметрами N_PLUS_ONE_THRESHOLD раз и больше;
+    - lazy_loads: ленивые загрузки связей (в async-коде они к тому же падают с MissingGreenlet);
+    - unused_eager_loads: связи, загруженные заранее (selectinload, joinedload, refresh с
+      attribute_names), к которым за запрос ни разу не обратились.
+Обращения к связям отслеживаются оберткой InstrumentedAttribute.__get__, поэтому режим ставится
+только явно и не предназначен для production.
+
+Эндпоинт может объявить бюджет SQL-команд декоратором query_budget(n). Превышение попадает в отчет,
+а при QUERY_DEBUG_STRICT запрос завершается ошибкой 500 с отчетом в теле, чтобы тесты падали.
+"""
+import json
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import InstrumentedAttribute, RelationshipProperty, Session
+from sqlalchemy.orm.attributes import instance_state
+
+N_PLUS_ONE_THRESHOLD = 5
+MAX_REPORTS = 200
+_PARAMS_REPR_LIMIT = 200
+
+
+class QueryTrace:
+    def __init__(self):
+        self.statements: List[Tuple[str, str, float]] = [] # (SQL, параметры, секунды)
+        self.lazy_loads: List[str] = []
+        # Объекты, загруженные или добавленные за запрос; ссылки держат их живыми до конца запроса,
+        # иначе identity map (слабые ссылки) теряет их раньше, чем связи будут проверены
+        self.instances: Dict[int, Any] = {}
+        # Загруженные связи объектов: (id объекта, имя связи) -> "Модель.связь"
+        self.loaded: Dict[Tuple[int, str], str] = {}
+        self.accessed: Set[Tuple[int, str]] = set()
+
+    def collect_loaded(self) -> None:
+        for key, instance in self.instances.items():
+            state = instance_state(instance)
+            for relationship in state.mapper.relationships:
+                if relationship.key in state.dict:
+                    self.loaded[(key, relationship.key)] = f"{state.class_.__name__}.{relationship.key}"
+
+    def unused_eager_loads(self) -> List[str]:
+        self.collect_loaded()
+        # Связь загружена, но к ней ни разу не обратились: загрузка была лишней
+        unused = Counter(name for key, name in self.loaded.items() if key not in self.accessed)
+        return [f"{name} x{count}" for name, count in sorted(unused.items())]
+
+    def report(self, method: str, path: str, route: str, budget: Optional[int]) -> Dict[str, Any]:
+        by_statement = Counter(sql for sql, _, _ in self.statements)
+        by_call = Counter((sql, params) for sql, params, _ in self.statements)
+        report = {
+            "method": method,
+            "path": path,
+            "route": route,
+            "statements": len(self.statements),
+            "db_ms": round(sum(seconds for _, _, seconds in self.statements) * 1000, 3),
+            "budget": budget,
+            "repeated": [
+                {"sql": sql, "params": params, "count": count}
+                for (sql, params), count in by_call.items() if count > 1
+            ],
+            "n_plus_one": [
+                {"sql": sql, "count": count}
+                for sql, count in by_statement.items() if count >= N_PLUS_ONE_THRESHOLD
+            ],
+            "lazy_loads": self.lazy_loads,
+            "unused_eager_loads": self.unused_eager_loads(),
+            "log": [
+                {"sql": sql, "params": params, "ms": round(seconds * 1000, 3)}
+                for sql, params, seconds in self.statements
+            ],
+        }
+        report["over_budget"] = budget is not None and len(self.statements) > budget
+        return report
+
+
+_current_trace: ContextVar[Optional[QueryTrace]] = ContextVar("query_trace", default=None)
+recent_reports: Deque[Dict[str, Any]] = deque(maxlen=MAX_REPORTS)
+
+
+def query_budget(max_statements: int) -> Callable:
+    """Объявляет бюджет SQL-команд эндпоинта; ставится под декоратором маршрута."""
+    def decorator(endpoint: Callable) -> Callable:
+        endpoint.query_budget = max_statements
+        return endpoint
+    return decorator
+
+
+def has_issues(report: Dict[str, Any]) -> bool:
+    return bool(report["over_budget"] or report["repeated"] or report["n_plus_one"]
+                or report["lazy_loads"] or report["unused_eager_loads"])
+
+
+# --- Обработчики событий, регистрируются в install() ---
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_trace.get() is not None:
+        conn.info.setdefault("querydebug_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    trace = _current_trace.get()
+    started = conn.info.get("querydebug_started")
+    if trace is None or not started:
+        return
+    params = repr(parameters)
+    if len(params) > _PARAMS_REPR_LIMIT:
+        params = params[:_PARAMS_REPR_LIMIT] + "..."
+    trace.statements.append((" ".join(statement.split()), params, time.perf_counter() - started.pop()))
+
+
+def _handle_error(context):
+    # Упавшая команда не вызывает after_cursor_execute, но была отправлена в БД и тоже считается в отчете
+    if context.connection is not None and context.statement is not None:
+        executemany = context.execution_context is not None and context.execution_context.executemany
+        _after_cursor_execute(context.connection, None, context.statement, context.parameters,
+                              context.execution_context, executemany)
+
+
+def _do_orm_execute(orm_execute_state):
+    trace = _current_trace.get()
+    if trace is None or not orm_execute_state.is_select or orm_execute_state.lazy_loaded_from is None:
+        return
+    path = orm_execute_state.loader_strategy_path
+    parent = orm_execute_state.lazy_loaded_from
+    name = path[-1].key if path is not None and len(path) else "?"
+    # Ленивая загрузка - та, что вызвана обращением к атрибуту; refresh(attribute_names=...)
+    # грузит связь тем же загрузчиком, но без обращения, и попадет в отчет как заранее загруженная
+    if (id(parent.obj()), name) in trace.accessed:
+        trace.lazy_loads.append(f"{parent.class_.__name__}.{name}")
+
+
+def _track_instance(session, instance):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.instances[id(instance)] = instance
+
+
+def _before_commit(session):
+    # COMMIT истечет атрибуты (expire_on_commit), поэтому загруженные связи снимаются до него
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.collect_loaded()
+
+
+_original_get = InstrumentedAttribute.__get__
+
+
+def _tracking_get(self, instance, owner):
+    if instance is not None:
+        trace = _current_trace.get()
+        if trace is not None and isinstance(self.property, RelationshipProperty):
+            trace.accessed.add((id(instance), self.key))
+    return _original_get(self, instance, owner)
+
+
+_installed = False
+
+
+def install() -> None:
+    """Включает сбор: обработчики движка и ORM и отслеживание обращений к связям."""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(Engine, "handle_error", _handle_error)
+    event.listen(Session, "do_orm_execute", _do_orm_execute)
+    event.listen(Session, "before_commit", _before_commit)
+    event.listen(Session, "loaded_as_persistent", _track_instance)
+    event.listen(Session, "transient_to_pending", _track_instance)
+    InstrumentedAttribute.__get__ = _tracking_get
+
+
+class QueryDebugMiddleware:
+    def __init__(self, app, strict: bool = False):
+        self.app = app
+        self.strict = strict
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trace = QueryTrace()
+        token = _current_trace.set(trace)
+        failed = False
+
+        def finish() -> Dict[str, Any]:
+            route = scope.get("route")
+            report = trace.report(
+                scope["method"], scope["path"], getattr(route, "path", "unmatched"),
+                getattr(getattr(route, "endpoint", None), "query_budget", None),
+            )
+            if has_issues(report):
+                recent_reports.append(report)
+            return report
+
+        async def send_wrapper(message):
+            nonlocal failed
+            if failed:
+                return # тело исходного ответа заменено отчетом
+            if message["type"] == "http.response.start":
+                # К началу ответа обработчик и зависимости (включая COMMIT) уже выполнены
+                report = finish()
+                headers = list(message.get("headers", []))
+                headers.append((b"x-query-count", str(report["statements"]).encode()))
+                if self.strict and report["over_budget"]:
+                    failed = True
+                    body = json.dumps({"detail": "Превышен бюджет SQL-команд.", "report": report},
+                                      ensure_ascii=False).encode()
+                    await send({
+                        "type": "http.response.start",
+                        "status": 500,
+                        "headers": [(b"content-type", b"application/json"),
+                                    (b"content-length", str(len(body)).encode())],
+                    })
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_trace.reset(token)
@@ -1,8 +1,11 @@
+import asyncio
 import os
-from typing import List, Dict, Any, Optional
+from datetime import datetime
+from dataclasses import astuple
+from typing import AsyncIterator, List, Dict, Any, Optional, Set, Tuple
 
 from fastapi import HTTPException
-from sqlalchemy import select, update, delete, func
+from sqlalchemy import Select, select, insert, update, delete, func
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload # Для загрузки связанных объектов
@@ -12,16 +15,40 @@ from models import (
     UserORM, ItemORM, LocationORM, OperationORM,
     OperationType, UserRole
 )
-from database import async_session_factory # Ваш async_session_factory
+from database import async_session_factory, run_after_commit # Ваш async_session_factory
+from cache import CachedUser, item_cache, user_cache
 # Импортируем СХЕМЫ из вашего НОВОГО проекта
 from schemas import (
     UserCreateSchema, UserReadSchema, UserUpdateSchema,
     ItemCreateSchema, ItemReadSchema, ItemUpdateSchema,
     OperationCreateSchema, OperationReadSchema,
     LocationCreateSchema, LocationReadSchema, LocationUpdateSchema,
-    OrmBaseModel
-     # Для журнала событий
+    OrmBaseModel,
+    OperationLogPageSchema, # Для журнала событий
+    OperationBatchLineResultSchema, OperationBatchResultSchema,
+    PageSchema,
 )
+from pagination import DEFAULT_PAGE_LIMIT, PageParams, paginate
+from export import stream_query
+from serialization import validate_rows
+from conditional import table_versions
+import ledger
+import location_stock
+import location_tree
+import changes
+import stockstream
+from singleflight import reads as single_flight
+
+# Поля, доступные для проекции fields=, и поля, по которым разрешена keyset-сортировка.
+# Сортировать можно только по NOT NULL колонкам, иначе курсор теряет строки с NULL
+ITEM_FIELDS = tuple(ItemReadSchema.model_fields)
+ITEM_SORTABLE_FIELDS = ("id", "code", "name", "weight", "quantity", "location_id", "created_at")
+USER_FIELDS = tuple(UserReadSchema.model_fields)
+USER_SORTABLE_FIELDS = ("id", "tg_id", "created_at", "last_login")
+LOCATION_FIELDS = tuple(LocationReadSchema.model_fields)
+LOCATION_SORTABLE_FIELDS = ("id", "name", "created_at")
+OPERATION_FIELDS = tuple(OperationReadSchema.model_fields)
+OPERATIONS_LOG_SORT = "-created_at,-id"
 
 # --- Вспомогательные функции для сериализации ---
 # Важно: Здесь предполагается, что ваши Read-схемы в schemas.py настроены
@@ -45,30 +72,118 @@ async def fetch_user_by_tg_id(tg_id: int, session: AsyncSession) -> Optional[Use
     user = await session.scalar(select(UserORM).where(UserORM.tg_id == tg_id))
     return user
 
-async def get_items_by_user_tg(tg_id: int, session: AsyncSession) -> List[ItemReadSchema]:
+async def fetch_auth_user(tg_id: int, session: AsyncSession) -> Optional[CachedUser]:
+    """
+    Данные пользователя для авторизации запроса. Сначала смотрим в user_cache,
+    при промахе читаем из users только нужные колонки. Отсутствие пользователя тоже кэшируется.
+    """
+    found, cached = user_cache.get(tg_id)
+    if found:
+        return cached
+    generation = user_cache.generation
+    row = (await session.execute(
+        select(UserORM.id, UserORM.tg_id, UserORM.role, UserORM.is_active).where(UserORM.tg_id == tg_id)
+    )).first()
+    user = CachedUser(*row) if row else None
+    # Пока шел запрос, кэш мог быть сброшен из-за изменения users: прочитанная строка может быть старой
+    if user_cache.generation == generation:
+        user_cache.set(tg_id, user)
+    return user
+
+# Кэши процесса и таблицы, от которых они зависят (версии увеличивают триггеры миграций v0006 и v0010)
+VERSIONED_CACHES = {"users": user_cache, "items": item_cache}
+
+async def watch_cache_versions(interval: float) -> None:
+    """
+    Фоновая задача приложения: раз в interval секунд сверяет версии users и items одним запросом
+    и сбрасывает user_cache или item_cache, если таблицу изменил другой воркер или запрос в обход приложения.
+    Поэтому смена роли, блокировка пользователя, отгрузка или удаление товара доходят до кэшей
+    всех воркеров не позже чем через interval.
+    """
+    versions: Dict[str, Optional[int]] = dict.fromkeys(VERSIONED_CACHES)
+    while True:
+        try:
+            async with async_session_factory() as session:
+                current = await table_versions(session, tuple(VERSIONED_CACHES))
+            for table, cache in VERSIONED_CACHES.items():
+                if current[table] != versions[table]:
+                    cache.clear()
+            versions = current
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Без сверки версий кэши могут устареть: сбрасываем их и повторяем через интервал
+            for cache in VERSIONED_CACHES.values():
+                cache.clear()
+            versions = dict.fromkeys(VERSIONED_CACHES)
+            print(f"Не удалось проверить версии кэшируемых таблиц: {e}")
+        await asyncio.sleep(interval)
+
+def _invalidate_cached_user(tg_id: int, session: AsyncSession) -> None:
+    # Сбрасываем запись сразу и еще раз после COMMIT: иначе параллельный запрос
+    # может успеть закэшировать старые данные до фиксации транзакции
+    user_cache.invalidate(tg_id)
+    run_after_commit(session, lambda: user_cache.invalidate(tg_id))
+
+async def get_items_by_user_tg(tg_id: int, session: AsyncSession, params: PageParams) -> PageSchema:
     # Так как в ItemORM нет user_id, мы не можем получить товары "пользователя".
     # Если эта функция должна была отображать все товары, то так и оставляем.
     # Если она должна показывать товары, которые пользователь как-то "создал" или "связан",
     # то для этого в ItemORM должно быть поле user_id (ForeignKey).
     # В текущей реализации, она возвращает ВСЕ товары.
-    user = await session.scalar(select(UserORM).where(UserORM.tg_id == tg_id))
-    if not user:
+    user_id = await session.scalar(select(UserORM.id).where(UserORM.tg_id == tg_id))
+    if not user_id:
         raise HTTPException(status_code=404, detail="Пользователь не найден.")
-
-    items_query = select(ItemORM).options(selectinload(ItemORM.location))
-    items = await session.scalars(items_query)
-    return [serialize_item(item) for item in items]
-
+    return await get_items(session, params)
+
+
+def _on_item_saved(
+    session: AsyncSession,
+    item: ItemReadSchema,
+    old_code: Optional[str] = None,
+    old_location_id: Optional[int] = None,
+) -> None:
+    """
+    Вызывается функциями записи после создания или изменения товара.
+    Кэш обновляется и подписчики stockstream получают событие только после COMMIT,
+    чтобы откаченные изменения не попали к сканерам.
+    """
+    def apply():
+        if old_code is not None and old_code != item.code:
+            item_cache.invalidate(old_code)
+        item_cache.set(item.code, item)
+        stockstream.broker.publish_item(item, old_location_id)
+    run_after_commit(session, apply)
+
+def _on_item_deleted(session: AsyncSession, item_id: int, code: str, location_id: int) -> None:
+    def apply():
+        item_cache.invalidate(code)
+        stockstream.broker.publish_deleted(item_id, code, location_id)
+    run_after_commit(session, apply)
+
+async def _load_scanned_item(code: str, session: AsyncSession) -> Optional[ItemReadSchema]:
+    # Локация в ответе не нужна, читаем только колонки товара по уникальному индексу items.code
+    generation = item_cache.generation
+    row = (await session.execute(
+        select(*(getattr(ItemORM, name) for name in ITEM_FIELDS)).where(ItemORM.code == code)
+    )).mappings().first()
+    item = ItemReadSchema.model_validate(dict(row)) if row else None
+    # Отсутствующие коды не кэшируем: товар может быть сразу создан в другом воркере.
+    # Если за время запроса кэш сбросили из-за записи в items, строка могла устареть
+    if item and item_cache.generation == generation:
+        item_cache.set(code, item)
+    return item
 
 async def scan_item_by_code(code: str, session: AsyncSession) -> Dict[str, Any]:
-    # Загружаем связанную локацию
-    item = await session.scalar(
-        select(ItemORM)
-        .options(selectinload(ItemORM.location))
-        .where(ItemORM.code == code)
-    )
+    # Горячий путь: большинство сканов обслуживается из item_cache без обращения к БД
+    found, item = item_cache.get(code)
+    if not found:
+        # Несколько сканеров с одним кодом при промахе кэша ждут один запрос к БД
+        item = await single_flight.do(
+            ("scan_item_by_code", session.bind, code), lambda: _load_scanned_item(code, session),
+        )
     if item:
-        return {"status": "exists", "item": serialize_item(item)}
+        return {"status": "exists", "item": item}
     else:
         return {"status": "not_found", "item_code": code}
 
@@ -111,8 +226,18 @@ async def create_item(item_data: ItemCreateSchema, user_tg_id: int, session: Asy
         session.add(new_operation)
 
         await session.flush()
+        await ledger.write_entries(session, [ledger.ledger_entry(
+            new_item.id, OperationType.receive, 0, None, new_item.quantity, new_item.location_id,
+            operation_id=new_operation.id,
+        )])
+        await location_stock.apply_change(
+            session, None, (new_item.location_id, new_item.quantity, new_item.weight),
+        )
+        changes.record(session, changes.ITEM, [new_item.id])
         await session.refresh(new_item, attribute_names=['location']) # Обновляем с загрузкой связанной локации
-        return serialize_item(new_item)
+        result = serialize_item(new_item)
+        _on_item_saved(session, result)
+        return result
     except IntegrityError as e:
         await session.rollback()
         raise HTTPException(status_code=400, detail="Ошибка базы данных при создании товара. Возможно, дублирующиеся данные.")
@@ -120,23 +245,37 @@ async def create_item(item_data: ItemCreateSchema, user_tg_id: int, session: Asy
         await session.rollback()
         raise
 
-async def get_items(session: AsyncSession) -> List[ItemReadSchema]:
-    items_query = select(ItemORM).options(selectinload(ItemORM.location))
-    items = await session.scalars(items_query)
-    return [serialize_item(item) for item in items]
+async def get_items(session: AsyncSession, params: PageParams) -> PageSchema:
+    # Одинаковые одновременные запросы страницы выполняют одну выборку (singleflight.py)
+    return await single_flight.do(("get_items", session.bind, astuple(params)), lambda: _get_items(session, params))
 
-async def get_item_by_id(item_id: int, session: AsyncSession) -> Optional[ItemReadSchema]:
-    item = await session.scalar(
-        select(ItemORM)
-        .options(selectinload(ItemORM.location))
-        .where(ItemORM.id == item_id)
+async def _get_items(session: AsyncSession, params: PageParams) -> PageSchema:
+    items, next_cursor = await paginate(
+        session, ItemORM, params,
+        allowed_fields=ITEM_FIELDS, sortable=ITEM_SORTABLE_FIELDS,
     )
-    if item:
-        return serialize_item(item)
+    # Строки страницы - колонки из БД с уже приведенными типами: повторная валидация не нужна
+    return PageSchema.model_construct(items=items, next_cursor=next_cursor)
+
+async def get_item_by_id(item_id: int, session: AsyncSession) -> Optional[ItemReadSchema]:
+    return await single_flight.do(("get_item_by_id", session.bind, item_id), lambda: _get_item_by_id(item_id, session))
+
+async def _get_item_by_id(item_id: int, session: AsyncSession) -> Optional[ItemReadSchema]:
+    # Только колонки ItemReadSchema, без ORM-объекта и подгрузки локации
+    row = (await session.execute(
+        select(*(getattr(ItemORM, name) for name in ITEM_FIELDS)).where(ItemORM.id == item_id)
+    )).mappings().first()
+    if row:
+        return ItemReadSchema.model_validate(dict(row))
     return None
 
 async def update_item(item_id: int, item_data: ItemUpdateSchema, session: AsyncSession) -> Optional[ItemReadSchema]:
-    item = await session.scalar(select(ItemORM).where(ItemORM.id == item_id))
+    # FOR UPDATE: остаток и локация до изменения идут в журнал остатков и дельту location_stock,
+    # поэтому параллельная операция не должна успеть зафиксироваться между чтением и записью.
+    # Порядок блокировок тот же, что у операций: сначала строка товара, потом агрегаты локаций.
+    # FOR NO KEY UPDATE не конфликтует с FOR KEY SHARE, которую берут проверки внешних ключей
+    # (строки снимка остатков, операции), поэтому снимок остатков не задерживает правку товара
+    item = await session.scalar(select(ItemORM).where(ItemORM.id == item_id).with_for_update(key_share=True))
     if not item:
         return None
 
@@ -146,17 +285,41 @@ async def update_item(item_id: int, item_data: ItemUpdateSchema, session: AsyncS
         location = await session.scalar(select(LocationORM).where(LocationORM.id == update_dict['location_id']))
         if not location:
             raise HTTPException(status_code=400, detail="Указанная локация не найдена.")
+    if update_dict.get('code') not in (None, item.code) and await session.scalar(
+        select(ItemORM.id).where(ItemORM.code == update_dict['code'])
+    ):
+        raise HTTPException(status_code=400, detail="Товар с таким кодом уже существует.")
 
+    old_code = item.code
+    quantity_before, location_before, weight_before = item.quantity, item.location_id, item.weight
     for key, value in update_dict.items():
         if hasattr(item, key):
             setattr(item, key, value)
 
-    await session.flush()
+    try:
+        await session.flush()
+    except IntegrityError:
+        # Код мог занять параллельный запрос между проверкой и записью
+        await session.rollback()
+        raise HTTPException(status_code=400, detail="Товар с таким кодом уже существует.")
+    if (item.quantity, item.location_id) != (quantity_before, location_before):
+        # Правка остатка или локации мимо операций тоже попадает в журнал остатков
+        op_type = OperationType.inventory if item.quantity != quantity_before else OperationType.move
+        await ledger.write_entries(session, [ledger.ledger_entry(
+            item.id, op_type, quantity_before, location_before, item.quantity, item.location_id,
+        )])
+    await location_stock.apply_change(
+        session, (location_before, quantity_before, weight_before), (item.location_id, item.quantity, item.weight),
+    )
+    changes.record(session, changes.ITEM, [item.id])
     await session.refresh(item, attribute_names=['location'])
-    return serialize_item(item)
+    result = serialize_item(item)
+    _on_item_saved(session, result, old_code=old_code, old_location_id=location_before)
+    return result
 
 async def delete_item(item_id: int, session: AsyncSession) -> bool:
-    item = await session.scalar(select(ItemORM).where(ItemORM.id == item_id))
+    # FOR UPDATE по той же причине, что в update_item: из этого состояния вычитается дельта агрегатов
+    item = await session.scalar(select(ItemORM).where(ItemORM.id == item_id).with_for_update())
     if not item:
         return False
     associated_operations_count = await session.scalar(select(func.count(OperationORM.id)).where(OperationORM.item_id == item_id))
@@ -165,21 +328,39 @@ async def delete_item(item_id: int, session: AsyncSession) -> bool:
 
     await session.delete(item)
     await session.flush()
+    await location_stock.apply_change(session, (item.location_id, item.quantity, item.weight), None)
+    changes.record(session, changes.ITEM, [item.id], deleted=True)
+    _on_item_deleted(session, item.id, item.code, item.location_id)
     return True
 
+LOCATION_NAME_TAKEN = "Локация с таким именем уже существует в этой родительской локации."
+
+async def _location_name_taken(session: AsyncSession, name: str, parent_id: Optional[int], exclude_id: Optional[int] = None) -> bool:
+    # Условие повторяет уникальный индекс ix_locations_parent_id_name, поэтому проверка идет по нему
+    query = select(LocationORM.id).where(
+        func.coalesce(LocationORM.parent_id, 0) == (parent_id or 0), LocationORM.name == name,
+    )
+    if exclude_id is not None:
+        query = query.where(LocationORM.id != exclude_id)
+    return await session.scalar(query) is not None
+
 async def create_new_location(location_data: LocationCreateSchema, session: AsyncSession) -> LocationReadSchema:
     try:
-        existing_location = await session.scalar(
-            select(LocationORM).where(LocationORM.name == location_data.name)
-        )
-        if existing_location:
-            raise HTTPException(status_code=400, detail="Локация с таким именем уже существует.")
+        if await _location_name_taken(session, location_data.name, location_data.parent_id):
+            raise HTTPException(status_code=400, detail=LOCATION_NAME_TAKEN)
+        if location_data.parent_id is not None and not await session.scalar(
+            select(LocationORM.id).where(LocationORM.id == location_data.parent_id)
+        ):
+            raise HTTPException(status_code=400, detail="Родительская локация не найдена.")
         new_location = LocationORM(
             name=location_data.name,
-            description=location_data.description
+            description=location_data.description,
+            parent_id=location_data.parent_id,
         )
         session.add(new_location)
         await session.flush()
+        await location_tree.add_location(session, new_location.id, new_location.parent_id)
+        changes.record(session, changes.LOCATION, [new_location.id])
         await session.refresh(new_location)
         return serialize_location(new_location)
     except IntegrityError as e:
@@ -196,104 +377,413 @@ async def update_existing_location(location_id: int, location_data: LocationUpda
 
     update_dict = location_data.model_dump(exclude_unset=True)
 
+    name = update_dict.get('name') or location.name
+    parent_id = update_dict['parent_id'] if 'parent_id' in update_dict else location.parent_id
+    if (name, parent_id) != (location.name, location.parent_id) and await _location_name_taken(
+        session, name, parent_id, exclude_id=location.id,
+    ):
+        raise HTTPException(status_code=400, detail=LOCATION_NAME_TAKEN)
+
+    if 'parent_id' in update_dict and update_dict['parent_id'] != location.parent_id:
+        parent_id = update_dict['parent_id']
+        if parent_id is not None and not await session.scalar(select(LocationORM.id).where(LocationORM.id == parent_id)):
+            raise HTTPException(status_code=400, detail="Родительская локация не найдена.")
+        # Поддерево переносится вместе с локацией; перенос внутрь себя отклоняется
+        await location_tree.reparent(session, location.id, parent_id)
+
     for key, value in update_dict.items():
         if hasattr(location, key):
             setattr(location, key, value)
 
-    await session.flush()
+    try:
+        await session.flush()
+    except IntegrityError:
+        # Параллельный запрос успел занять то же имя у того же родителя
+        await session.rollback()
+        raise HTTPException(status_code=400, detail=LOCATION_NAME_TAKEN)
+    changes.record(session, changes.LOCATION, [location.id])
     await session.refresh(location)
     return serialize_location(location)
 
-async def delete_existing_location(location_id: int, session: AsyncSession) -> bool:
-    location = await session.scalar(select(LocationORM).where(LocationORM.id == location_id))
-    if not location:
+async def delete_existing_location(location_id: int, session: AsyncSession, recursive: bool = False) -> bool:
+    """
+    Удаляет локацию. Локация с дочерними удаляется только с recursive=True, вместе со всем поддеревом.
+    Если в поддереве есть товары, удаление отклоняется: товары сначала нужно переместить.
+    """
+    subtree = list(await session.scalars(location_tree.subtree_ids(location_id)))
+    if not subtree:
         return False
-    associated_items_count = await session.scalar(select(func.count(ItemORM.id)).where(ItemORM.location_id == location_id))
-    # В вашей OperationORM нет from_location_id или to_location_id, поэтому эти проверки невозможны напрямую
-    # Если вы хотите, чтобы операции "перемещение" препятствовали удалению локации,
-    # нужно будет добавить поля from_location_id и to_location_id в OperationORM.
-    # В текущей реализации, удаление локации, в которой есть товары, заблокировано.
-    if associated_items_count > 0:
+    if len(subtree) > 1 and not recursive:
+        raise HTTPException(status_code=400, detail="У локации есть вложенные локации. Удалите их или передайте recursive=true.")
+    has_items = await session.scalar(select(select(ItemORM.id).where(ItemORM.location_id.in_(subtree)).exists()))
+    if has_items:
         raise HTTPException(status_code=400, detail="Невозможно удалить локацию, так как с ней связаны товары. Сначала переместите их.")
-    await session.delete(location)
-    await session.flush()
+    # Одна команда удаляет все поддерево: ссылки parent_id внутри него проверяются в конце команды,
+    # строки location_tree и location_stock удаляются каскадом
+    await session.execute(
+        delete(LocationORM).where(LocationORM.id.in_(subtree)).execution_options(synchronize_session=False)
+    )
+    changes.record(session, changes.LOCATION, subtree, deleted=True)
     return True
 
+async def get_subtree_items(location_id: int, session: AsyncSession, params: PageParams) -> PageSchema:
+    """Товары локации и всех вложенных: одно соединение items с location_tree."""
+    if not await session.scalar(select(LocationORM.id).where(LocationORM.id == location_id)):
+        raise HTTPException(status_code=404, detail="Локация не найдена")
+    items, next_cursor = await paginate(
+        session, ItemORM, params,
+        allowed_fields=ITEM_FIELDS, sortable=ITEM_SORTABLE_FIELDS,
+        where=[ItemORM.location_id.in_(location_tree.subtree_ids(location_id))],
+    )
+    return PageSchema.model_construct(items=items, next_cursor=next_cursor)
+
 async def fetch_location_by_id(location_id: int, session: AsyncSession) -> Optional[LocationORM]:
     location = await session.scalar(select(LocationORM).where(LocationORM.id == location_id))
     return location
 
-async def fetch_all_locations(session: AsyncSession) -> List[LocationReadSchema]:
-    locations = await session.scalars(select(LocationORM))
-    return [serialize_location(loc) for loc in locations]
+async def fetch_all_locations(session: AsyncSession, params: PageParams) -> PageSchema:
+    return await single_flight.do(
+        ("fetch_all_locations", session.bind, astuple(params)), lambda: _fetch_all_locations(session, params),
+    )
+
+async def _fetch_all_locations(session: AsyncSession, params: PageParams) -> PageSchema:
+    locations, next_cursor = await paginate(
+        session, LocationORM, params,
+        allowed_fields=LOCATION_FIELDS, sortable=LOCATION_SORTABLE_FIELDS,
+    )
+    return PageSchema.model_construct(items=locations, next_cursor=next_cursor)
+
+async def _raise_rejected_operation(op_data: OperationCreateSchema, session: AsyncSession) -> None:
+    """
+    Условный UPDATE не затронул ни одной строки. Выясняем причину отдельным SELECT:
+    этот запрос выполняется только на пути ошибки.
+    """
+    current = (await session.execute(
+        select(ItemORM.quantity, ItemORM.location_id).where(ItemORM.id == op_data.item_id)
+    )).first()
+    if not current:
+        raise HTTPException(status_code=404, detail="Товар не найден.")
+    if op_data.type == OperationType.ship:
+        raise HTTPException(status_code=400, detail="Недостаточно товара для отгрузки.")
+    if op_data.type == OperationType.move:
+        if current.location_id == op_data.to_location_id:
+            raise HTTPException(status_code=400, detail="Товар уже находится в указанной конечной локации.")
+        if op_data.from_location_id and current.location_id not in set(await session.scalars(
+            location_tree.subtree_ids(op_data.from_location_id)
+        )):
+            raise HTTPException(status_code=400, detail="Начальная локация операции перемещения не совпадает с текущей локацией товара.")
+        raise HTTPException(status_code=404, detail=f"Конечная локация с ID {op_data.to_location_id} не найдена.")
+    raise HTTPException(status_code=409, detail="Не удалось применить операцию к товару.")
 
 async def process_operation(op_data: OperationCreateSchema, user_tg_id: int, session: AsyncSession) -> OperationReadSchema:
-    # Ищем пользователя по tg_id, который совершает операцию
-    user_performer = await fetch_user_by_tg_id(user_tg_id, session)
+    # Пользователь, совершающий операцию, обычно уже лежит в user_cache после авторизации запроса
+    user_performer = await fetch_auth_user(user_tg_id, session)
     if not user_performer:
         raise HTTPException(status_code=404, detail="Пользователь, совершающий операцию, не найден.")
 
-    item = await session.scalar(select(ItemORM).where(ItemORM.id == op_data.item_id))
-    if not item:
-        raise HTTPException(status_code=404, detail="Товар не найден.")
+    # Изменение остатка - один условный UPDATE ... RETURNING. Проверка и запись выполняются
+    # атомарно в БД, поэтому параллельные отгрузки одного товара не теряют обновления
+    # и не уводят остаток в минус. Подзапрос old с FOR NO KEY UPDATE (как у самого UPDATE) отдает
+    # состояние до изменения для журнала остатков в том же запросе
+    old = (
+        select(ItemORM.id, ItemORM.quantity, ItemORM.location_id)
+        .where(ItemORM.id == op_data.item_id)
+        .with_for_update(key_share=True)
+        .subquery("old")
+    )
+    stmt = update(ItemORM).where(ItemORM.id == old.c.id)
+    if op_data.type == OperationType.receive:
+        stmt = stmt.values(quantity=ItemORM.quantity + op_data.quantity)
+    elif op_data.type == OperationType.ship:
+        stmt = stmt.where(ItemORM.quantity >= op_data.quantity).values(quantity=ItemORM.quantity - op_data.quantity)
+    elif op_data.type == OperationType.inventory:
+        stmt = stmt.values(quantity=op_data.quantity) # Устанавливаем новое количество
+    elif op_data.type == OperationType.move:
+        if not op_data.to_location_id: # Для перемещения to_location_id обязателен
+            raise HTTPException(status_code=400, detail="Для операции 'перемещение' необходима конечная локация (to_location_id).")
+        stmt = stmt.where(
+            ItemORM.location_id != op_data.to_location_id,
+            select(LocationORM.id).where(LocationORM.id == op_data.to_location_id).exists(),
+        ).values(location_id=op_data.to_location_id)
+        # Проверяем, что товар лежит в from_location_id или во вложенной в нее локации, если она указана:
+        # сканер может указать зону, а не конкретную ячейку
+        if op_data.from_location_id:
+            stmt = stmt.where(ItemORM.location_id.in_(location_tree.subtree_ids(op_data.from_location_id)))
+
+    item_row = (await session.execute(
+        stmt.returning(
+            *(getattr(ItemORM, name) for name in ITEM_FIELDS),
+            old.c.quantity.label("quantity_before"),
+            old.c.location_id.label("location_before"),
+        ),
+        execution_options={"synchronize_session": False},
+    )).mappings().first()
+    if item_row is None:
+        await _raise_rejected_operation(op_data, session)
+
+    # Поля quantity, from_location_id, to_location_id не сохраняются в OperationORM:
+    # количество и локации до и после операции пишутся в журнал остатков (stock_ledger)
+    operation_row = (await session.execute(
+        insert(OperationORM)
+        .values(
+            item_id=op_data.item_id,
+            user_id=user_performer.id, # ID пользователя из БД
+            type=op_data.type,
+            note=op_data.note,
+            created_by_id=user_performer.id, # Кто создал запись операции (тот же, кто совершил)
+        )
+        .returning(*(getattr(OperationORM, name) for name in OPERATION_FIELDS))
+    )).mappings().one()
+    await ledger.write_entries(session, [ledger.ledger_entry(
+        op_data.item_id, op_data.type,
+        item_row["quantity_before"], item_row["location_before"],
+        item_row["quantity"], item_row["location_id"],
+        operation_id=operation_row["id"],
+    )])
+    await location_stock.apply_change(
+        session,
+        (item_row["location_before"], item_row["quantity_before"], item_row["weight"]),
+        (item_row["location_id"], item_row["quantity"], item_row["weight"]),
+    )
+    changes.record(session, changes.ITEM, [op_data.item_id])
 
-    # Логика изменения количества ItemORM.quantity
+    _on_item_saved(
+        session, ItemReadSchema.model_validate({name: item_row[name] for name in ITEM_FIELDS}),
+        old_location_id=item_row["location_before"],
+    )
+    return OperationReadSchema.model_validate(dict(operation_row))
+
+def _apply_line_to_item(
+    op_data: OperationCreateSchema,
+    item: Dict[str, Any],
+    known_locations: set,
+    subtrees: Dict[int, Set[int]],
+) -> None:
+    """
+    Применяет строку пакета к состоянию товара в памяти. Правила те же, что у process_operation;
+    при нарушении поднимается HTTPException, состояние товара при этом не меняется.
+    subtrees - поддеревья начальных локаций перемещений (from_location_id -> id локаций).
+    """
     if op_data.type == OperationType.receive:
-        item.quantity += op_data.quantity
+        item["quantity"] += op_data.quantity
     elif op_data.type == OperationType.ship:
-        if item.quantity < op_data.quantity:
+        if item["quantity"] < op_data.quantity:
             raise HTTPException(status_code=400, detail="Недостаточно товара для отгрузки.")
-        item.quantity -= op_data.quantity
+        item["quantity"] -= op_data.quantity
     elif op_data.type == OperationType.inventory:
-        item.quantity = op_data.quantity # Устанавливаем новое количество
+        item["quantity"] = op_data.quantity
     elif op_data.type == OperationType.move:
-        if not op_data.to_location_id: # Для перемещения to_location_id обязателен
+        if not op_data.to_location_id:
             raise HTTPException(status_code=400, detail="Для операции 'перемещение' необходима конечная локация (to_location_id).")
-        if item.location_id == op_data.to_location_id:
+        if item["location_id"] == op_data.to_location_id:
             raise HTTPException(status_code=400, detail="Товар уже находится в указанной конечной локации.")
-        # Проверяем, что from_location_id соответствует текущей локации товара, если указан
-        if op_data.from_location_id and item.location_id != op_data.from_location_id:
+        if op_data.from_location_id and item["location_id"] not in subtrees[op_data.from_location_id]:
             raise HTTPException(status_code=400, detail="Начальная локация операции перемещения не совпадает с текущей локацией товара.")
-
-        # Обновляем локацию товара
-        target_location = await session.scalar(select(LocationORM).where(LocationORM.id == op_data.to_location_id))
-        if not target_location:
+        if op_data.to_location_id not in known_locations:
             raise HTTPException(status_code=404, detail=f"Конечная локация с ID {op_data.to_location_id} не найдена.")
-        item.location_id = op_data.to_location_id
+        item["location_id"] = op_data.to_location_id
+
+async def apply_operations(
+    entries: List[Tuple[OperationCreateSchema, int]],
+    session: AsyncSession,
+) -> List[Any]:
+    """
+    Применяет набор операций (операция, id пользователя) в текущей транзакции за постоянное число запросов:
+    один SELECT ... FOR NO KEY UPDATE по всем товарам, по одному SELECT по целевым локациям и поддеревьям
+    начальных локаций перемещений, один пакетный UPDATE остатков и один пакетный INSERT операций.
+    Строки применяются по порядку, поэтому несколько строк по одному товару видят результат предыдущих.
+    Возвращает для каждой строки OperationReadSchema или HTTPException с причиной отказа.
+    """
+    item_ids = sorted({op_data.item_id for op_data, _ in entries})
+    # Блокируем строки товаров в порядке id, чтобы параллельные пакеты не взаимоблокировались
+    item_rows = (await session.execute(
+        select(*(getattr(ItemORM, name) for name in ITEM_FIELDS))
+        .where(ItemORM.id.in_(item_ids))
+        .order_by(ItemORM.id)
+        .with_for_update(key_share=True)
+    )).mappings().all()
+    items = {row["id"]: dict(row) for row in item_rows}
+    original = {item_id: (item["location_id"], item["quantity"], item["weight"]) for item_id, item in items.items()}
+
+    location_ids = {op_data.to_location_id for op_data, _ in entries
+                    if op_data.type == OperationType.move and op_data.to_location_id}
+    known_locations = set()
+    if location_ids:
+        known_locations = set(await session.scalars(
+            select(LocationORM.id).where(LocationORM.id.in_(location_ids))
+        ))
+    subtrees = await location_tree.descendants_of(session, {
+        op_data.from_location_id for op_data, _ in entries
+        if op_data.type == OperationType.move and op_data.from_location_id
+    })
+
+    results: List[Any] = [None] * len(entries)
+    operation_rows = []
+    operation_indexes = []
+    ledger_rows = []
+    changed_items = set()
+    for index, (op_data, user_id) in enumerate(entries):
+        item = items.get(op_data.item_id)
+        if item is None:
+            results[index] = HTTPException(status_code=404, detail="Товар не найден.")
+            continue
+        quantity_before, location_before = item["quantity"], item["location_id"]
+        try:
+            _apply_line_to_item(op_data, item, known_locations, subtrees)
+        except HTTPException as e:
+            results[index] = e
+            continue
+        ledger_rows.append(ledger.ledger_entry(
+            item["id"], op_data.type, quantity_before, location_before, item["quantity"], item["location_id"],
+        ))
+        changed_items.add(item["id"])
+        operation_indexes.append(index)
+        operation_rows.append({
+            "item_id": item["id"],
+            "user_id": user_id,
+            "type": op_data.type,
+            "note": op_data.note,
+            "created_by_id": user_id,
+        })
+
+    if changed_items:
+        # ORM bulk UPDATE по первичному ключу выполняется одним executemany
+        await session.execute(
+            update(ItemORM),
+            [{"id": item_id, "quantity": items[item_id]["quantity"], "location_id": items[item_id]["location_id"]}
+             for item_id in sorted(changed_items)],
+        )
+    if operation_rows:
+        inserted = (await session.execute(
+            insert(OperationORM).returning(
+                *(getattr(OperationORM, name) for name in OPERATION_FIELDS),
+                sort_by_parameter_order=True,
+            ),
+            operation_rows,
+        )).mappings().all()
+        for index, row, entry in zip(operation_indexes, inserted, ledger_rows):
+            results[index] = OperationReadSchema.model_validate(dict(row))
+            entry["operation_id"] = row["id"]
+        await ledger.write_entries(session, ledger_rows)
+    stock_delta = location_stock.LocationStockDelta()
+    for item_id in changed_items:
+        item = items[item_id]
+        stock_delta.change(original[item_id], (item["location_id"], item["quantity"], item["weight"]))
+    await stock_delta.apply(session)
+    changes.record(session, changes.ITEM, changed_items)
+
+    for item_id in changed_items:
+        _on_item_saved(session, ItemReadSchema.model_validate(items[item_id]), old_location_id=original[item_id][0])
+    return results
+
+async def process_operations_batch(
+    lines: List[OperationCreateSchema],
+    user_tg_id: int,
+    session: AsyncSession,
+) -> OperationBatchResultSchema:
+    user_performer = await fetch_auth_user(user_tg_id, session)
+    if not user_performer:
+        raise HTTPException(status_code=404, detail="Пользователь, совершающий операцию, не найден.")
 
+    outcomes = await apply_operations([(line, user_performer.id) for line in lines], session)
+    results = []
+    for index, outcome in enumerate(outcomes):
+        if isinstance(outcome, HTTPException):
+            results.append(OperationBatchLineResultSchema(
+                index=index, status="error", status_code=outcome.status_code, error=outcome.detail,
+            ))
+        else:
+            results.append(OperationBatchLineResultSchema(index=index, status="ok", operation=outcome))
+    failed = sum(1 for result in results if result.status == "error")
+    return OperationBatchResultSchema(succeeded=len(results) - failed, failed=failed, results=results)
+
+def _operations_log_filters(
+    item_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    op_type: Optional[OperationType] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+) -> list:
+    filters = []
+    if item_id is not None:
+        filters.append(OperationORM.item_id == item_id)
+    if user_id is not None:
+        filters.append(OperationORM.user_id == user_id)
+    if op_type is not None:
+        filters.append(OperationORM.type == op_type)
+    if date_from is not None:
+        filters.append(OperationORM.created_at >= date_from)
+    if date_to is not None:
+        filters.append(OperationORM.created_at < date_to)
+    return filters
+
+async def get_operations_page(
+    session: AsyncSession,
+    limit: int = DEFAULT_PAGE_LIMIT,
+    cursor: Optional[str] = None,
+    item_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    op_type: Optional[OperationType] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+) -> OperationLogPageSchema:
+    # Журнал всегда идет от новых к старым, id разрешает совпадения created_at.
+    # Выбираются только колонки OperationReadSchema: подгрузка item/location/user журналу не нужна
+    params = PageParams(limit=limit, cursor=cursor, sort=OPERATIONS_LOG_SORT, fields=None)
+    rows, next_cursor = await paginate(
+        session, OperationORM, params,
+        allowed_fields=OPERATION_FIELDS, sortable=("created_at", "id"),
+        where=_operations_log_filters(item_id, user_id, op_type, date_from, date_to),
+    )
+    return OperationLogPageSchema.model_construct(
+        items=validate_rows(OperationReadSchema, rows), next_cursor=next_cursor,
+    )
+
+def operations_export_query(
+    item_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    op_type: Optional[OperationType] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+) -> Select:
+    return (
+        select(*(getattr(OperationORM, name) for name in OPERATION_FIELDS))
+        .where(*_operations_log_filters(item_id, user_id, op_type, date_from, date_to))
+        .order_by(OperationORM.created_at.desc(), OperationORM.id.desc())
+    )
 
-    operation = OperationORM(
-        item_id=item.id,
-        user_id=user_performer.id, # ID пользователя из БД
-        type=op_data.type,
-        note=op_data.note,
-        created_by_id=user_performer.id # Кто создал запись операции (тот же, кто совершил)
-        # Поля quantity, from_location_id, to_location_id НЕ будут сохранены в OperationORM,
-        # так как их нет в вашей models.py. Они влияют только на ItemORM.
+def stream_operations_ndjson(
+    item_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    op_type: Optional[OperationType] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+) -> AsyncIterator[bytes]:
+    """Журнал операций построчно в формате NDJSON через серверный курсор."""
+    return stream_query(operations_export_query(item_id, user_id, op_type, date_from, date_to), "ndjson")
+
+def items_export_query() -> Select:
+    # Товары вместе с названием локации; порядок по id дает стабильную выгрузку
+    return (
+        select(
+            ItemORM.id, ItemORM.code, ItemORM.name, ItemORM.weight, ItemORM.quantity,
+            ItemORM.location_id, LocationORM.name.label("location_name"),
+            ItemORM.description, ItemORM.created_at,
+        )
+        .join(LocationORM, LocationORM.id == ItemORM.location_id)
+        .order_by(ItemORM.id)
     )
-    session.add(operation)
-
-    await session.flush() # Flush для получения operation.id
-    # Для сериализации operation, загружаем связанные объекты.
-    # Обратите внимание, что to_location и from_location могут быть None в OperationReadSchema,
-    # если их нет в вашей OperationORM. Здесь они не будут загружены, так как их нет в OperationORM.
-    await session.refresh(operation, attribute_names=['item', 'user'])
-    # Важно также обновить item, чтобы его актуальное состояние было доступно, если нужно
-    await session.refresh(item, attribute_names=['location']) # Чтобы ItemReadSchema получил обновленную локацию
-
-    return serialize_operation(operation)
-
-async def get_all_operations(session: AsyncSession) -> List[OperationReadSchema]:
-    # Загружаем связанные объекты для полноценного отображения в журнале
-    # Item загружаем с его Location, User загружаем
-    operations_query = select(OperationORM).options(
-        selectinload(OperationORM.item).selectinload(ItemORM.location),
-        selectinload(OperationORM.user) # Пользователь, который совершил
-        # created_by_id есть, но нет связи created_by в OperationORM, если не добавили
-        # Если хотите иметь доступ к created_by, нужно добавить relationship в OperationORM
-    ).order_by(OperationORM.created_at.desc())
-    operations = await session.scalars(operations_query)
-    return [serialize_operation(op) for op in operations]
+
+def stock_export_query() -> Select:
+    # Остатки по локациям из агрегатов location_stock; total_weight - суммарный вес (вес единицы * количество)
+    summary = location_stock.summary_query().subquery()
+    return select(
+        summary.c.location_id,
+        summary.c.name.label("location_name"),
+        summary.c.item_count,
+        summary.c.total_quantity,
+        summary.c.total_weight,
+    ).order_by(summary.c.location_id)
 
 async def register_new_user(registration_data: UserCreateSchema, session: AsyncSession) -> UserReadSchema:
     try:
@@ -312,6 +802,7 @@ async def register_new_user(registration_data: UserCreateSchema, session: AsyncS
         session.add(new_user)
         await session.flush()
         await session.refresh(new_user)
+        _invalidate_cached_user(new_user.tg_id, session)
         print(f"Зарегистрирован новый пользователь: {new_user.__dict__}")
         return serialize_user(new_user)
     except IntegrityError as e:
@@ -321,9 +812,12 @@ async def register_new_user(registration_data: UserCreateSchema, session: AsyncS
         await session.rollback()
         raise
 
-async def get_all_users(session: AsyncSession) -> List[UserReadSchema]:
-    users = await session.scalars(select(UserORM))
-    return [serialize_user(user) for user in users]
+async def get_all_users(session: AsyncSession, params: PageParams) -> PageSchema:
+    users, next_cursor = await paginate(
+        session, UserORM, params,
+        allowed_fields=USER_FIELDS, sortable=USER_SORTABLE_FIELDS,
+    )
+    return PageSchema.model_construct(items=users, next_cursor=next_cursor)
 
 async def update_user(user_id: int, user_data: UserUpdateSchema, session: AsyncSession) -> Optional[UserReadSchema]:
     user = await session.scalar(select(UserORM).where(UserORM.id == user_id))
@@ -338,6 +832,7 @@ async def update_user(user_id: int, user_data: UserUpdateSchema, session: AsyncS
 
     await session.flush()
     await session.refresh(user)
+    _invalidate_cached_user(user.tg_id, session)
     return serialize_user(user)
 
 async def delete_user(user_id: int, session: AsyncSession) -> bool:
@@ -355,4 +850,5 @@ async def delete_user(user_id: int, session: AsyncSession) -> bool:
 
     await session.delete(user)
     await session.flush()
-    return True
\ No newline at end of file
+    _invalidate_cached_user(user.tg_id, session)
+    return True
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel, ConfigDict
 
@@ -74,11 +74,13 @@ class ItemReadSchema(OrmBaseModel):
 class LocationCreateSchema(BaseModel):
     name: str_256
     description: Optional[str_256] = None # В модели это str_256, но может быть и опциональным
+    parent_id: Optional[int] = None # Родительская локация, None - корневая
 
 # Схема для обновления локации
 class LocationUpdateSchema(BaseModel):
     name: Optional[str_256] = None
     description: Optional[str_256] = None
+    parent_id: Optional[int] = None # Явный null переносит локацию в корень вместе с поддеревом
 
 # Схема для чтения локации
 class LocationReadSchema(OrmBaseModel):
@@ -86,6 +88,7 @@ class LocationReadSchema(OrmBaseModel):
     name: str_256
     description: str_256 # В модели это не Optional
     created_at: datetime
+    parent_id: Optional[int] = None
     # items: List["ItemReadSchema"] = [] # Для вложенного ответа
 
 # --- Operation Schemas ---
@@ -114,6 +117,110 @@ class OperationReadSchema(OrmBaseModel):
     created_by_id: int
     # item: Optional["ItemReadSchema"] = None # Для вложенного ответа
     # user: Optional["UserReadSchema"] = None # Для вложенного ответа
+
+# Результат одной строки пакетной операции: либо operation, либо status_code + error
+class OperationBatchLineResultSchema(BaseModel):
+    index: int
+    status: str # "ok" или "error"
+    operation: Optional[OperationReadSchema] = None
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+
+class OperationBatchResultSchema(BaseModel):
+    succeeded: int
+    failed: int
+    results: List[OperationBatchLineResultSchema]
+
+# Сводка по локации: число товаров, суммарное количество и вес (вес единицы * количество)
+class LocationSummarySchema(BaseModel):
+    location_id: int
+    name: str
+    item_count: int = 0
+    total_quantity: int = 0
+    total_weight: int = 0
+
+# Итоги поддерева локации: сама локация и все вложенные
+class LocationSubtreeSummarySchema(LocationSummarySchema):
+    location_count: int = 1
+
+# --- Stock Ledger Schemas ---
+class StockLedgerEntrySchema(OrmBaseModel):
+    id: int
+    item_id: int
+    operation_id: Optional[int] = None
+    type: OperationType
+    delta: int
+    quantity_after: int
+    from_location_id: Optional[int] = None
+    location_id: int
+    created_at: datetime
+
+# Остаток товара на момент времени
+class StockPointSchema(BaseModel):
+    item_id: int
+    quantity: int
+    location_id: int
+
+class StockAtSchema(BaseModel):
+    at: datetime
+    snapshot_taken_at: datetime # снимок, от которого восстановлено состояние
+    items: List[StockPointSchema]
+    next_cursor: Optional[str] = None
+
+# Движение товара за период: остаток на начало, изменения и остаток на конец.
+# opening_* равны None, если на начало периода товара еще не было
+class StockHistorySchema(BaseModel):
+    item_id: int
+    date_from: datetime
+    date_to: datetime
+    opening_quantity: Optional[int] = None
+    opening_location_id: Optional[int] = None
+    closing_quantity: Optional[int] = None
+    closing_location_id: Optional[int] = None
+    entries: List[StockLedgerEntrySchema]
+
+class StockSnapshotResultSchema(BaseModel):
+    taken_at: Optional[datetime] = None # None, если снимок не понадобился или его уже снимает другой воркер
+    items: int = 0
+
+# --- Sync Schemas ---
+# Ответ GET /api/sync: текущее состояние сущностей, измененных после since, и id удаленных.
+# next_since передается в следующий запрос; has_more = true, если изменения не поместились в limit
+class SyncResponseSchema(BaseModel):
+    since: int
+    next_since: int
+    has_more: bool
+    items: List[Dict[str, Any]]
+    locations: List[Dict[str, Any]]
+    deleted_items: List[int]
+    deleted_locations: List[int]
+
+# --- Import Schemas ---
+# Отклоненная строка файла импорта: номер строки в файле, код товара (если удалось прочитать) и причина
+class ImportRejectSchema(BaseModel):
+    line: int
+    code: Optional[str] = None
+    error: str
+
+class ImportReportSchema(BaseModel):
+    processed: int = 0
+    imported: int = 0
+    rejected: int = 0
+    rejects: List[ImportRejectSchema] = []
+    rejects_truncated: bool = False # True, если в rejects попали не все отклоненные строки
+
+# Страница журнала операций: next_cursor передается обратно в параметре cursor,
+# None означает, что это последняя страница
+class OperationLogPageSchema(BaseModel):
+    items: List[OperationReadSchema]
+    next_cursor: Optional[str] = None
+
+# Страница любого списка (товары, пользователи, локации). Строки отдаются словарями,
+# так как параметр fields= может оставить в них только часть полей Read-схемы
+class PageSchema(BaseModel):
+    items: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None
+
 class DeleteResponseSchema(BaseModel):
     message: str
     id: Optional[int] = None # ID удаленного объекта, если нужно его вернуть
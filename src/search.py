@@ -0,0 +1,85 @@
+"""
+Поиск товаров по префиксу кода и нечеткому совпадению с названием и описанием.
+
+Поиск идет по индексам миграции v0005: префикс кода - btree text_pattern_ops,
+название и описание - GIN pg_trgm (оператор <%, словесное сходство триграмм).
+
+Оценка: 1.0 за совпадение префикса кода, иначе максимум из сходства с названием и половины
+сходства с описанием. Результаты отдаются по убыванию оценки, при равенстве по id, страницами
+с keyset-курсором. Для коротких запросов (короче BROAD_QUERY_LENGTH) оцениваются только первые
+SEARCH_CANDIDATE_LIMIT совпадений по id: такой запрос подходит к большой части каталога, и полная
+сортировка всех совпадений стоила бы как сканирование таблицы.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import and_, case, func, literal, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import ItemORM
+from pagination import decode_cursor, encode_cursor
+from schemas import ItemReadSchema
+
+ITEM_SEARCH_FIELDS = tuple(ItemReadSchema.model_fields)
+DESCRIPTION_WEIGHT = 0.5
+# Запрос короче BROAD_QUERY_LENGTH совпадает с большой частью каталога (префикс кода "46", слово "ко"):
+# оцениваются и сортируются только первые SEARCH_CANDIDATE_LIMIT совпадений по id
+BROAD_QUERY_LENGTH = 3
+SEARCH_CANDIDATE_LIMIT = 1000
+
+
+def _decode_search_cursor(cursor: str, query: str) -> Tuple[float, int]:
+    values = decode_cursor(cursor)
+    if len(values) != 3 or values[0] != query:
+        raise HTTPException(status_code=400, detail="Курсор не соответствует поисковому запросу.")
+    try:
+        return float(values[1]), int(values[2])
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Некорректный курсор пагинации.")
+
+
+def _like_prefix(query: str) -> str:
+    return query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+async def _search(session: AsyncSession, query: str, limit: int,
+                           after: Optional[Tuple[float, int]]) -> List[Dict[str, Any]]:
+    code_prefix = ItemORM.code.like(_like_prefix(query), escape="\\")
+    q = literal(query)
+    score = func.greatest(
+        case((code_prefix, 1.0), else_=0.0),
+        func.word_similarity(q, ItemORM.name),
+        func.word_similarity(q, ItemORM.description) * DESCRIPTION_WEIGHT,
+    ).label("score")
+    # Каждое условие использует свой индекс, PostgreSQL объединяет их через BitmapOr
+    candidates = (
+        select(*(getattr(ItemORM, name) for name in ITEM_SEARCH_FIELDS), score)
+        .where(or_(code_prefix, q.op("<%")(ItemORM.name), q.op("<%")(ItemORM.description)))
+    )
+    if len(query) < BROAD_QUERY_LENGTH:
+        # Совпадений много, поэтому выгоднее идти по первичному ключу с фильтром и остановиться на пределе,
+        # чем собирать и сортировать по оценке все совпадения. Порядок по id делает набор кандидатов
+        # одинаковым для всех страниц курсора
+        candidates = candidates.order_by(ItemORM.id).limit(SEARCH_CANDIDATE_LIMIT)
+    matched = candidates.subquery()
+    stmt = select(matched)
+    if after is not None:
+        last_score, last_id = after
+        stmt = stmt.where(or_(matched.c.score < last_score, and_(matched.c.score == last_score, matched.c.id > last_id)))
+    stmt = stmt.order_by(matched.c.score.desc(), matched.c.id).limit(limit + 1)
+    return [dict(row) for row in (await session.execute(stmt)).mappings()]
+
+
+async def search_items(session: AsyncSession, query: str, limit: int,
+                       cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Страница результатов поиска и курсор следующей страницы (None на последней)."""
+    query = query.strip()
+    if not query:
+        raise HTTPException(status_code=400, detail="Пустой поисковый запрос.")
+    after = _decode_search_cursor(cursor, query) if cursor else None
+    rows = await _search(session, query, limit, after)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([query, rows[-1]["score"], rows[-1]["id"]])
+    return rows, next_cursor
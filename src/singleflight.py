@@ -0,0 +1,67 @@
+"""
+Объединение одинаковых одновременных чтений (single-flight).
+
+Первый вызов с ключом выполняет работу, вызовы с тем же ключом, пришедшие до ее завершения,
+ждут его результат и получают тот же объект (или то же исключение). Результат не кэшируется:
+после завершения следующий вызов снова идет в БД. Поэтому объединенный вызов видит данные не старее,
+чем уже выполнявшийся запрос, а ключи функций чтения включают движок сессии, чтобы запросы
+с primary (окно "read your own writes") не получали результат чтения с реплики.
+
+Если первый вызов отменен (клиент отключился), ожидающие не отменяются, а выполняют работу сами.
+Рассчитано на один event loop, поэтому обходится без блокировок.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class _LeaderCancelled(Exception):
+    pass
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self.executed = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._calls.get(key)
+        if future is not None:
+            self.shared += 1
+            try:
+                return await asyncio.shield(future)
+            except _LeaderCancelled:
+                return await self.do(key, fn)
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self.executed += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.set_exception(_LeaderCancelled())
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+            if future.done() and not future.cancelled():
+                future.exception() # ожидающих может не быть: помечаем исключение полученным
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.executed + self.shared
+        return {
+            "in_flight": len(self._calls),
+            "executed": self.executed,
+            "shared": self.shared,
+            "shared_ratio": round(self.shared / total, 4) if total else None,
+        }
+
+
+# Общий экземпляр для функций чтения requests.py и кодирования ответов conditional.py:
+# ключи начинаются с имени функции и не пересекаются
+reads = SingleFlight()
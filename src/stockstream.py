@@ -0,0 +1,254 @@
+"""
+Рассылка изменений остатков подписчикам (WebSocket /ws/stock и SSE /api/stock/events).
+
+Функции записи после COMMIT передают измененный товар в broker.publish_item / publish_deleted
+(через _on_item_saved и _on_item_deleted в requests.py), поэтому откаченные изменения не рассылаются,
+а таблицы товаров не опрашиваются. Событие кодируется в JSON один раз на все подписки.
+
+Подписка фильтруется по локациям и/или товарам; без фильтров приходят все события. Подписка на локацию
+получает события всего ее поддерева: фоновая задача broker.run() дополняет локации события их предками
+из location_tree (один запрос на пачку событий). Подписчики проиндексированы по id локации и товара,
+так что публикация затрагивает только подходящие подписки, сколько бы простаивающих клиентов ни было
+подключено. У каждой подписки своя ограниченная очередь: медленный клиент, переполнивший ее, получает
+событие overflow и отключается, после чего догоняет состояние через GET /api/sync.
+
+Между воркерами события передаются через LISTEN/NOTIFY: broker.run() держит отдельное соединение primary,
+слушает канал NOTIFY_CHANNEL и, доставив пачку своим подписчикам, отправляет ее (уже с предками) через
+pg_notify; собственные уведомления воркер пропускает. При потере соединения все подписчики получают overflow,
+потому что события других воркеров могли потеряться. Без broker.run() (скрипты, тесты) события
+доставляются сразу, только подписчикам самой локации и только в своем процессе.
+"""
+import asyncio
+import json
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from database import async_engine
+from schemas import ItemReadSchema
+import location_tree
+
+SUBSCRIBER_QUEUE_SIZE = 256
+HEARTBEAT_SECONDS = 25.0
+MAX_FILTER_IDS = 100
+OVERFLOW_EVENT = json.dumps({"type": "overflow"})
+
+NOTIFY_CHANNEL = "stock_events"
+# Предел PostgreSQL для payload NOTIFY - 8000 байт, пачка событий делится на уведомления меньше него
+NOTIFY_PAYLOAD_LIMIT = 7900
+# Проверка соединения LISTEN, если событий нет, и пауза перед переподключением после ошибки
+RELAY_PING_SECONDS = 30.0
+RELAY_RETRY_SECONDS = 5.0
+
+
+class Subscription:
+    __slots__ = ("location_ids", "item_ids", "queue", "overflowed")
+
+    def __init__(self, location_ids: FrozenSet[int], item_ids: FrozenSet[int]):
+        self.location_ids = location_ids
+        self.item_ids = item_ids
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    async def next_event(self) -> Optional[str]:
+        """Следующее закодированное событие; None, если за HEARTBEAT_SECONDS событий не было."""
+        if self.overflowed and self.queue.empty():
+            return OVERFLOW_EVENT
+        try:
+            return await asyncio.wait_for(self.queue.get(), HEARTBEAT_SECONDS)
+        except asyncio.TimeoutError:
+            return None
+
+
+class StockBroker:
+    def __init__(self):
+        self._everything: Set[Subscription] = set()
+        self._by_location: Dict[int, Set[Subscription]] = defaultdict(set)
+        self._by_item: Dict[int, Set[Subscription]] = defaultdict(set)
+        self.published = 0
+        self.delivered = 0
+        self.overflows = 0
+        self.received = 0 # события из других воркеров
+        self.relay_errors = 0
+        # Отправитель уведомлений: по нему воркер узнает и пропускает свои события
+        self.origin = uuid.uuid4().hex
+        self._relaying = False
+        self._pending: List[Tuple[int, Tuple[int, ...], Dict[str, Any]]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def subscribe(self, location_ids: Iterable[int] = (), item_ids: Iterable[int] = ()) -> Subscription:
+        subscription = Subscription(frozenset(location_ids), frozenset(item_ids))
+        if not subscription.location_ids and not subscription.item_ids:
+            self._everything.add(subscription)
+        for location_id in subscription.location_ids:
+            self._by_location[location_id].add(subscription)
+        for item_id in subscription.item_ids:
+            self._by_item[item_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._everything.discard(subscription)
+        for index, ids in ((self._by_location, subscription.location_ids), (self._by_item, subscription.item_ids)):
+            for key in ids:
+                subscribers = index.get(key)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del index[key]
+
+    def _publish(self, item_id: int, location_ids: Iterable[int], event: Dict[str, Any]) -> None:
+        self.published += 1
+        if self._relaying:
+            self._pending.append((item_id, tuple(location_ids), event))
+            self._wakeup.set()
+            return
+        self._deliver(item_id, location_ids, json.dumps(event, ensure_ascii=False, default=str))
+
+    def _deliver(self, item_id: int, location_ids: Iterable[int], payload: str) -> None:
+        targets = set(self._everything)
+        if item_id in self._by_item:
+            targets |= self._by_item[item_id]
+        for location_id in location_ids:
+            if location_id in self._by_location:
+                targets |= self._by_location[location_id]
+        for subscription in targets:
+            if subscription.overflowed:
+                continue
+            try:
+                subscription.queue.put_nowait(payload)
+                self.delivered += 1
+            except asyncio.QueueFull:
+                # Клиент не успевает читать: отключаем его, а не копим события в памяти
+                subscription.overflowed = True
+                self.overflows += 1
+                self.unsubscribe(subscription)
+
+    def publish_item(self, item: ItemReadSchema, previous_location_id: Optional[int] = None) -> None:
+        event = {
+            "type": "item",
+            "id": item.id,
+            "code": item.code,
+            "quantity": item.quantity,
+            "weight": item.weight,
+            "location_id": item.location_id,
+        }
+        locations = {item.location_id}
+        if previous_location_id is not None and previous_location_id != item.location_id:
+            # Подписчики старой локации тоже должны узнать, что товар из нее ушел
+            event["previous_location_id"] = previous_location_id
+            locations.add(previous_location_id)
+        self._publish(item.id, locations, event)
+
+    def publish_deleted(self, item_id: int, code: str, location_id: int) -> None:
+        self._publish(item_id, (location_id,), {
+            "type": "item_deleted", "id": item_id, "code": code, "location_id": location_id,
+        })
+
+    def _subscriptions(self) -> Set[Subscription]:
+        subscriptions = set(self._everything)
+        for index in (self._by_location, self._by_item):
+            for subscribers in index.values():
+                subscriptions |= subscribers
+        return subscriptions
+
+    def _drop_all(self) -> None:
+        """Отключает всех подписчиков через overflow: они догонят пропущенное через GET /api/sync."""
+        for subscription in self._subscriptions():
+            subscription.overflowed = True
+            self.unsubscribe(subscription)
+
+    async def run(self) -> None:
+        """
+        Фоновая задача приложения: доставляет события с предками локаций своим подписчикам
+        и обменивается ими с другими воркерами через LISTEN/NOTIFY.
+        """
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                async with async_engine.connect() as conn:
+                    driver = (await conn.get_raw_connection()).driver_connection
+                    await driver.add_listener(NOTIFY_CHANNEL, self._on_notify)
+                    try:
+                        self._relaying = True
+                        await self._relay_forever(conn)
+                    finally:
+                        self._relaying = False
+                        # Соединение вернется в пул: обработчик уведомлений на нем больше не нужен
+                        if not driver.is_closed():
+                            await driver.remove_listener(NOTIFY_CHANNEL, self._on_notify)
+            except asyncio.CancelledError:
+                # Остановка приложения: накопленное отдаем своим подписчикам как есть
+                pending, self._pending = self._pending, []
+                for item_id, location_ids, event in pending:
+                    self._deliver(item_id, location_ids, json.dumps(event, ensure_ascii=False, default=str))
+                raise
+            except Exception as e:
+                self.relay_errors += 1
+                print(f"Рассылка событий остатков: {e!r}, переподключение через {RELAY_RETRY_SECONDS} с")
+                self._pending = []
+                self._drop_all()
+            await asyncio.sleep(RELAY_RETRY_SECONDS)
+
+    async def _relay_forever(self, conn: AsyncConnection) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), RELAY_PING_SECONDS)
+            except asyncio.TimeoutError:
+                await conn.execute(text("SELECT 1"))
+                await conn.commit()
+                continue
+            self._wakeup.clear()
+            batch, self._pending = self._pending, []
+            await self._relay(conn, batch)
+
+    async def _relay(self, conn: AsyncConnection, batch: List[Tuple[int, Tuple[int, ...], Dict[str, Any]]]) -> None:
+        ancestors = await location_tree.ancestors_of(conn, {location_id for _, ids, _ in batch for location_id in ids})
+        messages = []
+        for item_id, location_ids, event in batch:
+            locations = sorted(set().union(*(ancestors[location_id] for location_id in location_ids)))
+            payload = json.dumps(event, ensure_ascii=False, default=str)
+            self._deliver(item_id, locations, payload)
+            messages.append(f"[{item_id},{json.dumps(locations)},{payload}]")
+        # Уведомления уходят при COMMIT, после него соединение свободно и получает уведомления других воркеров
+        for notification in self._notifications(messages):
+            await conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": NOTIFY_CHANNEL, "payload": notification})
+        await conn.commit()
+
+    def _notifications(self, messages: List[str]) -> Iterable[str]:
+        head = f'{{"origin":"{self.origin}","events":['
+        chunk: List[str] = []
+        size = len(head) + 2
+        for message in messages:
+            length = len(message.encode()) + 1
+            if chunk and size + length > NOTIFY_PAYLOAD_LIMIT:
+                yield head + ",".join(chunk) + "]}"
+                chunk, size = [], len(head) + 2
+            chunk.append(message)
+            size += length
+        if chunk:
+            yield head + ",".join(chunk) + "]}"
+
+    def _on_notify(self, connection, pid: int, channel: str, payload: str) -> None:
+        message = json.loads(payload)
+        if message["origin"] == self.origin:
+            return
+        for item_id, location_ids, event in message["events"]:
+            self.received += 1
+            self._deliver(item_id, location_ids, json.dumps(event, ensure_ascii=False))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "subscribers": len(self._subscriptions()),
+            "published": self.published,
+            "delivered": self.delivered,
+            "overflows": self.overflows,
+            "relaying": self._relaying,
+            "received": self.received,
+            "relay_errors": self.relay_errors,
+        }
+
+
+broker = StockBroker()
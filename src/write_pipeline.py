@@ -0,0 +1,129 @@
+"""
+Групповая фиксация операций POST /api/operations (включается OPERATIONS_GROUP_COMMIT).
+
+Вместо отдельной транзакции на каждый запрос операции ставятся в очередь, а фоновая задача
+собирает их в пакет (до GROUP_COMMIT_MAX_BATCH операций или GROUP_COMMIT_MAX_DELAY_MS миллисекунд
+с первой операции пакета) и применяет одной транзакцией через rq.apply_operations. Каждый вызывающий
+получает свой результат: OperationReadSchema или HTTPException с причиной отказа его строки.
+
+Пакеты фиксируются строго по одному, а строки внутри пакета применяются в порядке поступления,
+поэтому операции по одному товару выполняются в том порядке, в каком пришли в воркер.
+Ошибка COMMIT отклоняет весь пакет: каждый вызывающий получает 500, ничего не сохраняется.
+"""
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from database import async_session_factory, read_router
+from schemas import OperationCreateSchema, OperationReadSchema
+import requests as rq
+
+# (операция, id пользователя, tg_id пользователя, future вызывающего)
+PendingOperation = Tuple[OperationCreateSchema, int, int, "asyncio.Future[OperationReadSchema]"]
+
+
+class OperationWritePipeline:
+    def __init__(self, max_batch: int, max_delay_ms: float, queue_size: int):
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        # Ограниченная очередь: при отставании БД новые запросы ждут места, а не копятся в памяти
+        self._queue: "asyncio.Queue[Optional[PendingOperation]]" = asyncio.Queue(maxsize=queue_size)
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.operations = 0
+        self.failed_batches = 0
+        self.max_batch_seen = 0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Дожидается фиксации уже принятых операций и останавливает фоновую задачу."""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, op_data: OperationCreateSchema, user_id: int, tg_id: int) -> OperationReadSchema:
+        if self._task is None:
+            raise RuntimeError("Конвейер записи не запущен.")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((op_data, user_id, tg_id, future))
+        # shield: отключение клиента не отменяет операцию, которая уже может быть в пакете
+        return await asyncio.shield(future)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    entry = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        entry = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if entry is None:
+                    stopping = True
+                    break
+                batch.append(entry)
+            try:
+                await self._commit(batch)
+            except Exception as e:
+                # Например, ошибка закрытия сессии: задача должна жить, иначе новые операции повиснут
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    async def _commit(self, batch: List[PendingOperation]) -> None:
+        self.batches += 1
+        self.operations += len(batch)
+        self.max_batch_seen = max(self.max_batch_seen, len(batch))
+        async with async_session_factory() as session:
+            try:
+                outcomes: List[Any] = await rq.apply_operations(
+                    [(op_data, user_id) for op_data, user_id, _, _ in batch], session,
+                )
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                self.failed_batches += 1
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(HTTPException(
+                            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f"Внутренняя ошибка сервера: {e}",
+                        ))
+                return
+        # Окно "read your own writes" для всех авторов пакета (у сессии пакета нет одного actor_tg_id)
+        for tg_id in {tg_id for _, _, tg_id, _ in batch}:
+            read_router.mark_write(tg_id)
+        for (*_, future), outcome in zip(batch, outcomes):
+            if future.done():
+                continue
+            if isinstance(outcome, HTTPException):
+                future.set_exception(outcome)
+            else:
+                future.set_result(outcome)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "batches": self.batches,
+            "operations": self.operations,
+            "failed_batches": self.failed_batches,
+            "avg_batch": round(self.operations / self.batches, 2) if self.batches else None,
+            "max_batch": self.max_batch_seen,
+        }
@@ -0,0 +1,111 @@
+"""
+Интеграционные тесты против отдельной тестовой БД PostgreSQL.
+
+Подключение берется из DB_HOST, DB_PORT, DB_USER, DB_PASS, а имя БД - из TEST_DB_NAME
+(по умолчанию stock_test). Тесты очищают все таблицы, поэтому имя БД обязано оканчиваться на _test.
+Если БД недоступна, тесты с фикстурой db пропускаются.
+
+    TEST_DB_NAME=stock_test python -m pytest -q
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+os.environ["DB_NAME"] = os.environ.get("TEST_DB_NAME", "stock_test")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_PORT", "5432")
+os.environ.setdefault("DB_USER", "postgres")
+os.environ.setdefault("DB_PASS", "postgres")
+# Фоновые снимки остатков и групповая фиксация в тестах не нужны: тесты вызывают их явно
+os.environ["STOCK_SNAPSHOT_INTERVAL_SECONDS"] = "0"
+os.environ["OPERATIONS_GROUP_COMMIT"] = "0"
+# Бюджеты SQL-команд эндпоинтов (querydebug.query_budget) проверяются строго: превышение - ответ 500
+os.environ["QUERY_DEBUG"] = "1"
+os.environ["QUERY_DEBUG_STRICT"] = "1"
+
+# Все таблицы с данными; schema_version и table_versions заполняются миграциями и не очищаются
+DATA_TABLES = (
+    "change_log", "stock_snapshots", "stock_ledger", "location_stock", "operations",
+    "items", "location_tree", "locations", "users",
+)
+
+
+def run(coro):
+    """
+    Выполняет корутину в новом event loop. Соединения asyncpg привязаны к своему циклу,
+    поэтому после каждого вызова пул движка закрывается.
+    """
+    from database import async_engine
+
+    async def wrapper():
+        try:
+            return await coro
+        finally:
+            await async_engine.dispose()
+    return asyncio.run(wrapper())
+
+
+@pytest.fixture(scope="session")
+def database_ready():
+    from sqlalchemy import text
+    from sqlalchemy.exc import DBAPIError
+    from database import async_engine
+    from config import settings
+    import migrations
+
+    if not settings.DB_NAME.endswith("_test"):
+        pytest.skip(f"Имя тестовой БД должно оканчиваться на _test, задано {settings.DB_NAME}")
+
+    async def connect():
+        async with async_engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+    try:
+        run(connect())
+    except (OSError, DBAPIError) as e:
+        # Нет сервера, нет БД или неверный пароль: тесты пропускаются, а ошибки миграций ниже - нет
+        pytest.skip(f"Тестовая БД недоступна: {e}")
+    run(migrations.upgrade(async_engine))
+
+
+@pytest.fixture
+def db(database_ready):
+    """Пустая БД со схемой последней версии и пустые кэши процесса."""
+    from sqlalchemy import text
+    from database import async_engine
+    from cache import item_cache, response_cache, user_cache
+
+    async def truncate():
+        async with async_engine.begin() as conn:
+            await conn.execute(text(f"TRUNCATE {', '.join(DATA_TABLES)} RESTART IDENTITY CASCADE"))
+    run(truncate())
+    for cache in (user_cache, item_cache, response_cache):
+        cache.clear()
+    yield
+
+
+@pytest.fixture
+def seed(db):
+    """Администратор, локация и товар: {"user": ..., "location": ..., "item": ...}."""
+    from database import async_session_factory
+    from models import UserRole
+    from schemas import ItemCreateSchema, LocationCreateSchema, UserCreateSchema
+    import requests as rq
+
+    async def create():
+        async with async_session_factory() as session:
+            user = await rq.register_new_user(UserCreateSchema(tg_id=1001, username="tester", role=UserRole.admin), session)
+            await session.commit()
+        async with async_session_factory() as session:
+            location = await rq.create_new_location(LocationCreateSchema(name="A-01", description="Стеллаж A"), session)
+            await session.commit()
+        async with async_session_factory() as session:
+            item = await rq.create_item(ItemCreateSchema(
+                code="4600000000017", name="Коробка", weight=2, quantity=10, location_id=location.id, description="",
+            ), user.tg_id, session)
+            await session.commit()
+        return {"user": user, "location": location, "item": item}
+    return run(create())
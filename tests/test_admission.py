@@ -0,0 +1,69 @@
+"""
+Контроль допуска: счетчики отказов и место, выданное одновременно с таймаутом ожидания.
+"""
+import asyncio
+
+import pytest
+
+import admission
+import main
+
+
+def _controller(max_wait=0.05):
+    return admission.AdmissionController(1, {name: (1, 1) for name in admission.PRIORITY}, max_wait)
+
+
+def test_rejected_and_timed_out_are_counted():
+    controller = _controller()
+
+    async def scenario():
+        await controller.acquire(admission.READ)
+        waiter = asyncio.create_task(controller.acquire(admission.READ))
+        await asyncio.sleep(0)
+        # Очередь класса (1 место) занята ожидающим
+        with pytest.raises(admission.Overloaded):
+            await controller.acquire(admission.READ)
+        with pytest.raises(admission.Overloaded):
+            await waiter
+
+    asyncio.run(scenario())
+    stats = controller.stats()["classes"][admission.READ]
+    assert (stats["admitted"], stats["rejected"], stats["timed_out"], stats["active"]) == (1, 1, 1, 1)
+
+
+def test_slot_granted_at_timeout_is_kept(monkeypatch):
+    controller = _controller()
+
+    async def granted_at_timeout(awaitable, timeout):
+        # Место освобождается в той же итерации цикла, в которой истекает ожидание
+        controller.release(admission.READ)
+        awaitable.cancel()
+        raise asyncio.TimeoutError()
+
+    async def scenario():
+        await controller.acquire(admission.READ)
+        monkeypatch.setattr(admission.asyncio, "wait_for", granted_at_timeout)
+        await controller.acquire(admission.READ)
+
+    asyncio.run(scenario())
+    stats = controller.stats()["classes"][admission.READ]
+    assert (stats["admitted"], stats["timed_out"], stats["active"]) == (2, 0, 1)
+    assert controller.active == 1
+
+
+def test_metrics_export_admission_counters(monkeypatch):
+    monkeypatch.setattr(main.admission_controller.classes[admission.SCAN], "rejected", 3)
+    monkeypatch.setattr(main.admission_controller.classes[admission.HEAVY], "timed_out", 2)
+    body = asyncio.run(main.metrics_endpoint()).body.decode()
+    assert "# TYPE admission_rejected_total counter" in body
+    assert 'admission_rejected_total{class="scan"} 3' in body
+    assert 'admission_timed_out_total{class="heavy"} 2' in body
+
+
+def test_default_limit_leaves_connections_for_background_tasks():
+    from config import settings
+
+    # В тестах из фоновых задач включены сверка версий кэшей и рассылка событий остатков
+    assert main.background_connections == 2
+    assert main.admission_total + main.background_connections == settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW
+    assert main.admission_controller.total_limit == main.admission_total
@@ -0,0 +1,110 @@
+"""
+Импорт товаров (importer.py): отклоненные строки и пачки, попавшие в гонку с другими записями.
+"""
+import io
+import threading
+
+from conftest import run
+from database import async_session_factory
+from schemas import ItemCreateSchema
+import importer
+import location_stock
+import requests as rq
+
+HEADER = "code,name,weight,quantity,location_id,description\n"
+
+
+def _import(seed, rows, **kwargs):
+    data = (HEADER + "".join(f"{row}\n" for row in rows)).encode()
+    return run(importer.import_items(io.BytesIO(data), "csv", seed["user"].id, **kwargs))
+
+
+def test_copy_conflict_rejects_the_chunk(seed, monkeypatch):
+    location = seed["location"]
+    write_items = importer.ItemImporter._write_items
+
+    async def racing_write(self, session, items):
+        # Код занимает параллельный запрос после проверки пачки, но до COPY
+        async with async_session_factory() as other:
+            await rq.create_item(ItemCreateSchema(
+                code=items[0].code, name="Гонка", weight=1, quantity=1, location_id=location.id, description="",
+            ), seed["user"].tg_id, other)
+            await other.commit()
+        await write_items(self, session, items)
+
+    monkeypatch.setattr(importer.ItemImporter, "_write_items", racing_write)
+    report = _import(seed, [f"4600000000031,Лента,1,5,{location.id},", f"4600000000048,Пленка,2,3,{location.id},"])
+
+    assert (report.processed, report.imported, report.rejected) == (2, 0, 2)
+    assert all("Ошибка базы данных при записи пачки" in reject.error for reject in report.rejects)
+
+    async def summary():
+        async with async_session_factory() as session:
+            return await location_stock.location_summary(session, location.id)
+    # В агрегате только товар из seed и товар параллельного запроса
+    assert run(summary()).item_count == 2
+
+
+def test_file_is_parsed_off_the_event_loop(seed, monkeypatch):
+    threads = set()
+    read_chunk = importer.ItemImporter._read_chunk
+
+    def recording_read(self, records):
+        threads.add(threading.current_thread())
+        return read_chunk(self, records)
+
+    monkeypatch.setattr(importer.ItemImporter, "_read_chunk", recording_read)
+    location_id = seed["location"].id
+    report = _import(seed, [f"46000000001{n:02d},Товар,1,1,{location_id}," for n in range(5)], chunk_size=2)
+
+    assert report.imported == 5
+    assert threads and threading.main_thread() not in threads
+
+
+def test_invalid_rows_are_rejected_with_their_lines(seed):
+    location_id, existing = seed["location"].id, seed["item"].code
+    report = _import(seed, [
+        f"4600000000055,Лента,1,5,{location_id},",
+        f"4600000000062,Пленка,тяжелая,3,{location_id},",
+        f"{existing},Коробка,2,1,{location_id},",
+        f"4600000000079,Скотч,1,1,{location_id + 100},",
+        f"4600000000086,Пакет,1,2,{location_id},",
+        # Повтор кода из предыдущей пачки файла (chunk_size=2)
+        f"4600000000055,Лента,1,1,{location_id},",
+        f"4600000000093,,1,1,{location_id},",
+    ], chunk_size=2)
+
+    assert (report.processed, report.imported, report.rejected) == (7, 2, 5)
+    # Строка 1 - заголовок CSV
+    rejects = {reject.line: (reject.code, reject.error) for reject in report.rejects}
+    assert [reject.line for reject in report.rejects] == [3, 4, 5, 7, 8]
+    assert rejects[3][0] == "4600000000062" and rejects[3][1].startswith("weight:")
+    assert rejects[4] == (existing, "Товар с таким кодом уже существует.")
+    assert rejects[5] == ("4600000000079", "Указанная локация не найдена.")
+    assert rejects[7] == ("4600000000055", "Код повторяется в файле.")
+    assert rejects[8][0] == "4600000000093" and rejects[8][1].startswith("name:")
+
+    async def stored():
+        async with async_session_factory() as session:
+            return [
+                (await rq.scan_item_by_code(code, session))["status"]
+                for code in ("4600000000055", "4600000000086", "4600000000062", "4600000000079")
+            ]
+    assert run(stored()) == ["exists", "exists", "not_found", "not_found"]
+
+
+def test_malformed_ndjson_lines_are_rejected(seed):
+    location_id = seed["location"].id
+    data = "\n".join([
+        '{"code": "4600000000109", "name": "Лента", "weight": 1, "quantity": 5, "location_id": %d}' % location_id,
+        '{"code": "4600000000116", "name": ',
+        '["4600000000123"]',
+        "",
+        '{"code": "4600000000130", "name": "Пакет", "weight": 1, "quantity": 1, "location_id": %d}' % location_id,
+    ]).encode()
+    report = run(importer.import_items(io.BytesIO(data), "ndjson", seed["user"].id))
+
+    assert (report.processed, report.imported, report.rejected) == (4, 2, 2)
+    assert [(reject.line, reject.code) for reject in report.rejects] == [(2, None), (3, None)]
+    assert report.rejects[0].error.startswith("Некорректный JSON")
+    assert report.rejects[1].error == "Строка должна быть объектом."
@@ -0,0 +1,64 @@
+"""
+item_cache и записи товаров в другом воркере: следующий скан после сверки версии items видит запись.
+"""
+import asyncio
+
+from sqlalchemy import delete, update
+
+from conftest import run
+from cache import item_cache
+from database import async_session_factory
+from models import ItemORM
+import requests as rq
+
+
+async def _scan(code):
+    async with async_session_factory() as session:
+        return await rq.scan_item_by_code(code, session)
+
+
+async def _remote_write(statement):
+    # Другой воркер: запись в items без хуков after-commit этого процесса
+    async with async_session_factory() as session:
+        await session.execute(statement)
+        await session.commit()
+
+
+def test_remote_write_is_seen_by_next_scan(seed):
+    item = seed["item"]
+
+    async def scenario():
+        watch = asyncio.create_task(rq.watch_cache_versions(0.05))
+        try:
+            await asyncio.sleep(0.1)
+            assert (await _scan(item.code))["item"].quantity == 10
+            assert item_cache.get(item.code)[0]
+            await _remote_write(update(ItemORM).where(ItemORM.id == item.id).values(quantity=4))
+            await asyncio.sleep(0.2)
+            shipped = await _scan(item.code)
+            await _remote_write(delete(ItemORM).where(ItemORM.id == item.id))
+            await asyncio.sleep(0.2)
+            return shipped, await _scan(item.code)
+        finally:
+            watch.cancel()
+
+    shipped, deleted = run(scenario())
+    assert shipped["item"].quantity == 4
+    assert deleted["status"] == "not_found"
+
+
+def test_scan_started_before_reset_is_not_cached(seed):
+    code = seed["item"].code
+    item_cache.clear()
+
+    async def scenario():
+        async with async_session_factory() as session:
+            await session.connection()
+            scan = asyncio.create_task(rq.scan_item_by_code(code, session))
+            await asyncio.sleep(0)
+            # Сброс кэша происходит, пока SELECT товара еще выполняется
+            item_cache.clear()
+            assert (await scan)["status"] == "exists"
+
+    run(scenario())
+    assert item_cache.get(code) == (False, None)
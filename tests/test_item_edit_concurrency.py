@@ -0,0 +1,54 @@
+"""
+Правка товара через PUT параллельно с операцией по тому же товару.
+
+update_item читает товар под FOR UPDATE, поэтому дельта в журнале остатков и в location_stock
+считается от состояния после зафиксированной операции, а не от прочитанного до нее.
+"""
+import asyncio
+
+from sqlalchemy import func, select
+
+from conftest import run
+from database import async_session_factory
+from main import AdaptedOperationCreateSchema
+from models import ItemORM, OperationType, StockLedgerORM
+from schemas import ItemUpdateSchema
+import location_stock
+import requests as rq
+
+
+def test_update_item_waits_for_concurrent_operation(seed):
+    item, user = seed["item"], seed["user"]
+
+    async def scenario():
+        async with async_session_factory() as operation_session, async_session_factory() as edit_session:
+            # Отгрузка держит блокировку строки товара до COMMIT
+            await rq.process_operation(AdaptedOperationCreateSchema(
+                item_id=item.id, type=OperationType.ship, note="", quantity=3,
+            ), user.tg_id, operation_session)
+
+            async def edit():
+                result = await rq.update_item(item.id, ItemUpdateSchema(quantity=20), edit_session)
+                await edit_session.commit()
+                return result
+            edit_task = asyncio.create_task(edit())
+            await asyncio.sleep(0.3)
+            assert not edit_task.done(), "update_item должен ждать блокировку строки товара"
+
+            await operation_session.commit()
+            edited = await asyncio.wait_for(edit_task, 10)
+            assert edited.quantity == 20
+
+        async with async_session_factory() as session:
+            entries = (await session.scalars(
+                select(StockLedgerORM).where(StockLedgerORM.item_id == item.id).order_by(StockLedgerORM.id)
+            )).all()
+            items_total = await session.scalar(select(func.sum(ItemORM.quantity)))
+            stock = await location_stock.location_summary(session, item.location_id)
+        return entries, items_total, stock
+
+    entries, items_total, stock = run(scenario())
+
+    assert [(entry.delta, entry.quantity_after) for entry in entries] == [(10, 10), (-3, 7), (13, 20)]
+    assert items_total == 20
+    assert (stock.item_count, stock.total_quantity, stock.total_weight) == (1, 20, 40)
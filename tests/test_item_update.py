@@ -0,0 +1,37 @@
+"""
+Правка товара через update_item: занятый код отклоняется с 400, кэш сканирования не меняется.
+"""
+import pytest
+from fastapi import HTTPException
+
+from cache import item_cache
+from conftest import run
+from database import async_session_factory
+from schemas import ItemCreateSchema, ItemUpdateSchema
+import requests as rq
+
+
+def test_update_item_rejects_taken_code(seed):
+    item, user = seed["item"], seed["user"]
+
+    async def scenario():
+        async with async_session_factory() as session:
+            other = await rq.create_item(ItemCreateSchema(
+                code="4600000000024", name="Лента", weight=1, quantity=5, location_id=item.location_id, description="",
+            ), user.tg_id, session)
+            await session.commit()
+        async with async_session_factory() as session:
+            with pytest.raises(HTTPException) as rejected:
+                await rq.update_item(other.id, ItemUpdateSchema(code=item.code, quantity=1), session)
+            await session.rollback()
+        async with async_session_factory() as session:
+            stored = await rq.get_item_by_id(other.id, session)
+        return other, rejected.value, stored
+
+    other, rejected, stored = run(scenario())
+
+    assert rejected.status_code == 400
+    assert rejected.detail == "Товар с таким кодом уже существует."
+    assert (stored.code, stored.quantity) == (other.code, other.quantity)
+    assert item_cache.get(item.code) == (True, item)
+    assert item_cache.get(other.code) == (True, other)
@@ -0,0 +1,74 @@
+"""
+Имя локации уникально среди соседей (ix_locations_parent_id_name), корневые локации - тоже соседи.
+"""
+import pytest
+from fastapi import HTTPException
+
+from conftest import run
+from database import async_session_factory
+from schemas import LocationCreateSchema, LocationUpdateSchema
+import requests as rq
+
+
+async def _create(name, parent_id=None):
+    async with async_session_factory() as session:
+        location = await rq.create_new_location(LocationCreateSchema(name=name, description="", parent_id=parent_id), session)
+        await session.commit()
+        return location
+
+
+async def _update(location_id, **values):
+    async with async_session_factory() as session:
+        location = await rq.update_existing_location(location_id, LocationUpdateSchema(**values), session)
+        await session.commit()
+        return location
+
+
+def test_same_name_under_different_parents(seed):
+    root = seed["location"]
+
+    async def scenario():
+        other = await _create("B-01")
+        first = await _create("1", root.id)
+        second = await _create("1", other.id)
+        return first, second
+
+    first, second = run(scenario())
+    assert (first.name, second.name) == ("1", "1")
+    assert first.parent_id != second.parent_id
+
+
+@pytest.mark.parametrize("parent", [True, False])
+def test_duplicate_sibling_rejected(seed, parent):
+    parent_id = seed["location"].id if parent else None
+
+    async def scenario():
+        await _create("1", parent_id)
+        await _create("1", parent_id)
+
+    with pytest.raises(HTTPException) as error:
+        run(scenario())
+    assert error.value.status_code == 400
+    assert error.value.detail == rq.LOCATION_NAME_TAKEN
+
+
+def test_update_into_taken_name_rejected(seed):
+    root = seed["location"]
+
+    async def scenario():
+        other = await _create("B-01")
+        await _create("1", root.id)
+        moved = await _create("1", other.id)
+        renamed = await _create("2", root.id)
+        errors = []
+        for location_id, values in ((moved.id, {"parent_id": root.id}), (renamed.id, {"name": "1"})):
+            try:
+                await _update(location_id, **values)
+            except HTTPException as e:
+                errors.append((e.status_code, e.detail))
+        # Переименование в свободное имя и перенос без конфликта проходят
+        await _update(renamed.id, name="3")
+        await _update(moved.id, parent_id=None)
+        return errors
+
+    assert run(scenario()) == [(400, rq.LOCATION_NAME_TAKEN)] * 2
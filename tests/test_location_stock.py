@@ -0,0 +1,54 @@
+"""
+Шарды location_stock: параллельные записи в одну локацию не ждут друг друга, сводки суммируют шарды.
+"""
+import asyncio
+
+from sqlalchemy import func, select
+
+from conftest import run
+from database import async_session_factory
+from main import AdaptedOperationCreateSchema
+from models import ItemORM, LocationStockORM, OperationType
+from schemas import ItemCreateSchema
+import location_stock
+import location_tree
+import requests as rq
+
+
+def test_concurrent_writes_to_one_location(seed):
+    item, user, location = seed["item"], seed["user"], seed["location"]
+
+    async def scenario():
+        async with async_session_factory() as session:
+            other = await rq.create_item(ItemCreateSchema(
+                code="4600000000048", name="Пленка", weight=3, quantity=2, location_id=location.id, description="",
+            ), user.tg_id, session)
+            await session.commit()
+
+        async with async_session_factory() as slow_session:
+            await rq.process_operation(AdaptedOperationCreateSchema(
+                item_id=item.id, type=OperationType.ship, note="", quantity=1,
+            ), user.tg_id, slow_session)
+            async with async_session_factory() as session:
+                await rq.process_operation(AdaptedOperationCreateSchema(
+                    item_id=other.id, type=OperationType.receive, note="", quantity=5,
+                ), user.tg_id, session)
+                await asyncio.wait_for(session.commit(), 5)
+            await slow_session.commit()
+
+        async with async_session_factory() as session:
+            shards = await session.scalar(
+                select(func.count()).select_from(LocationStockORM).where(LocationStockORM.location_id == location.id)
+            )
+            items = (await session.execute(
+                select(func.count(), func.sum(ItemORM.quantity), func.sum(ItemORM.quantity * ItemORM.weight))
+            )).one()
+            summary = await location_stock.location_summary(session, location.id)
+            subtree = await location_tree.subtree_summary(session, location.id)
+        return shards, tuple(items), summary, subtree
+
+    shards, items, summary, subtree = run(scenario())
+
+    assert shards > 1
+    assert (summary.item_count, summary.total_quantity, summary.total_weight) == items == (2, 16, 39)
+    assert (subtree.location_count, subtree.item_count, subtree.total_quantity) == (1, 2, 16)
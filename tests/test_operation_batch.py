@@ -0,0 +1,131 @@
+"""
+Пакет операций (apply_operations): строки по одному товару применяются по порядку, отказ строки
+не меняет состояние товара для следующих строк, строки товаров блокируются в порядке id.
+"""
+import asyncio
+
+import pytest
+from sqlalchemy import func, select, text
+from sqlalchemy.exc import DBAPIError
+
+from conftest import run
+from database import async_session_factory
+from main import AdaptedOperationCreateSchema
+from models import ItemORM, OperationORM, OperationType, StockLedgerORM
+from schemas import ItemCreateSchema, LocationCreateSchema
+import location_stock
+import requests as rq
+
+
+def _line(item_id, type_, quantity=0, **kwargs):
+    return AdaptedOperationCreateSchema(item_id=item_id, type=type_, note="", quantity=quantity, **kwargs)
+
+
+async def _batch(lines, tg_id):
+    async with async_session_factory() as session:
+        result = await rq.process_operations_batch(lines, tg_id, session)
+        await session.commit()
+        return result
+
+
+def test_lines_for_same_item_apply_in_order(seed):
+    item, user = seed["item"], seed["user"]
+
+    async def scenario():
+        result = await _batch([
+            _line(item.id, OperationType.ship, 8),
+            _line(item.id, OperationType.receive, 5),
+            _line(item.id, OperationType.ship, 20), # остаток 7: отказ, остаток не меняется
+            _line(item.id, OperationType.ship, 6),
+            _line(item.id, OperationType.inventory, 4),
+        ], user.tg_id)
+        async with async_session_factory() as session:
+            entries = (await session.execute(
+                select(StockLedgerORM.delta, StockLedgerORM.quantity_after)
+                .where(StockLedgerORM.item_id == item.id).order_by(StockLedgerORM.id)
+            )).all()
+            quantity = await session.scalar(select(ItemORM.quantity).where(ItemORM.id == item.id))
+            stock = await location_stock.location_summary(session, item.location_id)
+        return result, entries, quantity, stock
+
+    result, entries, quantity, stock = run(scenario())
+
+    assert [line.status for line in result.results] == ["ok", "ok", "error", "ok", "ok"]
+    assert (result.results[2].status_code, result.results[2].error) == (400, "Недостаточно товара для отгрузки.")
+    # Первая строка журнала - приемка при создании товара
+    assert [tuple(entry) for entry in entries] == [(10, 10), (-8, 2), (5, 7), (-6, 1), (3, 4)]
+    assert quantity == 4
+    assert (stock.item_count, stock.total_quantity) == (1, 4)
+
+
+def test_rejected_lines_are_reported_per_row(seed):
+    item, user, location = seed["item"], seed["user"], seed["location"]
+
+    async def scenario():
+        async with async_session_factory() as session:
+            target = await rq.create_new_location(LocationCreateSchema(name="B-01", description=""), session)
+            await session.commit()
+        result = await _batch([
+            _line(item.id + 100, OperationType.receive, 1),
+            _line(item.id, OperationType.move, to_location_id=location.id),
+            _line(item.id, OperationType.move, to_location_id=target.id + 100),
+            _line(item.id, OperationType.move, from_location_id=target.id, to_location_id=target.id),
+            _line(item.id, OperationType.move, from_location_id=location.id, to_location_id=target.id),
+        ], user.tg_id)
+        async with async_session_factory() as session:
+            operations = await session.scalar(select(func.count(OperationORM.id)).where(OperationORM.item_id == item.id))
+            stored = await session.scalar(select(ItemORM.location_id).where(ItemORM.id == item.id))
+        return target, result, operations, stored
+
+    target, result, operations, stored = run(scenario())
+
+    assert (result.succeeded, result.failed) == (1, 4)
+    assert [(line.index, line.status_code) for line in result.results if line.status == "error"] == [
+        (0, 404), (1, 400), (2, 404), (3, 400),
+    ]
+    assert result.results[4].operation.type == OperationType.move
+    # Приемка при создании и единственное успешное перемещение
+    assert (operations, stored) == (2, target.id)
+
+
+def test_items_are_locked_in_id_order(seed):
+    first, user = seed["item"], seed["user"]
+
+    async def scenario():
+        async with async_session_factory() as session:
+            second = await rq.create_item(ItemCreateSchema(
+                code="4600000000024", name="Лента", weight=1, quantity=5, location_id=first.location_id, description="",
+            ), user.tg_id, session)
+            await session.commit()
+        async with async_session_factory() as holder, async_session_factory() as batch_session:
+            # Другой пакет держит строку второго товара
+            await rq.process_operations_batch([_line(second.id, OperationType.receive, 1)], user.tg_id, holder)
+
+            async def batch():
+                # Строки в обратном порядке id: блокировки все равно берутся от меньшего id к большему
+                result = await rq.process_operations_batch([
+                    _line(second.id, OperationType.ship, 2), _line(first.id, OperationType.ship, 3),
+                ], user.tg_id, batch_session)
+                await batch_session.commit()
+                return result
+            batch_task = asyncio.create_task(batch())
+            await asyncio.sleep(0.3)
+            assert not batch_task.done(), "пакет должен ждать строку второго товара"
+
+            # Первый товар пакет уже заблокировал, хотя его строка идет второй
+            async with async_session_factory() as probe:
+                with pytest.raises(DBAPIError):
+                    await probe.execute(text("SELECT id FROM items WHERE id = :id FOR UPDATE NOWAIT"), {"id": first.id})
+
+            await holder.commit()
+            result = await asyncio.wait_for(batch_task, 5)
+        async with async_session_factory() as session:
+            quantities = dict((await session.execute(
+                select(ItemORM.id, ItemORM.quantity).where(ItemORM.id.in_([first.id, second.id]))
+            )).all())
+        return second, result, quantities
+
+    second, result, quantities = run(scenario())
+
+    assert (result.succeeded, result.failed) == (2, 0)
+    assert quantities == {first.id: 7, second.id: 4}
@@ -0,0 +1,45 @@
+"""
+Журнал операций get_operations_page: от новых к старым, операции одного пакета (одинаковый created_at)
+упорядочены по id и не теряются на границе страниц, фильтры сохраняются между страницами.
+"""
+from conftest import run
+from database import async_session_factory
+from main import AdaptedOperationCreateSchema
+from models import OperationType
+import requests as rq
+
+
+async def _log_pages(limit, **filters):
+    pages, cursor = [], None
+    async with async_session_factory() as session:
+        while True:
+            page = await rq.get_operations_page(session, limit, cursor, **filters)
+            pages.append([(operation.id, operation.type) for operation in page.items])
+            cursor = page.next_cursor
+            if cursor is None:
+                return pages
+
+
+def test_log_pages_through_equal_timestamps(seed):
+    item, user = seed["item"], seed["user"]
+
+    async def scenario():
+        # Один пакет - одна транзакция: у всех его операций один created_at
+        async with async_session_factory() as session:
+            await rq.process_operations_batch([
+                AdaptedOperationCreateSchema(item_id=item.id, type=type_, note="", quantity=1)
+                for type_ in (OperationType.ship, OperationType.receive, OperationType.ship, OperationType.receive)
+            ], user.tg_id, session)
+            await session.commit()
+        return await _log_pages(2), await _log_pages(1, op_type=OperationType.ship)
+
+    pages, ships = run(scenario())
+
+    walked = [entry for page in pages for entry in page]
+    # Четыре операции пакета по убыванию id, затем приемка при создании товара
+    assert [type_ for _, type_ in walked] == [
+        OperationType.receive, OperationType.ship, OperationType.receive, OperationType.ship, OperationType.receive,
+    ]
+    assert [operation_id for operation_id, _ in walked] == sorted((operation_id for operation_id, _ in walked), reverse=True)
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert [entry for page in ships for entry in page] == [entry for entry in walked if entry[1] == OperationType.ship]
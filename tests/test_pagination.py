@@ -0,0 +1,84 @@
+"""
+Keyset-пагинация paginate: смешанные направления сортировки, одинаковые значения ключей
+и курсор, привязанный к сортировке.
+"""
+import pytest
+from fastapi import HTTPException
+
+from conftest import run
+from database import async_session_factory
+from models import ItemORM
+from pagination import PageParams, paginate
+from schemas import ItemCreateSchema
+import requests as rq
+
+FIELDS = ("id", "name", "weight")
+SORTABLE = ("id", "name", "weight", "quantity")
+
+
+def _desc(text):
+    # Ключ sorted для строки по убыванию (названия - по одной букве)
+    return tuple(-ord(char) for char in text)
+
+
+async def _create_items(seed):
+    # Повторяющиеся названия и веса: порядок внутри одинаковых значений решает id
+    async with async_session_factory() as session:
+        for n, (name, weight) in enumerate([("Б", 3), ("А", 1), ("Б", 1), ("А", 3), ("Б", 3), ("В", 2), ("А", 1)]):
+            await rq.create_item(ItemCreateSchema(
+                code=f"46200000000{n:02d}", name=name, weight=weight, quantity=1,
+                location_id=seed["location"].id, description="",
+            ), seed["user"].tg_id, session)
+        await session.commit()
+
+
+async def _pages(sort, limit):
+    pages, cursor = [], None
+    async with async_session_factory() as session:
+        while True:
+            rows, cursor = await paginate(
+                session, ItemORM, PageParams(limit=limit, cursor=cursor, sort=sort, fields=None),
+                allowed_fields=FIELDS, sortable=SORTABLE,
+            )
+            pages.append(rows)
+            if cursor is None:
+                return pages
+
+
+@pytest.mark.parametrize("sort, key", [
+    ("name,-weight", lambda row: (row["name"], -row["weight"], -row["id"])),
+    ("-name,weight", lambda row: (_desc(row["name"]), row["weight"], row["id"])),
+    ("-weight,name,id", lambda row: (-row["weight"], row["name"], row["id"])),
+    ("weight,-id", lambda row: (row["weight"], -row["id"])),
+])
+@pytest.mark.parametrize("limit", [1, 2, 3])
+def test_mixed_directions_walk_every_row_once(seed, sort, key, limit):
+    async def scenario():
+        await _create_items(seed)
+        return await _pages(sort, limit), await _pages(sort, 100)
+
+    pages, (everything,) = run(scenario())
+
+    walked = [row for page in pages for row in page]
+    assert walked == sorted(everything, key=key)
+    assert len(walked) == 8
+    assert all(len(page) == limit for page in pages[:-1])
+
+
+def test_cursor_is_bound_to_its_sort(seed):
+    async def scenario():
+        await _create_items(seed)
+        async with async_session_factory() as session:
+            _, cursor = await paginate(
+                session, ItemORM, PageParams(limit=2, cursor=None, sort="name,-weight", fields=None),
+                allowed_fields=FIELDS, sortable=SORTABLE,
+            )
+            with pytest.raises(HTTPException) as rejected:
+                await paginate(
+                    session, ItemORM, PageParams(limit=2, cursor=cursor, sort="-name,weight", fields=None),
+                    allowed_fields=FIELDS, sortable=SORTABLE,
+                )
+        return rejected.value
+
+    rejected = run(scenario())
+    assert (rejected.status_code, rejected.detail) == (400, "Курсор не соответствует параметрам сортировки.")
@@ -0,0 +1,90 @@
+"""
+Горячие эндпоинты по HTTP с QUERY_DEBUG_STRICT: превышение query_budget возвращает 500 с отчетом.
+Запросы идут с пустыми кэшами (худший случай) и повторно с заполненными.
+"""
+import httpx
+import pytest
+
+from conftest import run
+from cache import item_cache, user_cache
+from main import app
+
+TG_ID = 1001
+
+
+@pytest.fixture
+def cold(seed):
+    """Данные seed без кэшированных пользователя и товара: запросы идут по худшему пути."""
+    user_cache.clear()
+    item_cache.clear()
+    return seed
+
+
+async def _request(method, url, **kwargs):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.request(method, url, params={"tg_id": TG_ID}, **kwargs)
+    assert response.status_code == 200, response.text
+    assert "x-query-count" in response.headers
+    return response
+
+
+def test_scan_within_budget(cold):
+    code = cold["item"].code
+
+    async def scenario():
+        first = await _request("GET", f"/api/items/scan/{code}")
+        warm = await _request("GET", f"/api/items/scan/{code}")
+        missing = await _request("GET", "/api/items/scan/4600000000994")
+        return first, warm, missing
+
+    first, warm, missing = run(scenario())
+    assert int(first.headers["x-query-count"]) == 2
+    assert first.json()["status"] == "exists"
+    assert int(warm.headers["x-query-count"]) == 0
+    assert missing.json()["status"] == "not_found"
+
+
+def test_create_item_within_budget(cold):
+    response = run(_request("POST", "/api/items", json={
+        "code": "4600000000024", "name": "Лента", "weight": 1, "quantity": 5,
+        "location_id": cold["location"].id, "description": "",
+    }))
+    assert response.json()["quantity"] == 5
+
+
+@pytest.mark.parametrize("operation", [
+    {"type": "receive", "quantity": 5},
+    {"type": "ship", "quantity": 3},
+    {"type": "inventory", "quantity": 7},
+    {"type": "move", "quantity": 0},
+])
+def test_operation_within_budget(cold, operation):
+    item = cold["item"]
+
+    async def scenario():
+        payload = {"item_id": item.id, "note": "", **operation}
+        if operation["type"] == "move":
+            target = await _request("POST", "/api/locations", json={"name": "B-01", "description": ""})
+            payload.update(from_location_id=item.location_id, to_location_id=target.json()["id"])
+        return await _request("POST", "/api/operations", json=payload)
+
+    assert run(scenario()).json()["type"] == operation["type"]
+
+
+def test_read_endpoint_does_not_hold_auth_connection(cold, monkeypatch):
+    """Авторизация с промахом кэша не держит соединение primary, пока эндпоинт читает данные."""
+    from database import async_engine
+    import requests as rq
+
+    checked_out = []
+    get_item_by_id = rq.get_item_by_id
+
+    async def spy(item_id, session):
+        checked_out.append(async_engine.pool.checkedout())
+        return await get_item_by_id(item_id, session)
+
+    monkeypatch.setattr(rq, "get_item_by_id", spy)
+    response = run(_request("GET", f"/api/items/{cold['item'].id}"))
+    assert response.json()["id"] == cold["item"].id
+    # Единственное занятое соединение - сессия чтения эндпоинта (версии для ETag уже прочитаны)
+    assert checked_out == [1]
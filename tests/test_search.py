@@ -0,0 +1,45 @@
+"""
+Поиск товаров: короткий запрос оценивает ограниченный набор кандидатов, страницы курсора согласованы.
+"""
+from conftest import run
+from database import async_session_factory
+from schemas import ItemCreateSchema
+import requests as rq
+import search
+
+
+async def _create_items(seed, count):
+    ids = []
+    for n in range(count):
+        async with async_session_factory() as session:
+            item = await rq.create_item(ItemCreateSchema(
+                code=f"46100000000{n:02d}", name=f"Лента {n}", weight=1, quantity=1,
+                location_id=seed["location"].id, description="",
+            ), seed["user"].tg_id, session)
+            await session.commit()
+            ids.append(item.id)
+    return ids
+
+
+async def _all_pages(query, limit):
+    pages, cursor = [], None
+    async with async_session_factory() as session:
+        while True:
+            rows, cursor = await search.search_items(session, query, limit, cursor)
+            pages.append([row["id"] for row in rows])
+            if cursor is None:
+                return pages
+
+
+def test_broad_query_scores_limited_candidates(seed, monkeypatch):
+    monkeypatch.setattr(search, "SEARCH_CANDIDATE_LIMIT", 3)
+
+    async def scenario():
+        ids = await _create_items(seed, 4)
+        return ids, await _all_pages("46", 2), await _all_pages("4610", 10)
+
+    ids, broad, full = run(scenario())
+    # Все коды начинаются с "46" (оценка 1.0): кандидаты - первые три совпадения по id, товар seed и два новых
+    assert broad == [[seed["item"].id, ids[0]], [ids[1]]]
+    # Запрос длиннее BROAD_QUERY_LENGTH не ограничивается
+    assert len(full[0]) == 4
@@ -0,0 +1,93 @@
+"""
+Single-flight: одновременные вызовы с одним ключом делят одно выполнение и его результат или исключение,
+отмена первого вызова не отменяет ожидающих, результат не кэшируется.
+"""
+import asyncio
+
+import pytest
+
+from conftest import run
+from database import async_session_factory
+from singleflight import SingleFlight, reads
+import requests as rq
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+
+    async def work(key):
+        calls.append(key)
+        await asyncio.sleep(0.05)
+        return object()
+
+    async def scenario():
+        first = await asyncio.gather(*(flight.do("a", lambda: work("a")) for _ in range(3)), flight.do("b", lambda: work("b")))
+        # Завершенный вызов не кэшируется: следующий снова выполняет работу
+        again = await flight.do("a", lambda: work("a"))
+        return first, again
+
+    (a1, a2, a3, b), again = asyncio.run(scenario())
+
+    assert a1 is a2 is a3 and a1 is not b and again is not a1
+    assert calls == ["a", "b", "a"]
+    assert flight.stats() == {"in_flight": 0, "executed": 3, "shared": 2, "shared_ratio": 0.4}
+
+
+def test_waiters_get_the_same_exception():
+    flight = SingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0.05)
+        raise ValueError("нет соединения")
+
+    async def scenario():
+        return await asyncio.gather(flight.do("a", failing), flight.do("a", failing), return_exceptions=True)
+
+    first, second = asyncio.run(scenario())
+
+    assert isinstance(first, ValueError) and second is first
+    assert flight.stats()["executed"] == 1
+
+
+def test_cancelled_leader_does_not_cancel_waiters():
+    flight = SingleFlight()
+    started = []
+
+    async def work():
+        started.append(len(started))
+        await asyncio.sleep(0.05)
+        return len(started)
+
+    async def scenario():
+        leader = asyncio.create_task(flight.do("a", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("a", work))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    # Ожидающий выполняет работу сам
+    assert asyncio.run(scenario()) == 2
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_concurrent_item_reads_share_one_query(seed):
+    item_id = seed["item"].id
+
+    async def read():
+        async with async_session_factory() as session:
+            return await rq.get_item_by_id(item_id, session)
+
+    async def scenario():
+        before = reads.stats()
+        items = await asyncio.gather(read(), read(), read())
+        after = reads.stats()
+        return items, after["executed"] - before["executed"], after["shared"] - before["shared"]
+
+    items, executed, shared = run(scenario())
+
+    assert items[0] is items[1] is items[2]
+    assert (executed, shared) == (1, 2)
@@ -0,0 +1,44 @@
+"""
+Обработчики SQL-команд метрик, профилирования и отладки запросов: упавшая команда снимает
+свою отметку начала в conn.info и попадает в хронологию и отчет.
+"""
+import time
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from conftest import run
+from database import async_engine
+import metrics # noqa: F401 - обработчики метрик регистрируются при импорте
+import profiling
+import querydebug
+
+MARKS = ("metrics_started", "profiling_started", "querydebug_started")
+
+
+def test_failed_statement_clears_start_marks(database_ready):
+    querydebug.install()
+    profiling._install_sql_listeners()
+
+    async def scenario():
+        trace = querydebug.QueryTrace()
+        timeline = profiling.SQLTimeline(time.perf_counter())
+        trace_token = querydebug._current_trace.set(trace)
+        timeline_token = profiling._current_timeline.set(timeline)
+        try:
+            async with async_engine.connect() as conn:
+                with pytest.raises(DBAPIError):
+                    await conn.execute(text("SELECT 1 / 0"))
+                await conn.rollback()
+                marks = {name: list(conn.info.get(name, ())) for name in MARKS}
+        finally:
+            querydebug._current_trace.reset(trace_token)
+            profiling._current_timeline.reset(timeline_token)
+        return marks, trace, timeline
+
+    marks, trace, timeline = run(scenario())
+
+    assert marks == {name: [] for name in MARKS}
+    assert [sql for sql, _, _ in trace.statements] == ["SELECT 1 / 0"]
+    assert [statement["sql"] for statement in timeline.statements] == ["SELECT 1 / 0"]
@@ -0,0 +1,56 @@
+"""
+Остатки на момент времени: снимок плюс журнал после него, фильтр по локации и страницы по item_id.
+"""
+from datetime import datetime, timedelta
+
+from conftest import run
+from database import async_session_factory
+from main import AdaptedOperationCreateSchema
+from models import OperationType
+from pagination import PageParams
+from schemas import ItemCreateSchema, LocationCreateSchema
+import ledger
+import requests as rq
+
+
+def test_stock_at_merges_snapshot_with_ledger(seed):
+    item, user, location = seed["item"], seed["user"], seed["location"]
+
+    async def scenario():
+        await ledger.take_snapshot()
+        async with async_session_factory() as session:
+            other_location = await rq.create_new_location(LocationCreateSchema(name="B-01", description=""), session)
+            await session.commit()
+        async with async_session_factory() as session:
+            # Товар после снимка есть только в журнале
+            created = await rq.create_item(ItemCreateSchema(
+                code="4600000000031", name="Скотч", weight=1, quantity=7, location_id=location.id, description="",
+            ), user.tg_id, session)
+            await session.commit()
+        for op_data in (
+            AdaptedOperationCreateSchema(item_id=item.id, type=OperationType.ship, note="", quantity=4),
+            AdaptedOperationCreateSchema(
+                item_id=item.id, type=OperationType.move, note="", quantity=0, to_location_id=other_location.id,
+            ),
+        ):
+            async with async_session_factory() as session:
+                await rq.process_operation(op_data, user.tg_id, session)
+                await session.commit()
+
+        async with async_session_factory() as session:
+            at = datetime.now() + timedelta(seconds=1)
+            first = await ledger.stock_at(session, at, PageParams(limit=1, cursor=None, sort=None, fields=None))
+            second = await ledger.stock_at(session, at, PageParams(limit=1, cursor=first.next_cursor, sort=None, fields=None))
+            in_location = await ledger.stock_at(
+                session, at, PageParams(limit=10, cursor=None, sort=None, fields=None), location_id=location.id,
+            )
+        return created, other_location, first, second, in_location
+
+    created, other_location, first, second, in_location = run(scenario())
+
+    assert [point.model_dump() for point in first.items + second.items] == [
+        {"item_id": item.id, "quantity": 6, "location_id": other_location.id},
+        {"item_id": created.id, "quantity": 7, "location_id": location.id},
+    ]
+    assert first.next_cursor and second.next_cursor is None
+    assert [point.item_id for point in in_location.items] == [created.id]
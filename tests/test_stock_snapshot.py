@@ -0,0 +1,74 @@
+"""
+Снимок остатков не блокирует запись: он ждет только транзакции, начатые до него.
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from conftest import run
+from database import async_session_factory
+from main import AdaptedOperationCreateSchema
+from models import OperationType
+from pagination import PageParams
+from schemas import ItemCreateSchema
+import ledger
+import requests as rq
+
+
+def test_snapshot_does_not_block_writers(seed):
+    item, user = seed["item"], seed["user"]
+
+    async def write_new_item():
+        async with async_session_factory() as session:
+            created = await rq.create_item(ItemCreateSchema(
+                code="4600000000031", name="Скотч", weight=1, quantity=7, location_id=item.location_id, description="",
+            ), user.tg_id, session)
+            await rq.process_operation(AdaptedOperationCreateSchema(
+                item_id=created.id, type=OperationType.ship, note="", quantity=2,
+            ), user.tg_id, session)
+            await session.commit()
+
+    async def scenario():
+        await ledger.take_snapshot()
+        async with async_session_factory() as slow_session:
+            # Транзакция, начатая до снимка: ее строку журнала снимок должен учесть
+            await rq.process_operation(AdaptedOperationCreateSchema(
+                item_id=item.id, type=OperationType.ship, note="", quantity=1,
+            ), user.tg_id, slow_session)
+            snapshot = asyncio.create_task(ledger.take_snapshot())
+            await asyncio.sleep(0.2)
+            assert not snapshot.done()
+            # Запись после начала снимка не ждет его
+            await asyncio.wait_for(write_new_item(), 5)
+            await slow_session.commit()
+        taken = await asyncio.wait_for(snapshot, 5)
+
+        async with async_session_factory() as session:
+            at = datetime.now() + timedelta(seconds=1)
+            stock = await ledger.stock_at(session, at, PageParams(limit=10, cursor=None, sort=None, fields=None))
+        return taken, stock
+
+    taken, stock = run(scenario())
+
+    assert taken.taken_at is not None and taken.items == 1
+    assert stock.snapshot_taken_at == taken.taken_at
+    assert [(point.item_id, point.quantity) for point in stock.items] == [(item.id, 9), (item.id + 1, 5)]
+
+
+def test_operation_does_not_wait_for_key_share(seed):
+    item, user = seed["item"], seed["user"]
+
+    async def scenario():
+        async with async_session_factory() as snapshot_session:
+            # Так строку товара блокирует проверка внешнего ключа при вставке строк снимка
+            await snapshot_session.execute(
+                text("SELECT id FROM items WHERE id = :id FOR KEY SHARE"), {"id": item.id}
+            )
+            async with async_session_factory() as session:
+                await asyncio.wait_for(rq.process_operation(AdaptedOperationCreateSchema(
+                    item_id=item.id, type=OperationType.ship, note="", quantity=1,
+                ), user.tg_id, session), 5)
+                await session.commit()
+
+    run(scenario())
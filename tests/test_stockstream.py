@@ -0,0 +1,88 @@
+"""
+Рассылка событий остатков: подписка на локацию видит поддерево, события доходят до других воркеров
+через LISTEN/NOTIFY. Второй воркер - отдельный StockBroker со своей задачей run().
+"""
+import asyncio
+import contextlib
+import json
+
+from conftest import run
+from database import async_session_factory
+from schemas import ItemUpdateSchema, LocationCreateSchema
+import requests as rq
+import stockstream
+
+
+async def _start(broker):
+    task = asyncio.create_task(broker.run())
+    while not broker.stats()["relaying"]:
+        await asyncio.sleep(0.01)
+    return task
+
+
+async def _stop(*tasks):
+    for task in tasks:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+
+async def _move(item_id, location_id):
+    async with async_session_factory() as session:
+        await rq.update_item(item_id, ItemUpdateSchema(location_id=location_id), session)
+        await session.commit()
+
+
+async def _next(subscription):
+    return json.loads(await asyncio.wait_for(subscription.queue.get(), 5))
+
+
+def test_location_subscription_sees_subtree(seed):
+    root, item = seed["location"], seed["item"]
+
+    async def scenario():
+        async with async_session_factory() as session:
+            shelf = await rq.create_new_location(LocationCreateSchema(name="1", description="", parent_id=root.id), session)
+            await session.commit()
+        async with async_session_factory() as session:
+            cell = await rq.create_new_location(LocationCreateSchema(name="1", description="", parent_id=shelf.id), session)
+            await session.commit()
+        task = await _start(stockstream.broker)
+        subscription = stockstream.broker.subscribe(location_ids=[root.id])
+        try:
+            await _move(item.id, cell.id)
+            return cell, await _next(subscription)
+        finally:
+            stockstream.broker.unsubscribe(subscription)
+            await _stop(task)
+
+    cell, event = run(scenario())
+    assert (event["type"], event["id"], event["location_id"]) == ("item", item.id, cell.id)
+
+
+def test_events_reach_other_workers_once(seed):
+    root, item = seed["location"], seed["item"]
+
+    async def scenario():
+        async with async_session_factory() as session:
+            target = await rq.create_new_location(LocationCreateSchema(name="B-01", description=""), session)
+            await session.commit()
+        other = stockstream.StockBroker()
+        tasks = [await _start(stockstream.broker), await _start(other)]
+        local = stockstream.broker.subscribe(item_ids=[item.id])
+        remote = other.subscribe(location_ids=[root.id])
+        try:
+            await _move(item.id, target.id)
+            events = await _next(local), await _next(remote)
+            # Собственное уведомление воркер пропускает: второго события у локального подписчика нет
+            await asyncio.sleep(0.2)
+            return target, events, local.queue.qsize(), other.stats()["received"]
+        finally:
+            stockstream.broker.unsubscribe(local)
+            other.unsubscribe(remote)
+            await _stop(*tasks)
+
+    target, (local_event, remote_event), left, received = run(scenario())
+    assert local_event == remote_event
+    assert (remote_event["location_id"], remote_event["previous_location_id"]) == (target.id, root.id)
+    assert (left, received) == (0, 1)
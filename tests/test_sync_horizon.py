@@ -0,0 +1,45 @@
+"""
+Запись журнала изменений не ждет чужих транзакций, а синхронизация не перешагивает номер seq
+транзакции, которая еще не зафиксирована.
+"""
+import asyncio
+
+from conftest import run
+from database import async_session_factory
+from schemas import ItemUpdateSchema
+import changes
+import requests as rq
+
+
+def test_sync_stops_before_uncommitted_lower_seq(seed):
+    item, location = seed["item"], seed["location"]
+
+    async def scenario():
+        async with async_session_factory() as session:
+            baseline = (await changes.sync_changes(session, 0)).next_since
+
+        async with async_session_factory() as slow_session:
+            # Медленная транзакция получает меньший номер и не фиксируется до конца сценария
+            await rq.update_item(item.id, ItemUpdateSchema(name="Коробка большая"), slow_session)
+            await slow_session.run_sync(changes._write_change_log)
+
+            # Писатель с большим номером не ждет медленную транзакцию
+            async with async_session_factory() as session:
+                await rq.update_existing_location(location.id, rq.LocationUpdateSchema(description="Ряд 2"), session)
+                await asyncio.wait_for(session.commit(), 5)
+
+            async with async_session_factory() as session:
+                during = await changes.sync_changes(session, baseline)
+            await slow_session.commit()
+
+        async with async_session_factory() as session:
+            after = await changes.sync_changes(session, baseline)
+        return baseline, during, after
+
+    baseline, during, after = run(scenario())
+
+    assert during.next_since == baseline
+    assert during.items == [] and during.locations == [] and not during.has_more
+    assert [row["id"] for row in after.items] == [item.id]
+    assert [row["id"] for row in after.locations] == [location.id]
+    assert after.next_since > baseline
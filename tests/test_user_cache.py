@@ -0,0 +1,52 @@
+"""
+Сброс user_cache после изменения пользователя в другом воркере (версия users в table_versions).
+"""
+import asyncio
+
+from sqlalchemy import update
+
+from conftest import run
+from cache import user_cache
+from database import async_session_factory
+from models import UserORM
+import requests as rq
+
+
+def test_change_from_another_worker_resets_cache(seed):
+    tg_id = seed["user"].tg_id
+
+    async def scenario():
+        watch = asyncio.create_task(rq.watch_cache_versions(0.05))
+        try:
+            await asyncio.sleep(0.1)
+            async with async_session_factory() as session:
+                assert (await rq.fetch_auth_user(tg_id, session)).is_active
+            assert user_cache.get(tg_id)[0]
+            # Другой воркер: запись в users без сброса кэша этого процесса
+            async with async_session_factory() as session:
+                await session.execute(update(UserORM).where(UserORM.tg_id == tg_id).values(is_active=False))
+                await session.commit()
+            await asyncio.sleep(0.2)
+            async with async_session_factory() as session:
+                return await rq.fetch_auth_user(tg_id, session)
+        finally:
+            watch.cancel()
+
+    assert run(scenario()).is_active is False
+
+
+def test_read_started_before_reset_is_not_cached(seed):
+    tg_id = seed["user"].tg_id
+
+    async def scenario():
+        async with async_session_factory() as session:
+            await session.connection()
+            fetch = asyncio.create_task(rq.fetch_auth_user(tg_id, session))
+            await asyncio.sleep(0)
+            # Сброс кэша происходит, пока SELECT пользователя еще выполняется
+            user_cache.clear()
+            assert (await fetch).is_active
+
+    user_cache.clear()
+    run(scenario())
+    assert user_cache.get(tg_id) == (False, None)
@@ -0,0 +1,93 @@
+"""
+Групповая фиксация (OperationWritePipeline): каждый вызывающий получает результат своей строки пакета,
+ошибка пакета отклоняет все его операции и не останавливает конвейер.
+"""
+import asyncio
+
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from conftest import run
+from database import async_session_factory
+from main import AdaptedOperationCreateSchema
+from models import ItemORM, OperationType
+from write_pipeline import OperationWritePipeline
+import requests as rq
+
+
+def _line(item_id, type_, quantity):
+    return AdaptedOperationCreateSchema(item_id=item_id, type=type_, note="", quantity=quantity)
+
+
+async def _submit_all(pipeline, user, lines):
+    return await asyncio.gather(
+        *(pipeline.submit(line, user.id, user.tg_id) for line in lines), return_exceptions=True,
+    )
+
+
+async def _quantity(item_id):
+    async with async_session_factory() as session:
+        return await session.scalar(select(ItemORM.quantity).where(ItemORM.id == item_id))
+
+
+def test_each_caller_gets_its_own_outcome(seed):
+    item, user = seed["item"], seed["user"]
+
+    async def scenario():
+        pipeline = OperationWritePipeline(max_batch=10, max_delay_ms=100, queue_size=10)
+        pipeline.start()
+        try:
+            outcomes = await _submit_all(pipeline, user, [
+                _line(item.id, OperationType.ship, 4),
+                _line(item.id, OperationType.ship, 100),
+                _line(item.id + 100, OperationType.receive, 1),
+                _line(item.id, OperationType.receive, 2),
+            ])
+        finally:
+            await pipeline.stop()
+        return outcomes, pipeline.stats(), await _quantity(item.id)
+
+    outcomes, stats, quantity = run(scenario())
+
+    shipped, too_much, unknown, received = outcomes
+    assert (shipped.type, received.type) == (OperationType.ship, OperationType.receive)
+    assert isinstance(too_much, HTTPException) and too_much.status_code == 400
+    assert isinstance(unknown, HTTPException) and unknown.status_code == 404
+    assert (stats["batches"], stats["max_batch"]) == (1, 4)
+    assert quantity == 8
+
+
+def test_failed_batch_rejects_every_caller(seed, monkeypatch):
+    item, user = seed["item"], seed["user"]
+    apply_operations = rq.apply_operations
+    failures = [RuntimeError("сбой записи")]
+
+    async def failing_apply(entries, session):
+        outcomes = await apply_operations(entries, session)
+        if failures:
+            raise failures.pop()
+        return outcomes
+
+    monkeypatch.setattr(rq, "apply_operations", failing_apply)
+
+    async def scenario():
+        pipeline = OperationWritePipeline(max_batch=10, max_delay_ms=100, queue_size=10)
+        pipeline.start()
+        try:
+            failed = await _submit_all(pipeline, user, [
+                _line(item.id, OperationType.ship, 1), _line(item.id, OperationType.ship, 100),
+            ])
+            after_failure = await _quantity(item.id)
+            # Конвейер продолжает работать после отказа пакета
+            retried = await pipeline.submit(_line(item.id, OperationType.ship, 1), user.id, user.tg_id)
+        finally:
+            await pipeline.stop()
+        return failed, after_failure, retried, pipeline.stats(), await _quantity(item.id)
+
+    failed, after_failure, retried, stats, quantity = run(scenario())
+
+    assert all(isinstance(outcome, HTTPException) and outcome.status_code == 500 for outcome in failed)
+    assert after_failure == 10
+    assert retried.type == OperationType.ship
+    assert (stats["batches"], stats["failed_batches"]) == (2, 1)
+    assert quantity == 9